@@ -1,7 +1,13 @@
 #!/usr/bin/python3
 
-from . import corrosion_maps
+import importlib
 
 __all__ = ["corrosion_maps","eqstreamcomp"]
 
 __version__ = "0.2.0"
+
+#The modules are imported on first access (ccstoolkit.corrosion_maps), so importing one doesn't import the other
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.'+name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import io
+import os
+import copy
+import json
+import weakref
+import importlib
+import contextlib
+
+from . import _parallel
+
+#asyncio is imported by the functions that use it, only the async entry points need it
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Settings
+#===================================================================================================================
+#The settings are read from the environment with the first request, not at the import
+_defaults = {
+    'workers': os.cpu_count() or 1,                            #Processes of the pool
+    'max_pending': 64                                          #Distinct requests submitted at once
+}
+
+_variables = {
+    'workers': 'CCSTOOLKIT_ASYNC_WORKERS',
+    'max_pending': 'CCSTOOLKIT_ASYNC_MAX_PENDING'
+}
+
+#One pool for all async entry points. The workers import the modules once and build their own tables.
+_modules = ('ccstoolkit.eqstreamcomp.composition', 'ccstoolkit.corrosion_maps.stability_maps')
+
+_dispatchers = weakref.WeakKeyDictionary()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Private methods
+#===================================================================================================================
+#The setting from its environment variable (or the default if it isn't set); a positive integer
+def _setting(name: str):
+    value = os.environ.get(_variables[name], '').strip()
+    if not value:
+        return _defaults[name]
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value<1:
+        raise ValueError(f'${_variables[name]} must be a positive integer, not {os.environ[_variables[name]]!r}.')
+    return value
+
+#Runs in the worker: call function (given as 'module.name'). The messages are not printed to the stdout of the service.
+def _call(function: str, x0, kwargs: dict):
+    module, name = function.rsplit('.', 1)
+    function = getattr(importlib.import_module(module), name)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(x0, **kwargs)
+
+#Requests in flight of one event loop. Identical requests share one job; at most max_pending jobs are submitted.
+class _Dispatcher:
+    def __init__(self, max_pending: int):
+        import asyncio
+        self.slots = asyncio.Semaphore(max_pending)
+        self.inflight = dict()                                 #key: [task, number of waiters]
+
+    #Wait for a slot (backpressure), then for the worker
+    async def run(self, function: str, x0, kwargs: dict):
+        import asyncio
+        async with self.slots:
+            pool = _parallel._get_pool(_setting('workers'), _modules)
+            #Cancelling the task cancels the job, if it hasn't started yet
+            return await asyncio.wrap_future(pool.submit(_call, function, x0, kwargs))
+
+    def forget(self, key, entry):
+        if key is not None and self.inflight.get(key) is entry:
+            del self.inflight[key]
+
+#The dispatcher of the running event loop
+def _get_dispatcher():
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if loop not in _dispatchers:
+        _dispatchers[loop] = _Dispatcher(_setting('max_pending'))
+    return _dispatchers[loop]
+
+#Key of a request; None if the input can't be serialized (such requests are not coalesced)
+def _key(function: str, x0, kwargs: dict):
+    try:
+        return json.dumps([function, x0, sorted(kwargs.items())], sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+#Await function(x0, **kwargs) in the pool. timeout in [s], None - no deadline.
+#A waiter that is cancelled or times out leaves the job to the other waiters; the job is cancelled with the last one.
+async def _submit(function: str, x0, kwargs: dict, timeout: float = None):
+    import asyncio
+    dispatcher = _get_dispatcher()
+    key = _key(function, x0, kwargs)
+
+    entry = dispatcher.inflight.get(key) if key is not None else None
+    if entry is None:
+        entry = [asyncio.get_running_loop().create_task(dispatcher.run(function, x0, kwargs)), 0]
+        entry[0].add_done_callback(lambda _, key=key, entry=entry: dispatcher.forget(key, entry))
+        if key is not None:
+            dispatcher.inflight[key] = entry
+
+    entry[1] += 1
+    try:
+        result = await asyncio.wait_for(asyncio.shield(entry[0]), timeout)
+    finally:
+        entry[1] -= 1
+        if not entry[1] and not entry[0].done():
+            dispatcher.forget(key, entry)
+            entry[0].cancel()
+
+    #The waiters of a coalesced request get their own copy
+    return copy.deepcopy(result)
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import json
+import math
+import itertools
+import threading
+import numpy as np
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Settings
+#===================================================================================================================
+#Layout of an atlas file: the magic, the length of the header (8 bytes, little endian), the header (JSON) and the
+#arrays, each starting at a multiple of _alignment bytes. The header has the offsets, types and shapes of the arrays.
+_magic = b'CCSATLAS'
+_alignment = 64
+
+_atlases = dict()                                              #Open atlases by path, with the time and size of the file
+_lock = threading.Lock()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------File
+#===================================================================================================================
+def _aligned(size: int):
+    return -(-size//_alignment)*_alignment
+
+#Write the header (a dict that can be written as JSON) and the arrays to one file. The file is written next to path
+#and renamed, so a reader never sees a partial atlas.
+def _write(path: str, header: dict, arrays: dict):
+    arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+
+    layout, offset = dict(), 0
+    for key, value in arrays.items():
+        layout[key] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset}
+        offset += _aligned(value.nbytes)
+
+    text = json.dumps(header | {'arrays': layout}).encode()
+    start = _aligned(len(_magic)+8+len(text))
+
+    with open(path+'.tmp', 'wb') as f:
+        f.write(_magic+len(text).to_bytes(8, 'little')+text)
+        for key, value in arrays.items():
+            f.seek(start+layout[key]['offset'])
+            f.write(value.tobytes())
+        f.truncate(start+offset)
+    os.replace(path+'.tmp', path)
+
+    return start+offset
+
+#Open an atlas: the header and the arrays as read-only views of one memory map (the pages are shared between the
+#processes that open the same file). Returns None if the file is not an atlas.
+def _open(path: str):
+    with open(path, 'rb') as f:
+        head = f.read(len(_magic)+8)
+        if len(head)<len(_magic)+8 or head[:len(_magic)]!=_magic:
+            return None
+        length = int.from_bytes(head[len(_magic):], 'little')
+        header = json.loads(f.read(length))
+
+    start = _aligned(len(_magic)+8+length)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {key: np.ndarray(tuple(item['shape']), dtype=np.dtype(item['dtype']), buffer=data, offset=start+item['offset']) for key, item in header.pop('arrays').items()}
+
+    return {'header': header, 'arrays': arrays}
+
+#The open atlas of path (_open), None if there is no atlas; opened again when the file changes. prepare(atlas) is
+#called once per opening.
+def _get_atlas(path: str, prepare=None):
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if path not in _atlases or _atlases[path][0]!=key:
+            atlas = _open(path)
+            if atlas is not None and prepare is not None:
+                prepare(atlas)
+            _atlases[path] = (key, atlas)
+        return _atlases[path][1]
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Grid
+#===================================================================================================================
+#The axes of the grid are [{'key': ..., 'min': ..., 'max': ..., 'n': ..., 'scale': 'log' or 'linear'}, ...]; the nodes
+#are numbered in C order (the last axis changes fastest).
+
+#The values of the nodes on an axis; the first and the last are exactly min and max (not 10**lg(min), ...)
+def _axis_values(axis: dict):
+    if axis['scale']=='log':
+        values = np.logspace(np.log10(axis['min']), np.log10(axis['max']), axis['n'])
+    else:
+        values = np.linspace(axis['min'], axis['max'], axis['n'])
+    values[[0, -1]] = axis['min'], axis['max']
+    return values
+
+#The values of the nodes of the grid, {key: array (nodes,)}
+def _grid_values(axes: list):
+    values = np.meshgrid(*[_axis_values(axis) for axis in axes], indexing='ij')
+    return {axis['key']: value.ravel() for axis, value in zip(axes, values)}
+
+#The position of a value on an axis in steps of the grid, from 0 to n-1
+def _coordinate(axis: dict, value: float):
+    if axis['n']<2 or axis['max']==axis['min']:
+        return 0.0
+    f = math.log10 if axis['scale']=='log' else float
+    u = (f(value)-f(axis['min']))/(f(axis['max'])-f(axis['min']))
+    return min(max(u, 0.0), 1.0)*(axis['n']-1)
+
+#The index of the node nearest to the values (one per axis)
+def _nearest(axes: list, values: list):
+    index = 0
+    for axis, value in zip(axes, values):
+        index = index*axis['n']+int(math.floor(_coordinate(axis, value)+0.5))
+    return index
+
+#The nodes of the cell of the grid around the values and their weights (multilinear interpolation in the coordinates
+#of the grid). The nodes with a zero weight are left out, e.g. a single node with weight 1 if the values are a node.
+def _cell(axes: list, values: list):
+    lows, ts = list(), list()
+    for axis, value in zip(axes, values):
+        u = _coordinate(axis, value)
+        low = min(int(u), max(axis['n']-2, 0))
+        lows.append(low)
+        ts.append(u-low)
+
+    nodes, weights = list(), list()
+    for corner in itertools.product([0, 1], repeat=len(axes)):
+        weight, index = 1.0, 0
+        for axis, low, t, c in zip(axes, lows, ts, corner):
+            weight *= t if c else 1-t
+            index = index*axis['n']+low+c
+        if weight>0:
+            nodes.append(index)
+            weights.append(weight)
+
+    return nodes, weights
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import json
+import math
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from ._substances import get_substances_TD_data
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Settings
+#===================================================================================================================
+_defaults = {
+    'path': os.path.join(os.environ.get('CCSTOOLKIT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ccstoolkit')), 'cache.sqlite'),
+    'maxsize': 1024,                                           #Number of results in the in-memory tier
+    'max_bytes': 64*2**20,                                     #Size of the on-disk tier
+    'digits': None                                             #Significant digits of the inputs; None - no quantization
+}
+
+_caches = dict()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Private methods
+#===================================================================================================================
+#Hash of the thermodynamic data. The data is a mutable dict, so the hash is recomputed for every lookup.
+def _TD_hash():
+    data = json.dumps(get_substances_TD_data(), sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+#Round to a number of significant digits
+def _quantize(value: float, digits: int):
+    if digits is None or value == 0 or not math.isfinite(value):
+        return float(value)
+    return round(float(value), digits-1-math.floor(math.log10(abs(value))))
+
+#Two-tier cache: an LRU of pickled results in memory and a sqlite table on disk, evicted by size
+class _Cache:
+    def __init__(self, path: str, maxsize: int, max_bytes: int, digits: int):
+        self.path, self.maxsize, self.max_bytes, self.digits = path, maxsize, max_bytes, digits
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection, self._pid = None, None
+        self._td = None
+
+    #One connection per process; a forked worker opens its own
+    def _connect(self):
+        import sqlite3
+        if self._connection is None or self._pid != os.getpid():
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, td TEXT, value BLOB, size INTEGER, atime REAL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    #Drop everything computed with other thermodynamic data
+    def _invalidate(self, td: str):
+        if td != self._td:
+            self._memory.clear()
+            self._connect().execute('DELETE FROM results WHERE td != ?', (td,))
+            self._td = td
+
+    def _evict(self):
+        connection = self._connect()
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total > self.max_bytes:
+            #Evict the least recently used results down to 90% of the limit
+            excess = total-int(0.9*self.max_bytes)
+            rows = connection.execute('SELECT key, size FROM results ORDER BY atime').fetchall()
+            keys = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+            connection.executemany('DELETE FROM results WHERE key = ?', keys)
+
+    #Canonical (and quantized) copy of the input
+    def canonical(self, x0: dict):
+        return {key: _quantize(value, self.digits) for key, value in sorted(x0.items())}
+
+    def key(self, name: str, x0: dict, **kwargs):
+        td = _TD_hash()
+        data = json.dumps([name, x0, sorted(kwargs.items())], sort_keys=True)
+        return td, hashlib.sha256((td+data).encode()).hexdigest()
+
+    def get(self, td: str, key: str):
+        with self._lock:
+            self._invalidate(td)
+
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return pickle.loads(self._memory[key])
+
+            connection = self._connect()
+            row = connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE results SET atime = ? WHERE key = ?', (time.time(), key))
+            self._remember(key, row[0])
+
+        return pickle.loads(row[0])
+
+    def set(self, td: str, key: str, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._invalidate(td)
+            self._remember(key, blob)
+
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (key, td, blob, len(blob), time.time()))
+            self._evict()
+
+    def _remember(self, key: str, blob: bytes):
+        self._memory[key] = blob
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._connect().execute('DELETE FROM results')
+
+#cache = True (default settings) or a dict with some of the keys of _defaults. Returns None if caching is off.
+def _get_cache(cache):
+    if not cache:
+        return None
+
+    settings = _defaults | (cache if isinstance(cache, dict) else dict())
+    key = tuple(settings[key] for key in _defaults)
+    if key not in _caches:
+        _caches[key] = _Cache(**{key: settings[key] for key in _defaults})
+    return _caches[key]
+
+#Call function(x0, **kwargs) through the cache. The function is evaluated on the canonical input, so hits
+#and misses return the same result. Failed calls (-1) are not stored.
+def _cached(name: str, function, x0: dict, cache, **kwargs):
+    cache = _get_cache(cache)
+    if cache is None or not isinstance(x0, dict):
+        return function(x0, **kwargs)
+
+    try:
+        x0 = cache.canonical(x0)
+    except (TypeError, ValueError):
+        return function(x0, **kwargs)
+
+    td, key = cache.key(name, x0, **kwargs)
+    value = cache.get(td, key)
+    if value is None:
+        value = function(x0, **kwargs)
+        if not isinstance(value, int):
+            cache.set(td, key, value)
+
+    return value
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import numpy as np
+
+from . import _line_logic
+from . import _sweep
+
+#One classifier per map (lines), kept between the calls
+_classifiers = dict()
+
+#Cells kept per map; all are dropped when there are more
+_maxsize = 1024
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Cells
+#===================================================================================================================
+#The regions of points (x, y) of one map for many P at once. The topology of a map only changes where an event
+#function (_sweep._event_matrix) changes its sign, so the P with the same signs of all event functions (a cell) have
+#the same regions, bounded by the same lines. The regions of a cell are found once, with each vertex as the
+#intersection of two lines (or sides of the bounding box); for the other P of the cell only the vertices are
+#calculated from the intercepts, all rows at once, and the points are located in the polygons.
+class _Classifier:
+    def __init__(self, lines: dict, x_bounds: tuple, y_bounds: tuple, names):
+        self.lines, self.x_bounds, self.y_bounds = lines, x_bounds, y_bounds
+        self.names = names                                     #names(bounds ids of the regions) -> [(region, name)]
+        self.ids = list(lines.keys())
+        self.matrix = _sweep._event_matrix(lines, x_bounds, y_bounds)
+
+        #The slopes of the lines of the event matrix: the lines of the map, the extra lines and the sides of the box
+        compiled = _line_logic._compile_map(lines)
+        self.box = len(self.ids)+len(self.matrix['extra'])
+        self.b = np.concatenate([compiled['b'], [ref['slopes'][0] for ref in self.matrix['extra']], [1, 1, 0, 0]]).astype(float)
+        self.c = np.concatenate([compiled['c'], [ref['slopes'][1] for ref in self.matrix['extra']], [0, 0, 1, 1]]).astype(float)
+
+        #---------------------------Cached regions by the signs of the event functions---------------------------
+        self.cells = dict()
+        self.walks = 0                                         #Number of cells found
+
+    #The line (row of the event matrix) of a segment of a face, the sides of the box have ids '<side><k>'
+    def _line(self, id_: str):
+        return self.box+int(id_[0]) if id_.isdigit() else self.ids.index(id_)
+
+    #Two lines that meet at the vertex p (a = intercepts at the P of p): the lines of its edges, or another line through
+    #p where the edges are on one line (a line ending on another or on a side of the box)
+    def _vertex(self, p: tuple, edges: tuple, a):
+        i, j = [self._line(id_) for id_ in edges]
+        if i!=j and abs(self.b[i]*self.c[j]-self.b[j]*self.c[i])>=1e-9:
+            return i, j
+
+        residual = np.abs(a+self.b*p[0]+self.c*p[1])
+        residual[self.box-len(self.matrix['extra']):self.box] = np.inf                  #The extra lines are not drawn
+        residual[np.abs(self.b[i]*self.c-self.b*self.c[i])<1e-9] = np.inf
+        return i, int(np.argmin(residual))
+
+    #The regions of the cell of P (a = intercepts): for each, the name, the pairs of lines of the vertices (V, 2) and the
+    #edges on a line of the map (the borders with other regions, not with the box). None if the vertices can't be
+    #reproduced from the pairs of lines.
+    def _cell(self, P: dict, a):
+        regions = _line_logic._get_regions(self.lines, P, self.x_bounds, self.y_bounds)
+
+        cell = list()
+        for r, name in self.names(tuple(tuple(region['bounds ids']) for region in regions)):
+            ids, points = regions[r]['bounds ids'], regions[r]['points'][:-1]
+            pairs = np.array([self._vertex(p, (ids[k-1], ids[k]), a) for k, p in enumerate(points)], dtype=int)
+            cell.append({'name': name, 'pairs': pairs, 'border': np.array([not id_.isdigit() for id_ in ids], dtype=bool)})
+
+            if np.max(np.abs(self._vertices(pairs, a[:, None])[..., 0]-np.array(points).T), initial=0)>1e-5:
+                return None
+
+        self.walks += 1
+        return cell
+
+    #The coordinates (x, y) of the vertices (V, n) of pairs of lines for the intercepts a (lines, n)
+    def _vertices(self, pairs, a):
+        i, j = pairs[:, 0], pairs[:, 1]
+        det = (self.b[i]*self.c[j]-self.b[j]*self.c[i])[:, None]
+        return np.array([(self.c[i][:, None]*a[j]-self.c[j][:, None]*a[i])/det, -(self.b[i][:, None]*a[j]-self.b[j][:, None]*a[i])/det])
+
+    #The regions of the points (x, y) in the regions of the cell for the intercepts a (lines, n): the names ('' outside
+    #of the regions) and the distances to the nearest border with another region (inf if there is none)
+    def _locate(self, cell: list, a, x, y):
+        names = np.full(len(x), '', dtype=object)
+        margins = np.full(len(x), np.nan)
+        found = np.zeros(len(x), dtype=bool)
+        for region in cell:
+            X, Y = self._vertices(region['pairs'], a)                                    #(V, n)
+            X1, Y1 = np.roll(X, -1, axis=0), np.roll(Y, -1, axis=0)
+
+            #Crossing number of a ray to the right of each point
+            with np.errstate(invalid='ignore', divide='ignore'):
+                crosses = ((Y>y) != (Y1>y)) & (x < X+(y-Y)*(X1-X)/(Y1-Y))
+            inside = ~found & (np.sum(crosses, axis=0)%2==1)
+            if not np.any(inside):
+                continue
+            found |= inside
+
+            #Distance to the edges of the region on the lines of the map
+            X, Y, X1, Y1 = [value[region['border']][:, inside] for value in [X, Y, X1, Y1]]
+            dx, dy = X1-X, Y1-Y
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = np.clip(np.nan_to_num(((x[inside]-X)*dx+(y[inside]-Y)*dy)/(dx**2+dy**2)), 0, 1)
+            names[inside] = region['name']
+            margins[inside] = np.min(np.hypot(X+t*dx-x[inside], Y+t*dy-y[inside]), axis=0, initial=np.inf)
+
+        return names, margins
+
+    #The regions of the points (x, y) for the columns of P = {key: array (n,)}: the names ('' outside of the map) and the
+    #distances to the nearest border with another region (NaN outside of the map)
+    def classify(self, P: dict, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        names = np.full(len(x), '', dtype=object)
+        margins = np.full(len(x), np.nan)
+
+        a = _sweep._intercepts(self.lines, self.matrix, P)                                #(lines, n)
+        with np.errstate(invalid='ignore'):
+            inside = np.all(np.isfinite(a), axis=0) & (self.x_bounds[0]<=x) & (x<=self.x_bounds[1]) & (self.y_bounds[0]<=y) & (y<=self.y_bounds[1])
+        rows = np.flatnonzero(inside)
+        if not len(rows):
+            return names, margins
+
+        #The signs of the event functions as bits. The rows of a time series are mostly in the cell of the row before,
+        #so the rows are grouped by runs with the same signs.
+        signs = np.sign(self.matrix['M'] @ a[:, rows]).T
+        bits = np.packbits(np.concatenate([signs>0, signs<0], axis=1), axis=1)
+        starts = np.flatnonzero(np.concatenate([[True], np.any(bits[1:]!=bits[:-1], axis=1)]))
+        groups = dict()
+        for start, stop in zip(starts, np.append(starts[1:], len(rows))):
+            groups.setdefault(bits[start].tobytes(), []).append(rows[start:stop])
+
+        for key, group in groups.items():
+            group = np.concatenate(group)
+            if key not in self.cells:
+                if len(self.cells)>=_maxsize:
+                    self.cells.clear()
+                self.cells[key] = self._cell({k: value[group[0]] for k, value in P.items()}, a[:, group[0]])
+
+            #A cell whose vertices can't be found from the lines: each P on its own
+            cells = [(self.cells[key], group)] if self.cells[key] is not None else [(self._cell({k: value[r] for k, value in P.items()}, a[:, r]), [r]) for r in group]
+            for cell, group in cells:
+                if cell is not None:
+                    names[group], margins[group] = self._locate(cell, a[:, group], x[group], y[group])
+
+        return names, margins
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#The classifier of a map (lines), created with the first call
+def _get_classifier(lines: dict, x_bounds: tuple, y_bounds: tuple, names):
+    key = (id(lines), tuple(x_bounds), tuple(y_bounds))
+    if key not in _classifiers or _classifiers[key].lines is not lines:
+        _classifiers[key] = _Classifier(lines, x_bounds, y_bounds, names)
+    return _classifiers[key]
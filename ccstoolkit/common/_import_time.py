@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import sys
+import subprocess
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Settings
+#===================================================================================================================
+#Statements timed in a fresh interpreter: the imports and the first map (the cold start of a worker)
+_statements = {
+    'numpy': 'import numpy',
+    'ccstoolkit': 'import ccstoolkit',
+    'corrosion_maps': 'import ccstoolkit.corrosion_maps',
+    'eqstreamcomp': 'import ccstoolkit.eqstreamcomp',
+    'corrosion_maps.cli': 'import ccstoolkit.corrosion_maps.cli',
+    'eqstreamcomp.cli': 'import ccstoolkit.eqstreamcomp.cli',
+    'first map': "from ccstoolkit import corrosion_maps; corrosion_maps.get_stability_maps({'S': 0.5, 'N': 0.75})"
+}
+
+_timer = '''
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter()-start)
+'''
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#Time a statement in a fresh interpreter; the smallest of repeats runs, in [s]
+def _time(statement: str, repeats: int = 5, env: dict = None):
+    env = os.environ | (env or dict())
+    times = [float(subprocess.run([sys.executable, '-c', _timer.format(statement=statement)], capture_output=True, text=True, check=True, env=env).stdout.split()[-1]) for _ in range(repeats)]
+    return min(times)
+
+#Import times of the modules and of the first map, with and without the precompiled reaction tables (tables = path of
+#an artifact written by corrosion_maps._reactions.save_tables)
+def _benchmark(repeats: int = 5, tables: str = None):
+    results = {key: _time(statement, repeats) for key, statement in _statements.items()}
+    if tables:
+        results['first map (tables)'] = _time(_statements['first map'], repeats, {'CCSTOOLKIT_TABLES': tables})
+    return results
+
+if __name__ == "__main__":
+    for key, t in _benchmark(tables=sys.argv[1] if len(sys.argv)>1 else None).items():
+        print(f"{key:<24}{t*1e3:8.1f} ms")
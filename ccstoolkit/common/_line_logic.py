@@ -1,137 +1,241 @@
 #!/usr/bin/python3
 
 import numpy as np
+from fractions import Fraction
 
 from . import _math
 
+#-----------------------------------------------------------Rules
+#A rule is (relation, target) or (relation, target, point) with
+#   relation = 'above', 'below' (compares y) or 'right of', 'left of' (compares x)
+#   target = key of a line or (key, key), the intersection of two lines
+#   point = the tested point (default) or (key, key), the intersection of two lines (a rule on P only)
+#or ('any', [rule, rule, ...]), satisfied if any of the rules is satisfied.
+#Each rule is a half-plane over the intercepts a of the lines (the slopes don't depend on P): w.a+u*x+v*y > 0
+
+#The weights of the coordinates of the intersection of two lines, x = wx.a and y = wy.a
+def _intersection_weights(pair: tuple, _lines: dict):
+    (i, j), ((b_i, c_i), (b_j, c_j)) = pair, [_lines[key]['slopes'] for key in pair]
+    det = b_i*c_j-b_j*c_i
+    return {j: c_i/det, i: -c_j/det}, {j: -b_i/det, i: b_j/det}
+
+#The half-plane (w, u, v) of a rule: +-(coordinate of the point - coordinate of the target) > 0
+def _half_plane(rule: tuple, _lines: dict):
+    relation, target = rule[0], rule[1]
+    point = rule[2] if len(rule)>2 else None
+    is_y = relation in ['above','below']
+    sign = 1 if relation in ['above','right of'] else -1
+    
+    if isinstance(target, tuple):
+        w = {key: -value for key, value in _intersection_weights(target, _lines)[is_y].items()}
+        u, v = (0, 1) if is_y else (1, 0)
+    else:
+        #y-y(x) = (a+b*x+c*y)/c and x-x(y) = (a+b*x+c*y)/b
+        b, c = _lines[target]['slopes']
+        d = c if is_y else b
+        w, u, v = {target: 1/d}, b/d, c/d
+    
+    #The point is the intersection of two lines: its coordinates are linear in a too
+    if point is not None:
+        wx, wy = _intersection_weights(point, _lines)
+        for weights, factor in [(wx, u), (wy, v)]:
+            for key, value in weights.items():
+                w[key] = w.get(key, 0)+factor*value
+        u, v = 0, 0
+    
+    return {key: sign*value for key, value in w.items()}, sign*u, sign*v
+
+#Compile the rules of a line into a signed constraint matrix: a conjunction of clauses, each a disjunction of half-planes.
+#Returns {'lines': referenced lines, 'W': (half-planes, lines), 'u', 'v': (half-planes,), 'clauses': (clauses, half-planes)}
+def _compile_rules(rules: list, _lines: dict):
+    half_planes, clauses = list(), list()
+    for rule in rules:
+        members = rule[1] if rule[0]=='any' else [rule]
+        clauses.append(list(range(len(half_planes), len(half_planes)+len(members))))
+        half_planes += [_half_plane(member, _lines) for member in members]
+    
+    refs = list(dict.fromkeys([key for w, _, _ in half_planes for key in w]))
+    
+    W = np.zeros((len(half_planes), len(refs)))
+    for j, (w, _, _) in enumerate(half_planes):
+        for key, value in w.items():
+            W[j, refs.index(key)] = value
+    
+    matrix = np.zeros((len(clauses), len(half_planes)))
+    for k, clause in enumerate(clauses):
+        matrix[k, clause] = 1
+    
+    return {
+        'keys': refs,
+        'lines': [_lines[key] for key in refs],
+        'W': W,
+        'u': np.array([u for _, u, _ in half_planes], dtype=float),
+        'v': np.array([v for _, _, v in half_planes], dtype=float),
+        'clauses': matrix
+    }
+
+#The compiled rules of all lines of a map in one matrix, with the line of each half-plane ('owner') and of each
+#clause ('clause lines'), and the arrays of the slopes of the lines. Cached per map.
+def _compile_map(lines: dict):
+    if id(lines) in _compiled and _compiled[id(lines)][0] is lines:
+        return _compiled[id(lines)][1]
+    
+    constraints = [line['constraints'] for line in lines.values()]
+    refs = dict()
+    for constraint in constraints:
+        refs |= dict(zip(constraint['keys'], constraint['lines']))
+    keys = list(refs.keys())
+    
+    J = sum(len(constraint['u']) for constraint in constraints)
+    C = sum(len(constraint['clauses']) for constraint in constraints)
+    compiled = {'keys': keys, 'lines': list(refs.values()), 'W': np.zeros((J, len(keys))), 'u': np.zeros(J), 'v': np.zeros(J), 'owner': np.zeros(J, dtype=int), 'clauses': np.zeros((C, J)), 'clause lines': np.zeros((C, len(lines)))}
+    
+    j, k = 0, 0
+    for l, constraint in enumerate(constraints):
+        J_l, C_l = len(constraint['u']), len(constraint['clauses'])
+        compiled['W'][j:j+J_l, [keys.index(key) for key in constraint['keys']]] = constraint['W']
+        compiled['u'][j:j+J_l], compiled['v'][j:j+J_l] = constraint['u'], constraint['v']
+        compiled['owner'][j:j+J_l] = l
+        compiled['clauses'][k:k+C_l, j:j+J_l] = constraint['clauses']
+        compiled['clause lines'][k:k+C_l, l] = 1
+        j, k = j+J_l, k+C_l
+    
+    #The referenced lines of the map by their index, the others by the line
+    ids = list(lines.keys())
+    compiled['refs'] = [ids.index(key) if key in lines else ref for key, ref in refs.items()]
+    compiled['switches'] = [(l, key) for l, key in enumerate(ids) if 'active' in lines[key]]
+    
+    #---------------------------Slopes, orientations and the parallel lines---------------------------
+    compiled['b'], compiled['c'] = np.array([lines[key]['slopes'] for key in ids], dtype=float).reshape(-1, 2).T
+    compiled['vertical'] = np.array([lines[key]['vertical'] for key in ids], dtype=bool)
+    compiled['angled'] = ~compiled['vertical'] & ~np.array([lines[key]['horizontal'] for key in ids], dtype=bool)
+    compiled['det'] = compiled['b'][:, None]*compiled['c'][None, :]-compiled['b'][None, :]*compiled['c'][:, None]
+    compiled['parallel'] = np.abs(compiled['det'])<1e-9
+    
+    _compiled[id(lines)] = (lines, compiled)
+    return compiled
+
+_compiled = dict()
+
+#-----------------------------------------------------------Angles
+#The order of the directions of the edges is the order of np.arctan2 in (-pi, pi], found exactly from the slopes
+#(floats are rational): the quadrant, then dy/dx within the quadrant.
+def _angle_key(d: tuple):
+    dx, dy = Fraction(d[0]), Fraction(d[1])
+    if dy<0:
+        quadrant = 0 if dx<0 else 1 if dx==0 else 2
+    elif dy==0:
+        quadrant = 7 if dx<0 else 3
+    else:
+        quadrant = 4 if dx>0 else 5 if dx==0 else 6
+    return (quadrant, dy/dx if dx!=0 and dy!=0 else Fraction(0))
+
+#The angle keys of the edges of a line from p0 to p1 (t increasing) and back
+def _line_angles(line: dict):
+    b, c = line['slopes']
+    forward = ((-c, b) if b>0 else (c, -b)) if line['vertical'] else ((c, -b) if c>0 else (-c, b))
+    return _angle_key(forward), _angle_key((-forward[0], -forward[1]))
+
+#The sides of the bounding box go up (left, right) or right (bottom, top)
+_box_angles = [(_angle_key((0, 1)), _angle_key((0, -1)))]*2+[(_angle_key((1, 0)), _angle_key((-1, 0)))]*2
+
+#End points closer than this (in both coordinates) are one vertex
+_snap = 1.5e-6
+
 #Based on the specified rules, create a dictionary containing the lines specifying a graph
 def _form_lines(_rules,_lines):
     lines = dict()
     for key,rules in _rules.items():
-        rules_f = list()
-        for rule in rules:
-            if rule[0]=='above':
-                rules_f.append(lambda x, y, P, key=rule[1]: y > _lines[key]['y'](x,P))
-            elif rule[0]=='below':
-                rules_f.append(lambda x, y, P, key=rule[1]: y < _lines[key]['y'](x,P))
-            elif rule[0]=='right of':
-                rules_f.append(lambda x, y, P, key=rule[1]: x > _lines[key]['x'](y,P))
-            elif rule[0]=='left of':
-                rules_f.append(lambda x, y, P, key=rule[1]: x < _lines[key]['x'](y,P))
-                
-        lines[key] = _lines[key] | {'rules': rules, 'rules_f': rules_f}
+        lines[key] = _lines[key] | {'rules': rules, 'constraints': _compile_rules(rules, _lines)}
+        lines[key]['angles'] = _line_angles(lines[key])
         
     return lines
-    
-#Get all intersections between a list of lines
-def _all_intersections(lines: dict, P: dict):
-    ids = list(lines.keys())
-    points = []
-
-    for i in range(len(ids)):
-        for j in range(i+1, len(ids)):
-            p = _math._intersection(lines[ids[i]], lines[ids[j]], P)
-            if p is not None:
-                points.append(p)
-    return points
 
-#Get only the active part of a line constrained by x_bounds, y_bounds and applying the line['rules']
-def _clip_line(line: dict, intersections: list, P: dict, x_bounds: tuple, y_bounds: tuple):
+#Clip all lines of a map at once (a = intercepts of the lines) to their active part constrained by x_bounds, y_bounds
+#and the rules. The split points of each line are its intersections with the other lines, sorted, and the bounding box.
+#Returns the active mask (lines,) and the end points p0, p1 (lines, 2), not rounded, NaN if not active.
+def _clip_lines(lines: dict, P: dict, a, x_bounds: tuple, y_bounds: tuple):
+    compiled = _compile_map(lines)
+    b, c, vertical = compiled['b'], compiled['c'], compiled['vertical']
     x_min, x_max = x_bounds
     y_min, y_max = y_bounds
-    a, b, c = line['coeffs'](P)
     
-    #Collect coordinates where this line intersects the others
-    t_vals = []                              #t can be x or y depending on the orientation
-    for p in intersections:
-        if p is None:
-            continue
-        x, y = p
-
-        if abs(a+b*x+c*y)<1e-9:               #Satisfies the equation = lies on the line
-            t_vals.append(y if line['vertical'] else x)
-            
-    #For angled lines, add intersections with the bounding box
-    if not line['vertical'] and not line['horizontal']:
-        t_vals.append(line['y'](x_min, P))
-        t_vals.append(line['y'](x_max, P))
-        t_vals.append(line['x'](y_min, P))
-        t_vals.append(line['x'](y_max, P))
-            
-    #Add bounding box limits
-    t_vals += (y_bounds if line['vertical'] else x_bounds)
+    #Limits of t (x or y along the line) and of the other coordinate
+    t_bounds = np.where(vertical[:, None], y_bounds, x_bounds).astype(float)
+    o_bounds = np.where(vertical[:, None], x_bounds, y_bounds).astype(float)
     
-    #Remove intersection points ouside the bounds
-    if line['vertical']:
-        t_vals = [t for t in t_vals if y_min <= round(t,6) <= y_max and x_min <= round(line['x'](t, P),6) <= x_max]
-    else:
-        t_vals = [t for t in t_vals if x_min <= round(t,6) <= x_max and y_min <= round(line['y'](t, P),6) <= y_max]
-    
-    #Sort
-    t_vals = sorted(t_vals)
-    
-    #Generate segments between consecutive points
-    segments = list()     
-    for t0, t1 in zip(t_vals[:-1], t_vals[1:]):
-        tmid = 0.5*(t0+t1)
-
-        if line['vertical']:
-            xmid = line['x'](tmid, P)
-            ymid = tmid
-        else:
-            xmid = tmid
-            ymid = line['y'](tmid, P)
-            
-        #If all rules are satisfied, save this segment
-        if np.all([rule(xmid,ymid,P) for rule in line['rules_f']]):
-            if line['vertical']:
-                segments.append(((xmid, t0), (xmid, t1)))
-            else:
-                segments.append((
-                    (t0, line['y'](t0, P)),
-                    (t1, line['y'](t1, P))
-                ))
-
-    return segments
+    #The other coordinate of the points t of the lines, line['x'](t) if vertical else line['y'](t)
+    def other(t):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(vertical[:, None], -(a[:, None]+c[:, None]*t)/b[:, None], -(a[:, None]+b[:, None]*t)/c[:, None])
+    
+    #---------------------------Intersections of each line with the others (_math._intersection)---------------------------
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = (c[:, None]*a[None, :]-c[None, :]*a[:, None])/compiled['det']
+        Y = -(b[:, None]*a[None, :]-b[None, :]*a[:, None])/compiled['det']
+    t = np.where(compiled['parallel'], np.nan, np.where(vertical[:, None], Y, X))
+    
+    #---------------------------Bounding box and its limits---------------------------
+    with np.errstate(invalid='ignore', divide='ignore'):
+        box = np.stack([-(a+b*x_min)/c, -(a+b*x_max)/c, -(a+c*y_min)/b, -(a+c*y_max)/b], axis=1)
+    t = np.concatenate([t, np.where(compiled['angled'][:, None], box, np.nan), t_bounds], axis=1)
+    
+    #Remove the points outside of the bounds
+    rt, ro = np.round(t, 6), np.round(other(t), 6)
+    with np.errstate(invalid='ignore'):
+        inside = (t_bounds[:, :1] <= rt) & (rt <= t_bounds[:, 1:]) & (o_bounds[:, :1] <= ro) & (ro <= o_bounds[:, 1:])
+    
+    #Sorted, the missing points (NaN) go last
+    t = np.sort(np.where(inside, t, np.nan), axis=1)[:, :max(2, np.max(np.sum(inside, axis=1)))]
+    
+    #---------------------------Rules at the middle points of all segments---------------------------
+    t0, t1 = t[:, :-1], t[:, 1:]
+    tmid = 0.5*(t0+t1)
+    omid = other(tmid)
+    xmid, ymid = np.where(vertical[:, None], omid, tmid), np.where(vertical[:, None], tmid, omid)
+    
+    a_refs = np.array([a[ref] if isinstance(ref, int) else float(ref['coeffs'](P)[0]) for ref in compiled['refs']], dtype=float)
+    owner = compiled['owner']
+    with np.errstate(invalid='ignore'):
+        values = (compiled['W'] @ a_refs)[:, None]+compiled['u'][:, None]*xmid[owner]+compiled['v'][:, None]*ymid[owner]
+    clauses = compiled['clauses'] @ (values>0) > 0
+    segments = ~np.isnan(t1) & (compiled['clause lines'].T @ ~clauses == 0)
+    
+    active = np.any(segments, axis=1)
+    for l, key in compiled['switches']:
+        active[l] &= bool(lines[key]['active'](P))
+    
+    #---------------------------Combine the active segments into one---------------------------
+    #Works because: all lines are straight and the segments are sorted
+    l = np.arange(len(a))
+    first = np.argmax(segments, axis=1)
+    last = segments.shape[1]-1-np.argmax(segments[:, ::-1], axis=1)
+    
+    x0 = np.where(vertical, omid[l, first], t0[l, first])
+    x1 = np.where(vertical, omid[l, last], t1[l, last])
+    y0 = np.where(vertical, t0[l, first], other(t0[l, first][:, None])[:, 0])
+    y1 = np.where(vertical, t1[l, last], other(t1[l, last][:, None])[:, 0])
+    
+    p0 = np.where(active[:, None], np.stack([x0, y0], axis=1), np.nan)
+    p1 = np.where(active[:, None], np.stack([x1, y1], axis=1), np.nan)
+    
+    return active, p0, p1
     
 #Get all active segments
 def _get_active_lines(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
-    #Get all intersection points
-    intersections = _all_intersections(lines, P)
-
-    active_lines = list()
-    #For each line
-    for key, line in lines.items():
-        #Check if active
-        if 'active' in line:
-            if not line['active'](P):
-                continue
-        
-        #Get the active segments of the line
-        segments = _clip_line(line, intersections, P, x_bounds, y_bounds)
-        #The segments are sorted by x or y!
-        
-        #If there are active segments
-        if segments:
-            #Combine the segment into one.
-            #Works because: all lines are straight and the segments are sorted
-            #The points need to be rounded, otherwise truncation errors make the match problematic!
-            active_line = dict()
-            active_line['id'] = key                                      #The id of the line
-            active_line['p0'] = _math._format_xy(segments[0][0])         #One end point
-            active_line['p1'] = _math._format_xy(segments[-1][1])        #The other end point
-            active_lines.append(active_line)
-            
-    return active_lines
+    ids = list(lines.keys())
+    a = np.array([lines[key]['coeffs'](P)[0] for key in ids], dtype=float)
     
-#Get the regions defined by a list of lines and x,y bounds
-def _get_regions(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    active, p0, p1 = _clip_lines(lines, P, a, x_bounds, y_bounds)
+    
+    #The points need to be rounded, otherwise truncation errors make the match problematic!
+    return [{'id': ids[l], 'p0': _math._format_xy(p0[l]), 'p1': _math._format_xy(p1[l]), 'angles': lines[ids[l]]['angles']} for l in np.flatnonzero(active)]
+    
+#Get the faces enclosed by the active lines and the bounding box, as closed loops of points, including the outer face
+def _get_faces(active_lines: list, x_bounds: tuple, y_bounds: tuple):
     #---------------------------Add bounding box segments---------------------------
     #The corners of the bounding box
     corners = [(x, y) for x in x_bounds for y in y_bounds]
-
-    #The active lines
-    active_lines = _get_active_lines(lines, P, x_bounds, y_bounds)
     
     #Get all intersection points
     active_intersections = [p for line in active_lines for p in [line['p0'],line['p1']]]
@@ -149,75 +253,67 @@ def _get_regions(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
     lines_box = list()
     for cnt, edge in enumerate(box_edges):
         for cnt1, p in enumerate(edge[:-1]):
-            line = {'id': str(cnt)+str(cnt1), 'p0': p, 'p1': edge[cnt1+1]}
+            line = {'id': str(cnt)+str(cnt1), 'p0': p, 'p1': edge[cnt1+1], 'angles': _box_angles[cnt]}
             lines_box.append(line)
-
+    
+    segments = active_lines+lines_box
+    
+    #---------------------------Half-edges---------------------------
+    #Half-edge 2*k goes from p0 to p1 of segment k, 2*k+1 back (its twin). The vertices are the end points, the ones
+    #closer than _snap are snapped to the first of them.
+    points = np.array([p for line in segments for p in [line['p0'], line['p1']]], dtype=float).reshape(-1, 2)
+    close = np.all(np.abs(points[:, None, :]-points[None, :, :])<=_snap, axis=2)
+    origin = np.argmax(close, axis=1)
+    target = origin.reshape(-1, 2)[:, ::-1].ravel()
+    angles = [angle for line in segments for angle in line.get('angles') or [_angle_key(np.subtract(line['p1'], line['p0'])), _angle_key(np.subtract(line['p0'], line['p1']))]]
+    
+    #The outgoing half-edges of each vertex sorted by angle (counterclockwise), the equal ones in the order of the segments
+    outs = dict()
+    for h in sorted(range(len(origin)), key=lambda h: (origin[h], angles[h])):
+        outs.setdefault(origin[h], []).append(h)
+    
+    #Where the half-edges to each vertex start in the outgoing half-edges of the vertex
+    position = dict()
+    for v, hs in outs.items():
+        for i, h in enumerate(hs):
+            position.setdefault((v, target[h]), i)
+    
     #---------------------------Find the faces---------------------------
-    #Walk the edges starting from a point and always turning in the same direction.
-    #When the point repeats, a face has been enclosed.
+    #Walk the half-edges always turning in the same direction (left): at the end of a half-edge take the previous
+    #outgoing half-edge, in counterclockwise order, to the one back. When the half-edge repeats, a face is enclosed.
+    following = [outs[target[h]][(position[(target[h], origin[h])]-1) % len(outs[target[h]])] for h in range(len(origin))]
     
-    #Define inner and outer edges for each line segment (inner/outer = top/bottom = left/right)
-    edges = list()
-    for line in active_lines+lines_box:
-        edges.append({'id': line['id'], 'from': line['p0'], 'to': line['p1'], 'used': False})
-        edges.append({'id': line['id'], 'from': line['p1'], 'to': line['p0'], 'used': False})
-
-    #Get all vertices
-    vertices = dict()
-    for edge in edges:
-        vertice = edge['from']
-
-        if vertice not in vertices:
-            vertices[vertice] = []
-
-        vertices[vertice].append(edge)
-
-    #For each vertice, sort the outgoing edges by angle.
-    #This ensures the algoritm transverses the graph always turning in the same direction (left).
-    for vertice, out_edges in vertices.items():
-        out_edges.sort(key=lambda e: _math._angle(vertice, e['to']))
-        
-    #Get all regions
+    used = np.zeros(len(origin), dtype=bool)
     regions = list()
-    #Starting from an edge
-    for edge in edges:
-        #Only if the edge is active
-        if edge['used']:
+    for edge in range(len(origin)):
+        if used[edge]:
             continue
-
-        #face = list()
+        
         face = {'bounds ids': [], 'points': []}
         current = edge
-        
-        #Add all 'from' points untill the loop closes
         while True:
-            current['used'] = True                             #Remove this edge from rotation
+            used[current] = True
+            face['bounds ids'].append(segments[current//2]['id'])
+            face['points'].append(current)
             
-            face['bounds ids'].append(current['id'])
-            face['points'].append(current['from'])             #Starting point
-
-            towards = current['to']                            #End point
-            outs = vertices[towards]                           
-
-            #Find the index of the reverse edge current['to']->current['from']
-            for i, oe in enumerate(outs):
-                if oe['to'] == current['from']:
-                    idx = i
-                    break
-
-            #Turn left: previous edge in CCW order
-            current = outs[(idx - 1) % len(outs)]
-
-            #Check if loop is closed
-            if current is edge:
+            current = following[current]
+            if current==edge:
                 break
-
+        
         regions.append(face)
+    
+    #The points of the vertices, closed loops for plotting
+    vertices = [tuple(map(float, p)) for p in points[origin]]
+    return [{'bounds ids': region['bounds ids'], 'points': [vertices[h] for h in region['points']+region['points'][:1]]} for region in regions]
 
-    #---------------------------Format the dictionary---------------------------
-    #Close the loops for plotting
-    regions = [{'bounds ids': region['bounds ids'], 'points': region['points']+[region['points'][0]]} for region in regions]
+#Get the regions defined by a list of lines and x,y bounds
+def _get_regions(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    #The active lines
+    active_lines = _get_active_lines(lines, P, x_bounds, y_bounds)
+    
+    regions = _get_faces(active_lines, x_bounds, y_bounds)
     
+    #---------------------------Format the dictionary---------------------------
     #Calculate the area of each face
     for region in regions:
         region['area'] = _math._polygon_area(region['points'])
@@ -236,3 +332,260 @@ def _get_regions(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
         
     return inner_regions
     
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Batch
+#===================================================================================================================
+#P = {key: array (n,)} (nested dicts allowed) reshaped to broadcast against arrays (n, m)
+def _columns(P: dict, shape: tuple):
+    return {key: _columns(value, shape) if isinstance(value, dict) else np.reshape(value, shape) for key, value in P.items()}
+
+#A map as plain arrays, without closures, so it can be pickled (e.g. sent to worker processes): the ids, slopes and
+#orientations of the lines, the angles of their edges and the compiled rules (_compile_map). The lines referenced by
+#the rules that are not in the map ('extra') follow the lines of the map: the intercepts a of the batch functions are
+#(lines+extra, n) and 'refs' are the rows of a of the referenced lines. Lines switched on and off by P ('active') are
+#listed in 'switches' and left to the caller. Cached per map.
+def _compile_arrays(lines: dict):
+    if id(lines) in _arrays and _arrays[id(lines)][0] is lines:
+        return _arrays[id(lines)][1]
+    
+    compiled = _compile_map(lines)
+    ids = list(lines.keys())
+    extra = [key for key, ref in zip(compiled['keys'], compiled['refs']) if not isinstance(ref, int)]
+    
+    arrays = {
+        'ids': ids,
+        'extra': extra,
+        'b': compiled['b'],
+        'c': compiled['c'],
+        'vertical': compiled['vertical'],
+        'horizontal': np.array([lines[key]['horizontal'] for key in ids], dtype=bool),
+        'angles': [lines[key]['angles'] for key in ids],
+        'refs': np.array([ref if isinstance(ref, int) else len(ids)+extra.index(key) for key, ref in zip(compiled['keys'], compiled['refs'])], dtype=int),
+        'switches': [key for _, key in compiled['switches']]
+    } | {key: compiled[key] for key in ['W','u','v','owner','clauses','clause lines']}
+    
+    _arrays[id(lines)] = (lines, arrays)
+    return arrays
+
+_arrays = dict()
+
+#Test the middle points (n, lines, m) of all lines of a map against their rules in one evaluation
+#(a_refs = intercepts of the referenced lines (n, refs))
+def _satisfied_map(arrays: dict, x, y, a_refs):
+    owner = arrays['owner']
+    with np.errstate(invalid='ignore'):
+        values = (a_refs @ arrays['W'].T)[:, :, None]+arrays['u'][:, None]*x[:, owner]+arrays['v'][:, None]*y[:, owner]
+        clauses = np.einsum('cj,njm->ncm', arrays['clauses'], (values>0).astype(float))>0
+    
+    return np.einsum('cl,ncm->nlm', arrays['clause lines'], (~clauses).astype(float))==0
+
+#The same as _get_active_lines for n rows of the intercepts a (lines+extra, n) of a map (_compile_arrays), with the
+#same arithmetic. The switches of the lines are not applied.
+#Returns the active mask (lines, n) and the end points p0, p1 (lines, n, 2), not rounded, NaN if not active.
+def _clip_lines_batch(arrays: dict, a, x_bounds: tuple, y_bounds: tuple):
+    x_min, x_max = x_bounds
+    y_min, y_max = y_bounds
+    L, n = len(arrays['ids']), a.shape[1]
+    b, c = arrays['b'], arrays['c']
+    
+    #The other coordinate of the points t of line l, the same as line['x'](t) if vertical else line['y'](t)
+    def other(l, t, a_l):
+        return -(a_l+c[l]*t)/b[l] if arrays['vertical'][l] else -(a_l+b[l]*t)/c[l]
+    
+    #---------------------------All intersections---------------------------
+    #The slopes don't depend on P, so the parallel pairs are the same for all rows
+    pairs = np.array([(i, j) for i in range(L) for j in range(i+1, L) if abs(b[i]*c[j]-b[j]*c[i]) >= 1e-9], dtype=int).reshape(-1, 2)
+    i, j = pairs[:, 0], pairs[:, 1]
+    det = (b[i]*c[j]-b[j]*c[i])[:, None]
+    X = (c[i][:, None]*a[j]-c[j][:, None]*a[i])/det                                               #(pairs, n)
+    Y = -(b[i][:, None]*a[j]-b[j][:, None]*a[i])/det
+    
+    rows = np.arange(n)
+    
+    active = np.zeros((L, n), dtype=bool)
+    p0 = np.full((L, n, 2), np.nan)
+    p1 = np.full((L, n, 2), np.nan)
+    ts = list()
+    for l in range(L):
+        vertical = arrays['vertical'][l]
+        
+        #---------------------------Split points, as in _clip_lines: the intersections of the line---------------------------
+        t = [(Y if vertical else X)[(i==l) | (j==l)].T]
+        
+        if not vertical and not arrays['horizontal'][l]:
+            t += [other(l, x_min, a[l])[:, None], other(l, x_max, a[l])[:, None]]
+            t += [(-(a[l]+c[l]*y_min)/b[l])[:, None], (-(a[l]+c[l]*y_max)/b[l])[:, None]]
+        t += [np.full((n, 2), y_bounds if vertical else x_bounds, dtype=float)]
+        t = np.concatenate(t, axis=1)
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            o = np.round(other(l, t, a[l][:, None]), 6)
+            if vertical:
+                inside = (y_min <= np.round(t,6)) & (np.round(t,6) <= y_max) & (x_min <= o) & (o <= x_max)
+            else:
+                inside = (x_min <= np.round(t,6)) & (np.round(t,6) <= x_max) & (y_min <= o) & (o <= y_max)
+        
+        #Sorted, the missing points (NaN) go last
+        ts.append(np.sort(np.where(inside, t, np.nan), axis=1)[:, :max(2, np.max(np.sum(inside, axis=1)))])
+    
+    #---------------------------Middle points of the segments of all lines---------------------------
+    m = max(t.shape[1] for t in ts)
+    t = np.stack([np.pad(t, ((0, 0), (0, m-t.shape[1])), constant_values=np.nan) for t in ts], axis=1)     #(n, lines, m)
+    t0, t1 = t[:, :, :-1], t[:, :, 1:]
+    tmid = 0.5*(t0+t1)
+    
+    xmid, ymid = tmid.copy(), tmid.copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for l in range(L):
+            (xmid if arrays['vertical'][l] else ymid)[:, l] = other(l, tmid[:, l], a[l][:, None])
+    
+    #---------------------------All rules of the map at once---------------------------
+    segments = ~np.isnan(t1) & _satisfied_map(arrays, xmid, ymid, a[arrays['refs']].T)
+    
+    for l in range(L):
+        active[l] = np.any(segments[:, l], axis=1)
+        
+        #---------------------------Combine the active segments into one---------------------------
+        first = np.argmax(segments[:, l], axis=1)
+        last = segments.shape[2]-1-np.argmax(segments[:, l, ::-1], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if arrays['vertical'][l]:
+                p0[l] = np.stack([other(l, tmid[rows, l, first], a[l]), t0[rows, l, first]], axis=1)
+                p1[l] = np.stack([other(l, tmid[rows, l, last], a[l]), t1[rows, l, last]], axis=1)
+            else:
+                p0[l] = np.stack([t0[rows, l, first], other(l, t0[rows, l, first], a[l])], axis=1)
+                p1[l] = np.stack([t1[rows, l, last], other(l, t1[rows, l, last], a[l])], axis=1)
+        
+        p0[l][~active[l]] = np.nan
+        p1[l][~active[l]] = np.nan
+    
+    return active, p0, p1
+
+#The same as _get_active_lines for the columns of P = {key: array (n,)}.
+#Returns the ids, the active mask (lines, n) and the rounded end points p0, p1 (lines, n, 2), NaN if not active.
+def _get_active_lines_batch(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    arrays = _compile_arrays(lines)
+    
+    #The intercepts of the lines of the map and of the extra lines
+    refs = dict(zip(_compile_map(lines)['keys'], _compile_map(lines)['lines']))
+    coeffs = [lines[key]['coeffs'](P)[0] for key in arrays['ids']]+[refs[key]['coeffs'](P)[0] for key in arrays['extra']]
+    a = np.array(np.broadcast_arrays(*[np.atleast_1d(np.asarray(coeff, dtype=float)) for coeff in coeffs]))
+    
+    active, p0, p1 = _clip_lines_batch(arrays, a, x_bounds, y_bounds)
+    
+    for key in arrays['switches']:
+        l = arrays['ids'].index(key)
+        active[l] &= lines[key]['active'](P)
+        p0[l][~active[l]] = np.nan
+        p1[l][~active[l]] = np.nan
+    
+    return arrays['ids'], active, np.round(p0, 6), np.round(p1, 6)
+
+#The topology of the graphs of the active lines of n rows (active (lines, n), end points p0, p1 (lines, n, 2)): the
+#vertices (coinciding end points), the points on each side of the bounding box with their order and the order of
+#the angles of the edges at each vertex. Rows with the same signature have the same faces.
+#Returns the vertices V (n, vertices, 2), their labels (n, vertices), the unique vertices and the signatures (n, ...)
+def _graph_signatures(active, p0, p1, x_bounds: tuple, y_bounds: tuple):
+    n = active.shape[1]
+    
+    #---------------------------Vertices: end points of the lines and corners---------------------------
+    corners = np.array([(x, y) for x in x_bounds for y in y_bounds], dtype=float)
+    V = np.concatenate([p0, p1, np.broadcast_to(corners[:, None, :], (4, n, 2))], axis=0).transpose(1, 0, 2)      #(n, vertices, 2)
+    present = np.concatenate([active, active, np.ones((4, n), dtype=bool)], axis=0).T
+    
+    #Each point is labeled by the first point with the same coordinates
+    same = np.all(V[:, :, None, :]==V[:, None, :, :], axis=3) & present[:, None, :]
+    labels = np.where(present, np.argmax(same, axis=2), -1)
+    unique = labels==np.arange(V.shape[1])
+    
+    #---------------------------Points on the sides of the bounding box and their order---------------------------
+    sides = [(0, x_bounds[0], 1), (0, x_bounds[1], 1), (1, y_bounds[0], 0), (1, y_bounds[1], 0)]
+    on_sides = [unique & (V[:, :, axis]==value) for axis, value, _ in sides]
+    orders = [np.argsort(np.where(on_side, V[:, :, along], np.inf), axis=1, kind='stable') for on_side, (_, _, along) in zip(on_sides, sides)]
+    
+    #---------------------------Order of the angles of the edges at each vertex---------------------------
+    #The edges of the lines, p0 -> p1 and p1 -> p0, sorted by their start and angle. The box edges (0, pi/2, pi, -pi/2)
+    #are placed by the position of the angles among theirs.
+    d = (p1-p0).transpose(1, 0, 2)
+    angles = np.concatenate([np.arctan2(d[:, :, 1], d[:, :, 0]), np.arctan2(-d[:, :, 1], -d[:, :, 0])], axis=1)
+    angles = np.where(np.concatenate([active.T, active.T], axis=1), angles, np.inf)
+    starts = np.concatenate([labels[:, :len(p0)], labels[:, len(p0):2*len(p0)]], axis=1)
+    rank = np.lexsort((angles, starts), axis=1)
+    with np.errstate(invalid='ignore'):
+        ties = np.all(np.diff([np.take_along_axis(starts, rank, axis=1), np.take_along_axis(angles, rank, axis=1)], axis=2)==0, axis=0)
+    box = np.sort(np.arctan2([0., 1., 0., -1.], [1., 0., -1., 0.]))
+    box_ranks = [np.searchsorted(box, angles, side=side) for side in ['left','right']]
+    
+    signatures = np.concatenate([active.T, labels, *on_sides, *orders, rank, ties, *box_ranks], axis=1).astype(np.int32)
+    
+    return V, labels, unique, signatures
+
+#The faces of row r (_get_faces), sorted by their bounds ids, with the points replaced by the labels of the vertices
+#(arrays = the map, _compile_arrays)
+def _face_labels(arrays: dict, active, p0, p1, V, labels, unique, r: int, x_bounds: tuple, y_bounds: tuple):
+    active_lines = [{'id': key, 'p0': tuple(map(float, p0[l, r])), 'p1': tuple(map(float, p1[l, r])), 'angles': angles} for l, (key, angles) in enumerate(zip(arrays['ids'], arrays['angles'])) if active[l, r]]
+    vertices = {tuple(map(float, V[r, k])): labels[r, k] for k in np.flatnonzero(unique[r])}
+    faces = sorted(_get_faces(active_lines, x_bounds, y_bounds), key=lambda d: d['bounds ids'])
+    
+    return [{'bounds ids': face['bounds ids'], 'labels': [vertices[p] for p in face['points']]} for face in faces]
+
+#The same as _get_regions for the columns of P = {key: array (n,)}.
+#The rows are grouped by the topology of the graph of the active lines (_graph_signatures). The faces are found once
+#per group and the areas and centroids of all rows of a group are calculated at once.
+#Returns a list of groups {'rows': array, 'signature': array, 'faces': [{'bounds ids': list, 'points': array (rows,
+#points, 2)}], 'area': array (rows, faces), 'centroid': array (rows, faces, 2)}. The faces are sorted by their bounds ids and
+#include the outer face; the regions of a row are the faces with a positive area (see _get_regions_of).
+def _get_regions_batch(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    _, active, p0, p1 = _get_active_lines_batch(lines, P, x_bounds, y_bounds)
+    return _group_regions(_compile_arrays(lines), active, p0, p1, x_bounds, y_bounds)
+
+#The same as _get_regions_batch for n rows of the intercepts a (lines+extra, n) of a map given as arrays
+#(_compile_arrays), e.g. in a worker process. The switches of the lines are not applied.
+def _get_regions_arrays(arrays: dict, a, x_bounds: tuple, y_bounds: tuple):
+    active, p0, p1 = _clip_lines_batch(arrays, a, x_bounds, y_bounds)
+    return _group_regions(arrays, active, np.round(p0, 6), np.round(p1, 6), x_bounds, y_bounds)
+
+#The groups of rows with the same faces (_get_regions_batch) of the active lines (lines, n) with the rounded end points
+def _group_regions(arrays: dict, active, p0, p1, x_bounds: tuple, y_bounds: tuple):
+    n = active.shape[1]
+    
+    V, labels, unique, signatures = _graph_signatures(active, p0, p1, x_bounds, y_bounds)
+    keys, inverse = np.unique(signatures, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    
+    #---------------------------Faces of each group---------------------------
+    groups = list()
+    for g in range(inverse.max()+1 if n else 0):
+        rows = np.flatnonzero(inverse==g)
+        faces = _face_labels(arrays, active, p0, p1, V, labels, unique, rows[0], x_bounds, y_bounds)
+        
+        group = {'rows': rows, 'signature': keys[g], 'faces': list(), 'area': np.zeros((len(rows), len(faces))), 'centroid': np.zeros((len(rows), len(faces), 2))}
+        for f, face in enumerate(faces):
+            points = V[rows][:, face['labels']]
+            x, y = points[:, :, 0], points[:, :, 1]
+            
+            #The same sums as _math._polygon_area and _math._calculate_centroid
+            area = np.zeros(len(rows))
+            for k in range(points.shape[1]):
+                area += x[:, k]*y[:, (k+1)%points.shape[1]]-x[:, (k+1)%points.shape[1]]*y[:, k]
+            group['area'][:, f] = area/2
+            
+            rolled = np.roll(points, 1, axis=1)
+            cross = _math._cross2d(points, rolled)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                group['centroid'][:, f] = np.sum((points+rolled)*cross[:, :, None], axis=1)/(6.0*(0.5*np.sum(cross, axis=1)))[:, None]
+            
+            group['faces'].append({'bounds ids': face['bounds ids'], 'points': points})
+        
+        groups.append(group)
+    
+    return groups
+
+#The regions of row i of a group of _get_regions_batch in the format of _get_regions
+def _get_regions_of(group: dict, i: int):
+    return [{
+        'bounds ids': face['bounds ids'],
+        'area': float(group['area'][i, f]),
+        'centroid': group['centroid'][i, f].copy(),
+        'points': [tuple(p) for p in face['points'][i].tolist()]
+    } for f, face in enumerate(group['faces']) if group['area'][i, f]>0]
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import atexit
+import importlib
+import numpy as np
+
+#multiprocessing and concurrent.futures are imported with the first pool or shared memory block (short-lived
+#processes that don't use them don't pay for the import)
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Worker pools
+#===================================================================================================================
+#The reaction tables are built from lambdas and can't be pickled. Instead, every worker imports the modules
+#once, at startup, and builds its own tables (or gets a compiled, picklable model through kwargs). The pools are kept
+#alive between calls.
+_pools = dict()
+
+def _init_worker(modules: tuple):
+    for module in modules:
+        importlib.import_module(module)
+
+def _get_pool(workers: int, modules: tuple):
+    from concurrent.futures import ProcessPoolExecutor
+
+    key = (workers, modules)
+    if key not in _pools:
+        _pools[key] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(modules,))
+    return _pools[key]
+
+@atexit.register
+def _shutdown_pools():
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Shared memory
+#===================================================================================================================
+#Allocate a shared memory block for each (shape, dtype). Returns the blocks, the arrays and picklable descriptors.
+def _allocate(specs: dict):
+    from multiprocessing import shared_memory
+
+    blocks, arrays, descriptors = dict(), dict(), dict()
+    for key, (shape, dtype) in specs.items():
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape))*dtype.itemsize)
+
+        blocks[key] = shared_memory.SharedMemory(create=True, size=size)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+        descriptors[key] = (blocks[key].name, shape, dtype)
+
+    return blocks, arrays, descriptors
+
+#Attach to shared memory blocks from their descriptors
+def _attach(descriptors: dict):
+    from multiprocessing import shared_memory
+
+    blocks, arrays = dict(), dict()
+    for key, (name, shape, dtype) in descriptors.items():
+        blocks[key] = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+
+    return blocks, arrays
+
+def _release(blocks: dict, unlink: bool = False):
+    for block in blocks.values():
+        block.close()
+        if unlink:
+            block.unlink()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Tasks
+#===================================================================================================================
+#Runs in the worker: call function(inputs, outputs, **kwargs) on the rows [start, stop) of the shared arrays
+def _run_task(function: str, inputs: dict, outputs: dict, start: int, stop: int, kwargs: dict):
+    module, name = function.rsplit('.', 1)
+    function = getattr(importlib.import_module(module), name)
+
+    blocks_in, arrays_in = _attach(inputs)
+    blocks_out, arrays_out = _attach(outputs)
+    try:
+        function({key: value[start:stop] for key, value in arrays_in.items()}, {key: value[start:stop] for key, value in arrays_out.items()}, **kwargs)
+    finally:
+        #The views must be dropped before the blocks are closed
+        del arrays_in, arrays_out
+        _release(blocks_in)
+        _release(blocks_out)
+
+    return stop-start
+
+#Split n rows in chunks and run function (given as 'module.name') on them in a pool of workers.
+#The inputs (a dict of arrays with n rows) are copied once into shared memory and the outputs are written there directly.
+#outputs = {key: (shape, dtype)}, shape[0] must be n. Returns a dict with the output arrays.
+#jobs = [kwargs, ...] splits the work on every chunk further (e.g. one job per map); each job is merged into kwargs
+#and must write to its own part of the outputs.
+def _map(function: str, inputs: dict, outputs: dict, n: int, workers: int, modules: tuple, chunksize: int = None, kwargs: dict = None, jobs: list = None):
+    kwargs = kwargs or dict()
+    jobs = jobs or [dict()]
+    chunksize = chunksize or max(1, -(-n*len(jobs)//(4*workers)))           #About 4 tasks per worker
+
+    blocks_in, arrays_in, descriptors_in = _allocate({key: (value.shape, value.dtype) for key, value in inputs.items()})
+    blocks_out, arrays_out, descriptors_out = _allocate(outputs)
+    try:
+        for key, value in inputs.items():
+            arrays_in[key][...] = value
+
+        pool = _get_pool(workers, modules)
+        futures = [pool.submit(_run_task, function, descriptors_in, descriptors_out, start, min(n, start+chunksize), kwargs | job) for start in range(0, n, chunksize) for job in jobs]
+        for future in futures:
+            future.result()
+
+        #Copy the results out of the shared memory before it is released
+        result = {key: value.copy() for key, value in arrays_out.items()}
+    finally:
+        del arrays_in, arrays_out
+        _release(blocks_in, unlink=True)
+        _release(blocks_out, unlink=True)
+
+    return result
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import numpy as np
+
+#Indexes of the last maps, by the function and P
+_indexes = dict()
+_maxsize = 32
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#Slab decomposition of the regions of a map (closed loops of points, counterclockwise, as from _line_logic._get_regions).
+#The x of the vertices split the plane into vertical slabs; within a slab the edges don't cross and are sorted by y.
+#The region of a point is the region above the highest edge below the point.
+#Returns {'names': names of the regions, 'x': slab limits (slabs+1,), 'start', 'end': edges of each slab (slabs,),
+#'x0', 'y0', 'slope': edges, 'above', 'below': regions above and below each edge, -1 if none}
+def _build_index(regions: list):
+    #---------------------------Edges with the regions above and below---------------------------
+    #The regions are on the left of their edges: above if the edge goes right, below if it goes left
+    edges = dict()
+    for r, region in enumerate(regions):
+        points = region['points']
+        for p, q in zip(points[:-1], points[1:]):
+            if p[0]==q[0]:
+                continue
+            key = (p, q) if p[0]<q[0] else (q, p)
+            edges.setdefault(key, [-1, -1])[0 if p[0]<q[0] else 1] = r
+
+    segments = np.array([[p[0], p[1], q[0], q[1]] for p, q in edges], dtype=float).reshape(-1, 4)
+    above, below = np.array(list(edges.values()), dtype=int).reshape(-1, 2).T
+    x0, y0, x1, y1 = segments.T
+    slope = (y1-y0)/(x1-x0)
+
+    #---------------------------Slabs and the edges across each, sorted by y---------------------------
+    x = np.unique(np.concatenate([x0, x1]))
+    xmid = 0.5*(x[:-1]+x[1:])
+    across = (x0[:, None]<=x[None, :-1]) & (x1[:, None]>=x[None, 1:])                          #(edges, slabs)
+
+    slabs, order = np.nonzero(across.T)
+    ymid = y0[order]+slope[order]*(xmid[slabs]-x0[order])
+    order = order[np.lexsort((ymid, slabs))]
+
+    counts = np.sum(across, axis=0)
+    end = np.cumsum(counts)
+
+    return {
+        'names': [region['name'] for region in regions],
+        'x': x,
+        'start': end-counts,
+        'end': end,
+        'x0': x0[order],
+        'y0': y0[order],
+        'slope': slope[order],
+        'above': above[order],
+        'below': below[order]
+    }
+
+#The regions of the points (x, y), -1 outside of the map. A binary search over the slabs, then over the edges of the
+#slab of each point, all points at once. A point on an edge belongs to the region above, or below if there is none.
+def _locate(index: dict, x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    x, y = np.broadcast_to(x, shape).ravel(), np.broadcast_to(y, shape).ravel()
+    
+    if len(index['x'])<2:
+        return np.full(shape, -1)
+
+    #The slab, the last one includes its right limit
+    slab = np.clip(np.searchsorted(index['x'], x, side='right')-1, 0, len(index['x'])-2)
+    inside = (index['x'][0]<=x) & (x<=index['x'][-1])
+
+    #The highest edge with y(x) <= y
+    lo, hi = index['start'][slab], index['end'][slab]
+    while True:
+        searching = np.flatnonzero(lo<hi)
+        if not len(searching):
+            break
+        mid = (lo[searching]+hi[searching])//2
+        below = index['y0'][mid]+index['slope'][mid]*(x[searching]-index['x0'][mid]) <= y[searching]
+        lo[searching] = np.where(below, mid+1, lo[searching])
+        hi[searching] = np.where(below, hi[searching], mid)
+
+    edge = np.maximum(lo-1, 0)
+    found = inside & (lo>index['start'][slab])
+    labels = np.where(found, index['above'][edge], -1)
+    on_edge = found & (labels==-1) & (index['y0'][edge]+index['slope'][edge]*(x-index['x0'][edge])==y)
+    labels[on_edge] = index['below'][edge][on_edge]
+
+    return labels.reshape(shape)
+
+#The names of the regions of the points (x, y), '' outside of the map or of the regions
+def _classify(index: dict, x, y):
+    return np.array(index['names']+[''])[_locate(index, x, y)]
+
+#The index of the regions get_regions(P) (a list of regions or a dict of maps), built once per P.
+#Returns -1 if get_regions does.
+def _get_index(name: str, get_regions, P: dict):
+    try:
+        key = (name, tuple(sorted(P.items())))
+        hash(key)
+    except (TypeError, AttributeError):
+        key = None
+
+    if key in _indexes:
+        return _indexes[key]
+
+    regions = get_regions(P)
+    if isinstance(regions, int):
+        return regions
+    index = {k: _build_index(v) for k, v in regions.items()} if isinstance(regions, dict) else _build_index(regions)
+
+    if key is not None:
+        if len(_indexes)>=_maxsize:
+            del _indexes[next(iter(_indexes))]
+        _indexes[key] = index
+
+    return index
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import numpy as np
+
+from . import _line_logic
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#Labels of the regions of a map on a grid of pixels, without the polygons of the regions. The (infinite) lines of the
+#map split the grid into cells with the same side of every line (the bits of the signs of a+b*x+c*y). Two neighbouring
+#cells are in the same region unless a line between them is active there, i.e. its crossing is on the segment left by
+#the rules of the line (_line_logic._clip_lines). The regions are the connected cells, named from the active lines that
+#bound them, as the faces of _line_logic._get_regions.
+
+#The pixel centres of the grid: x increasing (columns), y decreasing (rows, the top row first, as in an image)
+def _grid(x_bounds: tuple, y_bounds: tuple, width: int, height: int):
+    x = x_bounds[0]+(np.arange(width)+0.5)*(x_bounds[1]-x_bounds[0])/width
+    y = y_bounds[1]-(np.arange(height)+0.5)*(y_bounds[1]-y_bounds[0])/height
+    return x, y
+
+#The roots of the cells joined by the pairs (union-find, the cells are few)
+def _join(n: int, pairs):
+    parent = list(range(n))
+    def root(i):
+        while parent[i]!=i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in pairs:
+        parent[root(i)] = root(j)
+    return np.array([root(i) for i in range(n)], dtype=int)
+
+#The sides of the lines (a+b*x+c*y > 0) of the points as words of 64 bits per point (usually one), (points, words)
+def _words(a, b, c, x, y):
+    bits = np.packbits(a[:, None]+b[:, None]*x[None, :]+c[:, None]*y[None, :] > 0, axis=0)
+    words = np.zeros((-(-len(bits)//8)*8, bits.shape[1]), dtype=np.uint8)
+    words[:len(bits)] = bits
+    return np.ascontiguousarray(words.T).view(np.uint64)
+
+#The middle points of the pieces of the active lines between two intersections with other lines (each piece is between
+#two cells), longer than length. Returns the lines, the points (2, pieces) and the normals (2, pieces) of the pieces.
+def _pieces(a, b, c, active, p0, p1, length: float):
+    lines, points, normals = list(), list(), list()
+    for l in np.flatnonzero(active):
+        d = np.array([-c[l], b[l]])/np.hypot(b[l], c[l])                               #Along the line
+        with np.errstate(invalid='ignore', divide='ignore'):
+            det = b[l]*c-b*c[l]
+            X, Y = (c[l]*a-c*a[l])/det, -(b[l]*a-b*a[l])/det
+        s0, s1 = sorted([p0[l] @ d, p1[l] @ d])
+        s = X*d[0]+Y*d[1]
+        s = np.sort(np.concatenate([[s0, s1], s[np.isfinite(s) & (s0<s) & (s<s1)]]))
+        
+        mid = 0.5*(s[:-1]+s[1:])[np.diff(s)>length]
+        lines += [l]*len(mid)
+        points.append(p0[l][:, None]+(mid-p0[l] @ d)*d[:, None])
+        normals.append(np.repeat(np.array([[b[l]], [c[l]]])/np.hypot(b[l], c[l]), len(mid), axis=1))
+    
+    return np.array(lines, dtype=int), np.concatenate(points+[np.zeros((2, 0))], axis=1), np.concatenate(normals+[np.zeros((2, 0))], axis=1)
+
+#Whether the paths from the points A to the points B (2, n) cross an active segment of a line
+def _blocked(A, B, a, b, c, active, p0, p1):
+    fa = a[:, None]+b[:, None]*A[0]+c[:, None]*A[1]
+    fb = a[:, None]+b[:, None]*B[0]+c[:, None]*B[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = fa/(fa-fb)
+        X, Y = A[0]+t*(B[0]-A[0]), A[1]+t*(B[1]-A[1])
+    eps = 1e-9*(1+np.abs(np.stack([X, Y])))
+    lo, hi = np.minimum(p0, p1).T[:, :, None], np.maximum(p0, p1).T[:, :, None]
+    on = active[:, None] & np.all((lo-eps<=np.stack([X, Y])) & (np.stack([X, Y])<=hi+eps), axis=0)
+    return np.any(((fa>0)!=(fb>0)) & on, axis=0)
+
+#The crossings of the lines between neighbouring pixels (p, q: flat indexes) with different signs.
+#Returns the pixels, the lines and whether each crossing is on the active segment of its line.
+def _crossings(sides, p, q, x, y, a, b, c, active, p0, p1):
+    k, l = np.nonzero(sides[:, p]!=sides[:, q])
+    p, q = p[l], q[l]
+
+    #The crossing is on the line, between the pixels: within the bounding box of the segment
+    X, Y = x[p], y[p]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = np.where(x[p]!=x[q], -(a[k]+c[k]*Y)/b[k], X)
+        Y = np.where(y[p]!=y[q], -(a[k]+b[k]*X)/c[k], Y)
+    eps = 1e-9*(1+np.abs(np.stack([X, Y])))
+    lo, hi = np.minimum(p0[k], p1[k]).T, np.maximum(p0[k], p1[k]).T
+    on = active[k] & np.all((lo-eps<=np.stack([X, Y])) & (np.stack([X, Y])<=hi+eps), axis=0)
+
+    return p, q, k, on
+
+#The labels (height, width) of the regions of the map at P, uint8 indexes in the names ('' first: outside of the
+#regions). names(bounds ids of the regions) -> [(region, name)], as the name parsers of the maps (only the lines of the
+#bounds ids are used, not their order).
+def _rasterize(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple, names, width: int, height: int):
+    ids = list(lines.keys())
+    compiled = _line_logic._compile_map(lines)
+    b, c = compiled['b'], compiled['c']
+    a = np.array([lines[key]['coeffs'](P)[0] for key in ids], dtype=float)
+    active, p0, p1 = _line_logic._clip_lines(lines, P, a, x_bounds, y_bounds)
+
+    #---------------------------Cells: the sides of all lines---------------------------
+    x, y = _grid(x_bounds, y_bounds, width, height)
+    X, Y = [value.ravel() for value in np.meshgrid(x, y)]
+    sides = (a[:, None, None]+b[:, None, None]*x[None, None, :]+c[:, None, None]*y[None, :, None] > 0).reshape(len(a), -1)
+
+    #The cells numbered by the runs of the same words along the rows
+    words = _words(a, b, c, X, Y)
+    starts = np.flatnonzero(np.concatenate([[True], np.any(words[1:]!=words[:-1], axis=1)]))
+    keys, runs = np.unique(words[starts], axis=0, return_inverse=True)
+    cell = np.repeat(runs.ravel(), np.diff(np.append(starts, len(words))))
+
+    #---------------------------Regions: cells joined across the inactive lines---------------------------
+    pixels = np.arange(width*height).reshape(height, width)
+    p = np.concatenate([pixels[:, :-1].ravel(), pixels[:-1, :].ravel()])
+    q = np.concatenate([pixels[:, 1:].ravel(), pixels[1:, :].ravel()])
+    differ = cell[p]!=cell[q]
+    p, q, k, on = _crossings(sides, p[differ], q[differ], X, Y, a, b, c, active, p0, p1)
+
+    #A pair of pixels is separated if any line between them is active there
+    pairs = np.unique(p*(width*height)+q, return_inverse=True)[1].ravel()
+    separated = np.bincount(pairs, weights=on, minlength=pairs.max()+1 if len(pairs) else 0)
+    joined = np.unique(np.stack([cell[p], cell[q]], axis=1)[separated[pairs]==0], axis=0)
+    region = _join(len(keys), joined)
+    
+    #---------------------------Names from the bounding lines---------------------------
+    #The lines between neighbouring pixels separated by one line (near a vertex each pixel can be on another line)
+    regions = list(np.unique(region[cell]))
+    bounds = [set() for _ in regions]
+    single = on & (separated[pairs]==1)
+    for r, l in set(zip(region[cell[np.concatenate([p[single], q[single]])]].tolist(), np.concatenate([k[single], k[single]]).tolist())):
+        bounds[regions.index(r)].add(ids[l])
+    
+    #The lines of the regions on both sides of the pieces of the active lines, for the edges shorter than the pixels: the
+    #region of the nearest pixel that can be reached from next to the piece without crossing an active line
+    delta = 1e-9*max(x_bounds[1]-x_bounds[0], y_bounds[1]-y_bounds[0])
+    k, points, normals = _pieces(a, b, c, active, p0, p1, 10*delta)
+    for side in [1, -1]:
+        start = points+side*delta*normals
+        column = np.rint((start[0]-x_bounds[0])/(x_bounds[1]-x_bounds[0])*width-0.5).astype(int)
+        row = np.rint((y_bounds[1]-start[1])/(y_bounds[1]-y_bounds[0])*height-0.5).astype(int)
+        near = np.arange(-2, 3)
+        near = np.clip(row[:, None, None]+near[None, :, None], 0, height-1)*width+np.clip(column[:, None, None]+near[None, None, :], 0, width-1)
+        near = near.reshape(len(k), -1)
+        
+        ends = np.stack([X[near], Y[near]]).reshape(2, -1)
+        distance = np.hypot(ends[0]-np.repeat(start[0], near.shape[1]), ends[1]-np.repeat(start[1], near.shape[1]))
+        distance[_blocked(np.repeat(start, near.shape[1], axis=1), ends, a, b, c, active, p0, p1)] = np.inf
+        distance = distance.reshape(near.shape)
+        
+        found = np.isfinite(np.min(distance, axis=1, initial=np.inf))
+        nearest = near[np.arange(len(k)), np.argmin(distance, axis=1)]
+        for l, r in zip(k[found], region[cell[nearest[found]]]):
+            bounds[regions.index(r)].add(ids[l])
+    region = region[cell]
+
+    #The regions without bounding lines (smaller than the pixels) are left without a name
+    bounded = [r for r, ids_ in enumerate(bounds) if ids_]
+    named = [(bounded[f], name) for f, name in names(tuple(tuple(sorted(bounds[r])) for r in bounded))]
+    table = ['']+sorted(set(name for _, name in named))
+    codes = np.zeros(len(regions), dtype=np.uint8)
+    for f, name in named:
+        codes[f] = table.index(name)
+
+    return {'labels': codes[np.searchsorted(regions, region)].reshape(height, width), 'names': table, 'x': x, 'y': y}
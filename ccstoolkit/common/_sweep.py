@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import itertools
+import numpy as np
+
+from . import _line_logic
+
+#Event matrices of the maps, by map
+_matrices = dict()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#The topology of a map can only change where
+#   three lines (or a line and the sides of the bounding box) go through one point: det([a b c]) = 0, or
+#   a rule of a line changes its sign at a point where the line meets another: w.a+u*x+v*y = 0.
+#Both are linear in the intercepts a of the lines (the slopes don't depend on P): M @ a = 0.
+#Returns {'M': (events, lines), 'extra': referenced lines outside of the map, 'box': intercepts of the sides (4,)}
+def _event_matrix(lines: dict, x_bounds: tuple, y_bounds: tuple):
+    key = (id(lines), tuple(x_bounds), tuple(y_bounds))
+    if key in _matrices and _matrices[key][0] is lines:
+        return _matrices[key][1]
+
+    compiled = _line_logic._compile_map(lines)
+    L = len(lines)
+
+    #The lines: the lines of the map, the other referenced lines and the sides of the bounding box (a+b*x+c*y=0)
+    extra = [ref for ref in compiled['refs'] if not isinstance(ref, int)]
+    b = np.concatenate([compiled['b'], [ref['slopes'][0] for ref in extra], [1, 1, 0, 0]]).astype(float)
+    c = np.concatenate([compiled['c'], [ref['slopes'][1] for ref in extra], [0, 0, 1, 1]]).astype(float)
+    E = len(b)
+
+    rows = list()
+
+    #---------------------------Three lines through one point---------------------------
+    triples = np.array([t for t in itertools.combinations(range(E), 3) if t[0]<L], dtype=int).reshape(-1, 3)
+    i, j, k = triples.T
+    M = np.zeros((len(triples), E))
+    np.add.at(M, (np.arange(len(triples)), i), b[j]*c[k]-b[k]*c[j])
+    np.add.at(M, (np.arange(len(triples)), j), -(b[i]*c[k]-b[k]*c[i]))
+    np.add.at(M, (np.arange(len(triples)), k), b[i]*c[j]-b[j]*c[i])
+    rows.append(M)
+
+    #---------------------------Rules at the points where their line meets the others---------------------------
+    refs = [ref if isinstance(ref, int) else L+extra.index(ref) for ref in compiled['refs']]
+    for h, l in enumerate(compiled['owner']):
+        w = np.zeros(E)
+        np.add.at(w, refs, compiled['W'][h])
+        u, v = compiled['u'][h], compiled['v'][h]
+
+        #A rule on P only
+        if u==0 and v==0:
+            rows.append(w[None, :])
+            continue
+
+        #x = (c_l*a_m-c_m*a_l)/det and y = -(b_l*a_m-b_m*a_l)/det at the intersection with line m
+        m = np.array([m for m in range(E) if m!=l and abs(b[l]*c[m]-b[m]*c[l])>=1e-9], dtype=int)
+        det = b[l]*c[m]-b[m]*c[l]
+        M = np.repeat(w[None, :], len(m), axis=0)
+        M[np.arange(len(m)), m] += (u*c[l]-v*b[l])/det
+        M[:, l] += (-u*c[m]+v*b[m])/det
+        rows.append(M)
+
+    M = np.concatenate(rows, axis=0)
+    M = M[np.any(np.abs(M[:, :E-4])>1e-12, axis=1)]                         #Not constant
+
+    matrix = {'M': np.unique(M, axis=0), 'extra': extra, 'box': -np.array([x_bounds[0], x_bounds[1], y_bounds[0], y_bounds[1]], dtype=float)}
+    _matrices[key] = (lines, matrix)
+    return matrix
+
+#The intercepts (lines, m) of the lines of the event matrix of a map for the columns of P = {key: array (m,)}
+def _intercepts(lines: dict, matrix: dict, P: dict):
+    m = len(next(iter(P.values())))
+    a = [np.broadcast_to(np.asarray(line['coeffs'](P)[0], dtype=float), (m,)) for line in list(lines.values())+matrix['extra']]
+    return np.concatenate([np.array(a).reshape(-1, m), np.repeat(matrix['box'][:, None], m, axis=1)], axis=0)
+
+#Follow P = {key: scalar} along s (grid, increasing), with P[param] = value(s). The event functions of the maps are
+#bracketed on the grid and their roots found by bisection (all at once). The topologies (topologies(P columns) ->
+#list of hashable) are compared on both sides of the roots; the changes between grid points that no event explains
+#are found by bisection on the topologies. s is changed by less than tol.
+#Returns the breakpoints (values of s) and the topologies of the pieces (one more than the breakpoints).
+def _sweep(maps: list, P: dict, param: str, grid, value, topologies, tol: float):
+    columns = lambda s: {key: np.full(len(s), p, dtype=float) for key, p in P.items() if key!=param} | {param: value(np.asarray(s, dtype=float))}
+    
+    #The event functions of all maps as one block diagonal matrix
+    matrices = [_event_matrix(lines, x_bounds, y_bounds) for lines, x_bounds, y_bounds in maps]
+    M = np.zeros((sum(len(matrix['M']) for matrix in matrices), sum(matrix['M'].shape[1] for matrix in matrices)))
+    i, j = 0, 0
+    for matrix in matrices:
+        M[i:i+matrix['M'].shape[0], j:j+matrix['M'].shape[1]] = matrix['M']
+        i, j = i+matrix['M'].shape[0], j+matrix['M'].shape[1]
+    intercepts = lambda s: np.concatenate([_intercepts(lines, matrix, columns(s)) for (lines, _, _), matrix in zip(maps, matrices)], axis=0)
+
+    #---------------------------Roots of the event functions---------------------------
+    F = M @ intercepts(grid)
+    with np.errstate(invalid='ignore'):
+        r, k = np.nonzero(np.sign(F[:, :-1])*np.sign(F[:, 1:])<0)
+    roots = grid[np.any(F==0, axis=0)]
+
+    #Bisection of all brackets at once
+    lo, hi = grid[k].astype(float), grid[k+1].astype(float)
+    sign = np.sign(F[r, k])
+    while len(r) and np.max(hi-lo)>tol:
+        mid = 0.5*(lo+hi)
+        same = np.sign(np.einsum('ne,en->n', M[r], intercepts(mid)))==sign
+        lo, hi = np.where(same, mid, lo), np.where(same, hi, mid)
+    roots = np.unique(np.concatenate([roots, 0.5*(lo+hi)]))
+
+    #---------------------------Topologies between the candidate points---------------------------
+    points = np.unique(np.concatenate([grid, roots]))
+    points = points[np.concatenate([[True], np.diff(points)>tol])]
+    middle = 0.5*(points[:-1]+points[1:])
+    pieces = topologies(columns(middle))
+
+    breakpoints, result = list(), [pieces[0]]
+    for p, (before, after) in enumerate(zip(pieces[:-1], pieces[1:])):
+        if after==before:
+            continue
+
+        at = points[p+1]
+        #A change at a grid point that no event explains: find it by bisection
+        if not np.any(np.abs(roots-at)<=tol):
+            a, b = middle[p], middle[p+1]
+            while b-a>tol:
+                c = 0.5*(a+b)
+                a, b = (c, b) if topologies(columns([c]))[0]==before else (a, c)
+            at = 0.5*(a+b)
+
+        breakpoints.append(float(at))
+        result.append(after)
+
+    return breakpoints, result
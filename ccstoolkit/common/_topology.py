@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import numpy as np
+
+from . import _line_logic
+
+#One engine per map (lines), kept between the calls
+_engines = dict()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Engine
+#===================================================================================================================
+#The regions of one map for one P at a time. The slopes of the lines don't depend on P (_line_logic._compile_map),
+#only the intercepts move with P. The faces found by the face walk (_line_logic._get_faces) are kept with the
+#signature of the graph of the active lines (_line_logic._graph_signatures). While the signature stays the same (the same active lines and vertices, the
+#same order of the points along the bounding box and of the angles of the edges), only the coordinates of the
+#vertices, the areas and the centroids are updated. Otherwise the faces are found again.
+class _Engine:
+    def __init__(self, lines: dict, x_bounds: tuple, y_bounds: tuple):
+        self.lines, self.x_bounds, self.y_bounds = lines, x_bounds, y_bounds
+        self.ids = list(lines.keys())
+
+        #---------------------------Cached topology---------------------------
+        self.signature = None
+        self.faces = None
+        self.walks = 0                                         #Number of face walks
+
+    #The faces of the graph as flat arrays: the labels of the points, the labels of the previous and the next point and
+    #the face of each point
+    def _set_faces(self, faces: list):
+        sizes = [len(face['labels']) for face in faces]
+        starts = np.cumsum([0]+sizes[:-1])
+        labels = np.concatenate([face['labels'] for face in faces])
+        position = np.arange(len(labels))-np.repeat(starts, sizes)
+        sizes_ = np.repeat(sizes, sizes)
+
+        self.faces = {
+            'bounds ids': [face['bounds ids'] for face in faces],
+            'labels': labels,
+            'previous': labels[np.repeat(starts, sizes)+(position-1)%sizes_],
+            'next': labels[np.repeat(starts, sizes)+(position+1)%sizes_],
+            'face': np.repeat(np.arange(len(faces)), sizes),
+            'slices': [slice(start, start+size) for start, size in zip(starts, sizes)]
+        }
+
+    #The regions for P in the format of _line_logic._get_regions
+    def regions(self, P: dict):
+        a = np.array([self.lines[key]['coeffs'](P)[0] for key in self.ids], dtype=float)
+
+        active, p0, p1 = _line_logic._clip_lines(self.lines, P, a, self.x_bounds, self.y_bounds)
+        p0, p1 = np.round(p0, 6), np.round(p1, 6)
+        V, labels, unique, signature = _line_logic._graph_signatures(active[:, None], p0[:, None], p1[:, None], self.x_bounds, self.y_bounds)
+
+        #---------------------------Face walk only if the topology changed---------------------------
+        if self.signature is None or not np.array_equal(signature, self.signature):
+            self._set_faces(_line_logic._face_labels(_line_logic._compile_arrays(self.lines), active[:, None], p0[:, None], p1[:, None], V, labels, unique, 0, self.x_bounds, self.y_bounds))
+            self.signature = signature
+            self.walks += 1
+
+        #---------------------------Areas and centroids of all faces at once---------------------------
+        faces, V = self.faces, V[0]
+        x, y = V[faces['labels'], 0], V[faces['labels'], 1]
+
+        #The same sums as _math._polygon_area and _math._calculate_centroid
+        n = len(faces['bounds ids'])
+        area = np.bincount(faces['face'], x*V[faces['next'], 1]-V[faces['next'], 0]*y, minlength=n)/2
+        cross = x*V[faces['previous'], 1]-y*V[faces['previous'], 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centroid = np.stack([np.bincount(faces['face'], (x+V[faces['previous'], 0])*cross, minlength=n), np.bincount(faces['face'], (y+V[faces['previous'], 1])*cross, minlength=n)], axis=1)/(6.0*(0.5*np.bincount(faces['face'], cross, minlength=n)))[:, None]
+
+        points = V[faces['labels']].tolist()
+
+        #The inner faces, already sorted by their bounds ids
+        return [{
+            'bounds ids': faces['bounds ids'][f],
+            'area': float(area[f]),
+            'centroid': centroid[f],
+            'points': [tuple(p) for p in points[faces['slices'][f]]]
+        } for f in np.flatnonzero(area>0)]
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#The engine of a map (lines), created with the first call
+def _get_engine(lines: dict, x_bounds: tuple, y_bounds: tuple):
+    key = (id(lines), tuple(x_bounds), tuple(y_bounds))
+    if key not in _engines or _engines[key].lines is not lines:
+        _engines[key] = _Engine(lines, x_bounds, y_bounds)
+    return _engines[key]
+
+#The same as _line_logic._get_regions, with the topology of the map kept from the previous call
+def _get_regions_incremental(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    return _get_engine(lines, x_bounds, y_bounds).regions(P)
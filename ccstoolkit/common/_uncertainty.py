@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import numpy as np
+
+from ._substances import get_substances_TD_data
+
+R = 8.314                                                                                   #[J/K/mol]
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Data
+#===================================================================================================================
+#Default standard uncertainties of the TD data. The elements in their reference state have dfg = dfh = 0 by definition.
+_sigma = {
+    'dfg': 1.0,                                                #[kJ/mol]
+    'dfh': 1.0,                                                #[kJ/mol]
+    'cp': 0.05,                                                #Relative
+    'cp min': 1.0,                                             #[J/mol/K]
+    'cp missing': 30.0                                         #[J/mol/K]   #cp = 0 in the table, e.g. FeSO4.H2O
+}
+
+_properties = ['dfg','dfh','cp']
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#Standard uncertainties of all substances. sigma = {substance: {'dfg': ..., 'dfh': ..., 'cp': ...}} overrides the defaults.
+def _get_sigma(sigma: dict = None):
+    sigma = sigma or dict()
+    substances = get_substances_TD_data()
+
+    result = dict()
+    for name, data in substances.items():
+        reference = data['dfg'] == 0 and data['dfh'] == 0
+        result[name] = {
+            'dfg': 0.0 if reference else _sigma['dfg'],
+            'dfh': 0.0 if reference else _sigma['dfh'],
+            'cp': _sigma['cp missing'] if data['cp'] == 0 else max(_sigma['cp min'], _sigma['cp']*abs(data['cp']))
+        } | sigma.get(name, dict())
+
+    return result
+
+#n samples of the perturbations of the TD data, {substance: {'dfg': array, 'dfh': array, 'cp': array}}
+def _sample(n: int, sigma: dict = None, seed=None):
+    rng = np.random.default_rng(seed)
+
+    return {name: {key: rng.normal(0, s[key], n) if s[key] else np.zeros(n) for key in _properties} for name, s in _get_sigma(sigma).items()}
+
+#Perturbations of lgK_p of the reactions for the perturbations of the TD data.
+#lnK_chi is linear in drg, drh and drcp and these are linear in dfg, dfh and cp, so the perturbation is exact.
+def _dlgK(reactions: dict, deltas: dict, T):
+    dlgK = dict()
+    for key, reaction in reactions.items():
+        d = {prop: sum([c*deltas[s][prop] for s, c in zip(reaction['reaction']['substances'], reaction['reaction']['coeffs'])]) for prop in _properties}
+
+        drg, drh, drcp = d['dfg']*1e3, d['dfh']*1e3, d['cp']                                #[J/mol], [J/mol], [J/mol/K]
+        dlnK = -drg/R/298.15 + drcp/R*np.log(T/298.15) - (drh-298.15*drcp)/R*(298.15-T)/T/298.15
+
+        dlgK[key] = dlnK/np.log(10)
+
+    return dlgK
+
+#Summary of samples along the first axis: mean, standard deviation, median and the central interval ci
+def _interval(samples, ci: float = 0.95):
+    samples = np.asarray(samples, dtype=float)
+    if not len(samples):
+        return {'mean': np.nan, 'std': np.nan, 'median': np.nan, 'low': np.nan, 'high': np.nan}
+
+    low, median, high = np.percentile(samples, [50*(1-ci), 50, 50*(1+ci)], axis=0)
+
+    return {'mean': float(np.mean(samples)), 'std': float(np.std(samples)), 'median': float(median), 'low': float(low), 'high': float(high)}
@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 
-from .stability_maps import get_stability_maps
+from .stability_maps import get_stability_maps, get_stability_maps_many, get_stability_maps_uncertainty, aget_stability_maps, classify_points, get_stability_maps_sweep, build_stability_maps_atlas, get_stability_maps_atlas, get_stability_maps_raster
+from .corrosion_risk import get_corrosion_risk, stream_corrosion_risk
+from .plots import save_stability_maps_plots
 
-__all__ = ["get_stability_maps"]
+__all__ = ["get_stability_maps","get_stability_maps_many","get_stability_maps_uncertainty","aget_stability_maps","classify_points","get_stability_maps_sweep","build_stability_maps_atlas","get_stability_maps_atlas","get_stability_maps_raster","get_corrosion_risk","stream_corrosion_risk","save_stability_maps_plots"]
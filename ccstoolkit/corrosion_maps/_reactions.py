@@ -3,10 +3,13 @@
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Import
 #===================================================================================================================
+import os
 import re
+import json
+import hashlib
+import threading
 import numpy as np
 
-import ccstoolkit.common._math as _math
 import ccstoolkit.common._line_logic as _line_logic
 import ccstoolkit.common._substances as _substances_
 
@@ -147,144 +150,226 @@ _rules_Fe_S = {                                  #Corrosion products of steel/Fe
     'FeSO4.7H2O/H2S/FeS2': [('below', 'FeSO4.7H2O/S/FeS2')]  
 }
 
+#Special rules, in place of ('special') in the rules above
+_special_rules_Fe_N = {
+    'Fe2O3/FeO(OH)': [('any', [('below', 'Fe(NO3)2/NO2/FeO(OH)'), ('below', 'Fe2O3/NO/Fe(NO3)2'), ('right of', ('Fe(NO3)2/HNO3/FeO(OH)', 'Fe(NO3)2/NO2/FeO(OH)'))])],
+    #Rules on P only: the order of two intersections of 'Fe2O3/NO2/Fe(NO3)2'
+    'Fe(NO3)2/HNO3/FeO(OH)': [('left of', ('Fe2O3/HNO3/Fe(NO3)2', 'Fe2O3/NO2/Fe(NO3)2'), ('Fe(NO3)2/HNO3/FeO(OH)', 'Fe2O3/NO2/Fe(NO3)2'))],
+    'Fe2O3/HNO3/Fe(NO3)2': [('right of', ('Fe2O3/HNO3/Fe(NO3)2', 'Fe2O3/NO2/Fe(NO3)2'), ('Fe(NO3)2/HNO3/FeO(OH)', 'Fe2O3/NO2/Fe(NO3)2'))]
+}
+
+_special_rules_Fe_S = {
+    'FeSO4.H2O/FeSO4': [('any', [('below', 'FeSO4/SO2/Fe2(SO4)3'), ('below', 'FeSO4/S/Fe2(SO4)3')])]
+}
+
+for rules, special_rules in [(_rules_Fe_N, _special_rules_Fe_N), (_rules_Fe_S, _special_rules_Fe_S)]:
+    for key, special in special_rules.items():
+        rules[key] = [rule for rule in rules[key] if rule != 'special']+special
+
+#The rules of each map
+_rules = {
+    'O': _rules_Fe_O,
+    'C': _rules_Fe_C,
+    'N': _rules_Fe_N,
+    'S': _rules_Fe_S,
+}
+
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Calculate/format/etc.
 #===================================================================================================================
-#Parse the reactions
-for key, reaction in _reactions.items():
-    reaction['key'] = key
-    
-    #---------------------------Extract the reactants, product and coefficients---------------------------
-    r = reaction['reaction']['reaction']
-    r = r.replace(' ','').split('<=>')
-    lhs, rhs = r
-    
-    #Reactants
-    #'^(\d+(?:/\d+)?)?([A-Za-z].*)' matches all digits before the first non-digit (except '/')
-    lhs_coeffs = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(1) for i in lhs.split('+')]
-    lhs_coeffs = [(int(coeff.split('/')[0])/int(coeff.split('/')[1]) if '/' in coeff else int(coeff)) if coeff else 1 for coeff in lhs_coeffs]
-    lhs_substances = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(2) for i in lhs.split('+')]
-    
-    reaction['reaction']['lhs'] = {'substances': lhs_substances, 'coeffs': lhs_coeffs}
-    
-    #Products
-    rhs_coeffs = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(1) for i in rhs.split('+')]
-    rhs_coeffs = [(int(coeff.split('/')[0])/int(coeff.split('/')[1]) if '/' in coeff else int(coeff)) if coeff else 1 for coeff in rhs_coeffs]
-    rhs_substances = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(2) for i in rhs.split('+')]
-    
-    reaction['reaction']['rhs'] = {'substances': rhs_substances, 'coeffs': rhs_coeffs}
+#The reactions are parsed and the lines are formed on the first call of get_reactions or get_lines, not on import.
+#The numeric tables of the reactions are loaded from a precompiled artifact (save_tables), if there is one
+#for the same reactions and thermodynamic data.
+_tables_path = os.environ.get('CCSTOOLKIT_TABLES', os.path.join(os.path.dirname(os.path.abspath(__file__)), '_reactions.npy'))
+
+_lines = None
+_lock = threading.Lock()
+
+#Hash of the reactions and the thermodynamic data
+def _tables_hash():
+    data = json.dumps([{key: reaction['reaction']['reaction'] for key, reaction in _reactions.items()}, _substances], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+#Parse the reactions into a numeric table, one record per reaction:
+#   'key', 'hash' (of the reactions and the thermodynamic data)
+#   'substances', 'coeffs' (terms,): the substances and their coefficients in the order of the equation, with a minus
+#   for the reactants; '' and 0 after the last term
+#   'lhs': number of reactants
+#   'drg', 'drh', 'drcp', 'nur'
+#   'slopes' (5,): coefficients of H2O, O2, CO2, Ntot and Stot
+def _parse_reactions():
+    parsed = list()
+    for key, reaction in _reactions.items():
+        #---------------------------Extract the reactants, product and coefficients---------------------------
+        r = reaction['reaction']['reaction']
+        r = r.replace(' ','').split('<=>')
+        lhs, rhs = r
+        
+        #Reactants
+        #'^(\d+(?:/\d+)?)?([A-Za-z].*)' matches all digits before the first non-digit (except '/')
+        lhs_coeffs = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(1) for i in lhs.split('+')]
+        lhs_coeffs = [(int(coeff.split('/')[0])/int(coeff.split('/')[1]) if '/' in coeff else int(coeff)) if coeff else 1 for coeff in lhs_coeffs]
+        lhs_substances = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(2) for i in lhs.split('+')]
+        
+        #Products
+        rhs_coeffs = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(1) for i in rhs.split('+')]
+        rhs_coeffs = [(int(coeff.split('/')[0])/int(coeff.split('/')[1]) if '/' in coeff else int(coeff)) if coeff else 1 for coeff in rhs_coeffs]
+        rhs_substances = [re.match(r'^(\d+(?:/\d+)?)?([A-Za-z].*)', i).group(2) for i in rhs.split('+')]
+        
+        #All coefficients (with a minus for the reactants) and substances
+        parsed.append((key, lhs_substances+rhs_substances, [-i for i in lhs_coeffs]+rhs_coeffs, len(lhs_substances)))
     
-    #All coefficients (with a minus for the reactants) and substances
-    coeffs = [-i for i in lhs_coeffs]+rhs_coeffs
-    subs = lhs_substances+rhs_substances
-    reaction['reaction']['coeffs'] = coeffs
-    reaction['reaction']['substances'] = subs
+    width = max([len(subs) for _, subs, _, _ in parsed])
+    dtype = [('key', 'U64'), ('hash', 'U16'), ('substances', 'U16', (width,)), ('coeffs', float, (width,)), ('lhs', int),
+             ('drg', float), ('drh', float), ('drcp', float), ('nur', float), ('slopes', float, (5,))]
+    table = np.zeros(len(parsed), dtype=dtype)
+    table['hash'] = _tables_hash()
     
-    #---------------------------Calculate the free energy of the reaction---------------------------
-    drg = 0
-    drh = 0
-    drcp = 0
-    nur = 0
-    for s,c in zip(subs,coeffs):
-        drg += _substances[s]['dfg']*c
-        drh += _substances[s]['dfh']*c
-        drcp += _substances[s]['cp']*c
-        nur += c*(not _substances[s]['solid'])
+    for k, (key, subs, coeffs, lhs) in enumerate(parsed):
+        table['key'][k] = key
+        table['substances'][k, :len(subs)] = subs
+        table['coeffs'][k, :len(subs)] = coeffs
+        table['lhs'][k] = lhs
         
-    reaction['drg'] = drg*1e3                                                                        #[J/mol]
-    reaction['drh'] = drh*1e3                                                                        #[J/mol]
-    reaction['drcp'] = drcp                                                                          #[J/mol/K]
-    reaction['nur'] = nur
-    
-    #---------------------------Calculate the equilibrium constant of the reaction---------------------------
-    reaction['K_chi_298'] = np.exp(-(reaction['drg'])/R/298.15)
-    reaction['K_chi'] = lambda T, reaction=reaction: reaction['K_chi_298']*(T/298.15)**(reaction['drcp']/R)*np.exp(-(reaction['drh']-298.15*reaction['drcp'])/R*(298.15-T)/T/298.15)
+        #---------------------------Calculate the free energy of the reaction---------------------------
+        drg = 0
+        drh = 0
+        drcp = 0
+        nur = 0
+        for s,c in zip(subs,coeffs):
+            drg += _substances[s]['dfg']*c
+            drh += _substances[s]['dfh']*c
+            drcp += _substances[s]['cp']*c
+            nur += c*(not _substances[s]['solid'])
+        
+        table['drg'][k] = drg*1e3                                                                   #[J/mol]
+        table['drh'][k] = drh*1e3                                                                   #[J/mol]
+        table['drcp'][k] = drcp                                                                     #[J/mol/K]
+        table['nur'][k] = nur
+        
+        #---------------------------Equation in the from a+b*lgH2O+c*lgO2=0---------------------------
+        #Substances that will be approximated by Ntot and Stot. There should be only one by equation...
+        coeff = lambda names: sum([c for s, c in zip(subs, coeffs) if s in names])
+        table['slopes'][k] = [coeff(['H2O']), coeff(['O2']), coeff(['CO2']), coeff(['NO2','HNO3']), coeff(['COS','H2S','SO2','SO3','H2SO4'])]
     
-    reaction['K_p'] = lambda T, reaction=reaction: reaction['K_chi'](T)*(1e5/R/T)**reaction['nur']
-    reaction['lgK_p'] = lambda T, reaction=reaction: np.log10(reaction['K_p'](T))
+    return table
+
+#The table of the artifact, None if there is none or it is out of date
+def _load_tables(path: str):
+    try:
+        table = np.load(path)
+        current = table['key'].tolist() == list(_reactions.keys()) and str(table['hash'][0]) == _tables_hash()
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
     
-    #---------------------------Equation in the from a+b*lgH2O+c*lgO2=0---------------------------
-    ind = subs.index('O2') if 'O2' in subs else None
-    coeff_O2 = coeffs[ind] if ind is not None else 0
+    return table if current else None
 
-    ind = subs.index('H2O') if 'H2O' in subs else None
-    coeff_H2O = coeffs[ind] if ind is not None else 0
+#The coefficients as in the equations: int if whole
+def _number(c: float):
+    return int(c) if c == int(c) else float(c)
 
-    ind = subs.index('CO2') if 'CO2' in subs else None
-    coeff_CO2 = coeffs[ind] if ind is not None else 0
-    
-    #Substances that will be approximated by Ntot
-    inds = [subs.index(i) if i in subs else None for i in ['NO2','HNO3']]
-    #There should be only one by equation...
-    coeff_Ntot = sum([coeffs[ind] if ind is not None else 0 for ind in inds])
-
-    #Substances that will be approximated by Stot
-    inds = [subs.index(i) if i in subs else None for i in ['COS','H2S','SO2','SO3','H2SO4']]
-    #There should be only one by equation...
-    coeff_Stot = sum([coeffs[ind] if ind is not None else 0 for ind in inds])
+#Fill in the reactions from the table and form the lines of the maps
+def _build():
+    global _lines
     
-    #P = {'S': 1, 'N': 1, 'C': 2000, 'T': 298.15}   <---------   Important!!!
-    #The intercept of the equations is a function of the composition.
-    intercept = lambda P, lgKp=_reactions[key]['lgK_p'], c_s=coeff_Stot, c_n=coeff_Ntot, c_c=coeff_CO2: -lgKp(P['T'])+c_s*np.log10(P['S'])+c_n*np.log10(P['N'])+c_c*np.log10(P['CO2'])
-    slope_x = coeff_H2O
-    slope_y = coeff_O2
+    table = _load_tables(_tables_path)
+    if table is None:
+        table = _parse_reactions()
     
-    reaction['line'] = {'equation': 'c[0](P)+c[1]*lgH2O+c[2]*lgO2=0 '}
-    reaction['line']['coeffs'] = lambda P, c=(intercept,slope_x,slope_y): (c[0](P),c[1],c[2])
-    
-    #---------------------------Equations in the form lgH2O=f(lgO2) and lgO2=f(lgH2O)---------------------------
-    reaction['line']['x'] = lambda y, P, c=(intercept,slope_x,slope_y): -(c[0](P)+c[2]*y)/c[1]
-    reaction['line']['y'] = lambda x, P, c=(intercept,slope_x,slope_y): -(c[0](P)+c[1]*x)/c[2]
-    
-    #---------------------------Is the line horizontal/vertical---------------------------
-    reaction['line']['vertical'] = coeff_O2 == 0
-    reaction['line']['horizontal'] = coeff_H2O == 0 
-    
-#Create the lines dicts
-_lines_Fe_O = _line_logic._form_lines(_rules_Fe_O,{key: item['line'] for key,item in _reactions.items()})
-_lines_Fe_C = _line_logic._form_lines(_rules_Fe_C,{key: item['line'] for key,item in _reactions.items()})
-_lines_Fe_N = _line_logic._form_lines(_rules_Fe_N,{key: item['line'] for key,item in _reactions.items()})
-_lines_Fe_S = _line_logic._form_lines(_rules_Fe_S,{key: item['line'] for key,item in _reactions.items()})
-
-#Add special rules
-def _special_rule_Fe2O3_FeOOH(x,y,P):
-    r1 = y < _reactions['Fe(NO3)2/NO2/FeO(OH)']['line']['y'](x,P)
-    r2 = y < _reactions['Fe2O3/NO/Fe(NO3)2']['line']['y'](x,P)
-    r3 = x > _math._intersection(_reactions['Fe(NO3)2/HNO3/FeO(OH)']['line'], _reactions['Fe(NO3)2/NO2/FeO(OH)']['line'], P)[0]
+    for row, (key, reaction) in zip(table, _reactions.items()):
+        reaction['key'] = key
+        
+        #---------------------------The reactants, product and coefficients---------------------------
+        subs = [s for s in row['substances'].tolist() if s]
+        coeffs = [_number(c) for c in row['coeffs'][:len(subs)]]
+        lhs = int(row['lhs'])
+        
+        reaction['reaction']['lhs'] = {'substances': subs[:lhs], 'coeffs': [-c for c in coeffs[:lhs]]}
+        reaction['reaction']['rhs'] = {'substances': subs[lhs:], 'coeffs': coeffs[lhs:]}
+        reaction['reaction']['coeffs'] = coeffs
+        reaction['reaction']['substances'] = subs
+        
+        reaction['drg'] = float(row['drg'])                                                         #[J/mol]
+        reaction['drh'] = float(row['drh'])                                                         #[J/mol]
+        reaction['drcp'] = float(row['drcp'])                                                       #[J/mol/K]
+        reaction['nur'] = _number(row['nur'])
+        
+        #---------------------------Calculate the equilibrium constant of the reaction---------------------------
+        reaction['K_chi_298'] = np.exp(-(reaction['drg'])/R/298.15)
+        reaction['K_chi'] = lambda T, reaction=reaction: reaction['K_chi_298']*(T/298.15)**(reaction['drcp']/R)*np.exp(-(reaction['drh']-298.15*reaction['drcp'])/R*(298.15-T)/T/298.15)
+        
+        reaction['K_p'] = lambda T, reaction=reaction: reaction['K_chi'](T)*(1e5/R/T)**reaction['nur']
+        reaction['lgK_p'] = lambda T, reaction=reaction: np.log10(reaction['K_p'](T))
+        
+        #---------------------------Equation in the from a+b*lgH2O+c*lgO2=0---------------------------
+        slope_x, slope_y, coeff_CO2, coeff_Ntot, coeff_Stot = [_number(c) for c in row['slopes']]
+        
+        #P = {'S': 1, 'N': 1, 'C': 2000, 'T': 298.15}   <---------   Important!!!
+        #The intercept of the equations is a function of the composition.
+        #An optional P['dlgK'] = {reaction: perturbation of lgK_p} shifts the lines (uncertainty of the TD data).
+        intercept = lambda P, k=key, lgKp=reaction['lgK_p'], c_s=coeff_Stot, c_n=coeff_Ntot, c_c=coeff_CO2: -lgKp(P['T'])-P.get('dlgK', {}).get(k, 0)+c_s*np.log10(P['S'])+c_n*np.log10(P['N'])+c_c*np.log10(P['CO2'])
+        
+        reaction['line'] = {'equation': 'c[0](P)+c[1]*lgH2O+c[2]*lgO2=0 '}
+        reaction['line']['coeffs'] = lambda P, c=(intercept,slope_x,slope_y): (c[0](P),c[1],c[2])
+        reaction['line']['slopes'] = (slope_x, slope_y)
+        reaction['line']['composition'] = (coeff_Stot, coeff_Ntot, coeff_CO2)                    #Of lgS, lgN and lgCO2 in the intercept
+        
+        #---------------------------Equations in the form lgH2O=f(lgO2) and lgO2=f(lgH2O)---------------------------
+        reaction['line']['x'] = lambda y, P, c=(intercept,slope_x,slope_y): -(c[0](P)+c[2]*y)/c[1]
+        reaction['line']['y'] = lambda x, P, c=(intercept,slope_x,slope_y): -(c[0](P)+c[1]*x)/c[2]
+        
+        #---------------------------Is the line horizontal/vertical---------------------------
+        reaction['line']['vertical'] = slope_y == 0
+        reaction['line']['horizontal'] = slope_x == 0
     
-    return r1 or r2 or r3
+    #Create the lines dicts
+    _lines = {key: _line_logic._form_lines(rules,{key: item['line'] for key,item in _reactions.items()}) for key, rules in _rules.items()}
 
-def _special_rule_FeNO32_HNO3_FeOOH(x,y,P):
-    i_1 = _math._intersection(_reactions['Fe(NO3)2/HNO3/FeO(OH)']['line'], _reactions['Fe2O3/NO2/Fe(NO3)2']['line'], P)
-    i_2 = _math._intersection(_reactions['Fe2O3/HNO3/Fe(NO3)2']['line'], _reactions['Fe2O3/NO2/Fe(NO3)2']['line'], P)
-    
-    return i_1[0] < i_2[0] 
-    
-def _special_rule_Fe2O3_HNO3_FeNO32(x,y,P):
-    i_1 = _math._intersection(_reactions['Fe(NO3)2/HNO3/FeO(OH)']['line'], _reactions['Fe2O3/NO2/Fe(NO3)2']['line'], P)
-    i_2 = _math._intersection(_reactions['Fe2O3/HNO3/Fe(NO3)2']['line'], _reactions['Fe2O3/NO2/Fe(NO3)2']['line'], P)
-    
-    return i_1[0] >= i_2[0] 
+#Build the tables once, also with several threads
+def _ensure_built():
+    if _lines is None:
+        with _lock:
+            if _lines is None:
+                _build()
 
-_lines_Fe_N['Fe2O3/FeO(OH)']['rules_f'].append(_special_rule_Fe2O3_FeOOH)
-_lines_Fe_N['Fe(NO3)2/HNO3/FeO(OH)']['rules_f'].append(_special_rule_FeNO32_HNO3_FeOOH)
-_lines_Fe_N['Fe2O3/HNO3/Fe(NO3)2']['rules_f'].append(_special_rule_Fe2O3_HNO3_FeNO32)
+#The maps as plain arrays, without closures, so the model can be pickled and sent to worker processes. For each map
+#the arrays of _line_logic._compile_arrays and the coefficients of the intercepts of its lines (and of the extra
+#lines): 'lgK' = K_chi_298, drh, drcp, nur (lines, 4) of lgK_p(T) and 'composition' = the coefficients of lgS, lgN and
+#lgCO2 (lines, 3).
+def _compile_model():
+    model = dict()
+    for key, lines in get_lines().items():
+        arrays = _line_logic._compile_arrays(lines)
+        reactions = [_reactions[k] for k in arrays['ids']+arrays['extra']]
+        model[key] = arrays | {
+            'lgK': np.array([[reaction['K_chi_298'], reaction['drh'], reaction['drcp'], reaction['nur']] for reaction in reactions], dtype=float),
+            'composition': np.array([reaction['line']['composition'] for reaction in reactions], dtype=float)
+        }
+    return model
 
-def _special_rule_FeSO4H2O_FeSO4(x,y,P):  #('below', 'FeSO4/SO2/Fe2(SO4)3')
-    r1 = y < _reactions['FeSO4/SO2/Fe2(SO4)3']['line']['y'](x,P)
-    r2 = y < _reactions['FeSO4/S/Fe2(SO4)3']['line']['y'](x,P)
-    
-    return r1 or r2
+_model = None
 
-_lines_Fe_S['FeSO4.H2O/FeSO4']['rules_f'].append(_special_rule_FeSO4H2O_FeSO4)
+#The intercepts (lines, n) of a map of the model for the columns of P = {key: array (n,)}, with an optional
+#P['dlgK'] = {reaction: array (n,)}. The same arithmetic as reaction['line']['coeffs'].
+def _intercepts(model: dict, P: dict):
+    T = P['T']
+    lgS, lgN, lgCO2 = [np.log10(P[key]) for key in ['S','N','CO2']]
+    
+    a = list()
+    for key, (K_chi_298, drh, drcp, nur), (c_s, c_n, c_c) in zip(model['ids']+model['extra'], model['lgK'].tolist(), model['composition'].tolist()):
+        K_chi = K_chi_298*(T/298.15)**(drcp/R)*np.exp(-(drh-298.15*drcp)/R*(298.15-T)/T/298.15)
+        lgK_p = np.log10(K_chi*(1e5/R/T)**_number(nur))
+        a.append(-lgK_p-P.get('dlgK', {}).get(key, 0)+_number(c_s)*lgS+_number(c_n)*lgN+_number(c_c)*lgCO2)
+    
+    return np.array(np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=float)) for value in a]))
 
-#Combine
-_lines = {
-    'O': _lines_Fe_O,
-    'C': _lines_Fe_C,
-    'N': _lines_Fe_N,
-    'S': _lines_Fe_S,
-}
+#Write the numeric table of the reactions to path (default CCSTOOLKIT_TABLES or _reactions.npy next to this file).
+#They are used instead of parsing the reactions, as long as the reactions and the thermodynamic data are the same.
+def save_tables(path: str = None):
+    path = path or _tables_path
+    path = path if path.endswith('.npy') else path+'.npy'
+    np.save(path, _parse_reactions())
+    return path
 
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Export
@@ -293,12 +378,23 @@ def get_domain():
 	return _domain
 	
 def get_reactions():
+	_ensure_built()
 	return _reactions
 
 def get_bounds():
     return _bounds
     
+def get_rules():
+    return _rules
+    
 def get_lines():
+    _ensure_built()
     return _lines
 
+def get_model():
+    global _model
+    if _model is None:
+        _model = _compile_model()
+    return _model
+
 
@@ -4,36 +4,20 @@
 #---------------------------------------------------------------------------------------Import
 #===================================================================================================================
 import re
+import csv
 import sys
 import argparse
-from tabulate import tabulate
-import matplotlib.pyplot as plt
 
 from .stability_maps import get_stability_maps
+from .plots import _corr_products_colors
+from .plots import _save
+from .plots import save_stability_maps_plots
 from ._reactions import get_domain
 from ._reactions import get_bounds
 from ._reactions import get_reactions
+from ._reactions import save_tables
 from ccstoolkit.common._substances import get_substances_TD_data
 
-#===================================================================================================================
-#---------------------------------------------------------------------------------------Constants
-#===================================================================================================================
-_corr_products_colors = {
-    'Fe': 'tab:blue',
-    'FeCO3': 'tab:orange',
-    'Fe(OH)2': 'navy',
-    'FeS2': 'tab:green',
-    'FeS': 'tab:orange',
-    'FeSO4': 'tab:red',
-    'FeSO4.H2O': 'tab:purple',
-    'FeSO4.7H2O': 'tab:pink',
-    'Fe(NO3)2': 'tab:olive',
-    'Fe3O4': 'tab:green',
-    'Fe2O3': 'tab:red',
-    'FeO(OH)': 'tab:purple',
-    'Fe2(SO4)3': 'tab:olive'
-}
-
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Methods
 #===================================================================================================================
@@ -67,6 +51,15 @@ def _verify_domain(P):
 	return True
 	
 def _plot(maps, fname=None):
+	#The saved plots are drawn by plots, without pyplot
+	if fname:
+		fname = _save(maps, *_plot_file(fname))
+		print(f"Plot saved to {fname}")
+		return
+	
+	#matplotlib is imported only for plotting
+	import matplotlib.pyplot as plt
+	
 	Bounds = get_bounds()
 
 	fig, axs = plt.subplot_mosaic(
@@ -96,11 +89,26 @@ def _plot(maps, fname=None):
 	labels = set([j for i in ('O','C','N','S') for j in axs[i].get_legend_handles_labels()[1]])
 	axs["legend"].legend([handles[label] for label in labels], labels, loc="center", ncol=5, frameon=False, fontsize=12)
 	
-	if fname:
-		plt.savefig(fname+'.png', format='png') #, transparent=True
-		print(f"Plot saved to {fname}.png")
-	else:
-		plt.show()
+	plt.show()
+
+#The file name and the format of a saved plot: SVG for '.svg', otherwise PNG ('.png' is added if missing)
+def _plot_file(fname):
+	return (fname, 'svg') if fname.lower().endswith('.svg') else (fname, 'png')
+
+#The plots of the compositions of a CSV file (columns S, N and optional CO2, T), saved as <prefix>_<row>
+def _plot_many(input_file, fname, workers=None):
+	with open(input_file, newline='') as f:
+		rows = list(csv.DictReader(f))
+	
+	Ps = [{key: float(value) for key, value in row.items() if key in ['S','N','CO2','T'] and value not in ['', None]} for row in rows]
+	prefix, format_ = _plot_file(fname)
+	prefix = prefix[:-len('.'+format_)] if prefix.lower().endswith('.'+format_) else prefix
+	
+	fnames = save_stability_maps_plots(Ps, prefix, file_format=format_, workers=workers)
+	if isinstance(fnames, int):
+		sys.exit(1)
+	
+	print(f"{sum(1 for fname in fnames if fname!=-1)} of {len(fnames)} plots saved to {prefix}_*.{format_}")
 
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Main
@@ -132,13 +140,26 @@ def main():
 	parser.add_argument("-pl","--plot",action="store_true",help="Plot the maps.")
 	
 	#Save plot
-	parser.add_argument("-sp",action="store",type=str,metavar='file',help="Save the plot.")
+	parser.add_argument("-sp",action="store",type=str,metavar='file',help="Save the plot (SVG for file.svg, otherwise PNG). With -i, the prefix of the plots of the compositions.")
+	
+	#Plot many compositions
+	parser.add_argument("-i",action="store",type=str,metavar='file',help="Input CSV file with columns S, N and optional CO2, T; with -sp, the plots of all rows are saved as <prefix>_<row>.")
+	
+	#Workers
+	parser.add_argument("-w","--workers",action="store",type=int,default=None,help="Number of worker processes for -i. Default is None (plot in this process).")
 	
 	#Output
 	parser.add_argument("-o",action="store",type=str,metavar='file',help="Output file name.")
 	
+	#Precompiled reaction tables
+	parser.add_argument("-st",action="store",type=str,nargs='?',const='',metavar='file',help="Save the precompiled reaction tables (default: CCSTOOLKIT_TABLES or next to the module).")
+	
 	args = parser.parse_args()
 	
+	#Save the reaction tables
+	if args.st is not None:
+		print(f"Reaction tables saved to {save_tables(args.st or None)}")
+	
 	#---------------------------------------------------------------------------------------Calculate
 	#Calculate the phase diagrams	
 	if args.p:
@@ -153,6 +174,8 @@ def main():
 	
 	#Print TD constants
 	if args.constants:
+		from tabulate import tabulate
+		
 		substances = get_substances_TD_data()
 		
 		headers = ["Substance", "dfg [kJ/mol]", "dfh [kJ/mol]", "cp [J/mol/K]", "solid"]
@@ -193,6 +216,10 @@ def main():
 	if (args.plot or args.sp) and args.p:
 		_plot(maps,args.sp)
 	
+	#Save the plots of many compositions
+	if args.sp and args.i:
+		_plot_many(args.i, args.sp, args.workers)
+	
 	return 0
 
 
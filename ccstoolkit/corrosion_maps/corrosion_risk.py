@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import itertools
+import numpy as np
+
+from . import _reactions
+from . import stability_maps as _stability_maps
+import ccstoolkit.common._cells as _cells
+
+#eqstreamcomp is imported with the first call (importing corrosion_maps doesn't pay for the solver)
+
+_bounds = _reactions.get_bounds()
+_domain = _reactions.get_domain()
+_map_keys = _stability_maps._map_keys
+
+_status = {
+    'ok': 0,
+    'doubtful': 1,                                             #Convergence of the composition doubtful
+    'oxygen too low': 2,                                       #Composition outside of the studied range
+    'outside domain': 3,                                       #Input outside of the domain of eqstreamcomp
+    'missing': 4,                                              #NaN in the input
+    'outside maps': 5                                          #S, N, CO2, T or (lgH2O, lgO2) outside of the maps
+}
+
+#The output of get_corrosion_risk
+_dtype = np.dtype(
+    [('lgH2O', float), ('lgO2', float), ('S_tot', float), ('N_tot', float), ('status', np.int8)]+
+    [('product_'+key, f'U{max(map(len, _stability_maps._names))}') for key in _map_keys]+
+    [('margin_'+key, float) for key in _map_keys]
+)
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Private methods
+#===================================================================================================================
+#The classifier of the points of a map (_cells._Classifier), kept between the calls
+def _get_classifier(key: str):
+    return _cells._get_classifier(_reactions.get_lines()[key], _bounds['x'], _bounds['y'], _stability_maps._get_names)
+
+#The streams of a list of dicts as columns; the missing optional values get their defaults
+def _columns(samples: list):
+    from ccstoolkit.eqstreamcomp import composition as _composition
+
+    columns = {key: np.array([_float(sample.get(key, np.nan)) for sample in samples]) for key in set([key for sample in samples for key in sample])}
+    for key, default in [('CO2', _composition._a_CO2),('tot', _composition._c_CO2),('T', 298.15)]:
+        if key in columns:
+            columns[key] = np.where(np.isnan(columns[key]), default, columns[key])
+
+    return columns
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Public methods
+#===================================================================================================================
+#A function that returns the corrosion products of steel in many streams at once
+def get_corrosion_risk(X, warm_start=True, workers=None, with_compositions=False):
+    '''X = the same as in eqstreamcomp.get_compositions, e.g. {'H2O': array, 'H2S': array, 'O2': array, 'NO2': array,
+    'SO2': array} in [ppmx] with optional 'CO2' [mM], 'tot' [mM] and 'T' [K]
+
+    warm_start = True (default; the streams are a sequence, e.g. a time series), False or a dict that keeps the last
+    solution between calls, as in eqstreamcomp.get_compositions
+
+    workers = the same as in eqstreamcomp.get_compositions (the compositions only)
+
+    with_compositions = False (default) or True: returns (risk, compositions of eqstreamcomp.get_compositions)
+
+    The equilibrium composition of each stream gives the point (lgH2O, lgO2) and the total S and N of the corrosion
+    maps at its CO2 and T. The regions of the maps are found once for all streams with the same topology of the maps
+    (the same signs of the event functions of get_stability_maps_sweep) and kept between the calls; for the other
+    streams only the vertices are calculated.
+
+    Returns a structured array with the fields
+        'lgH2O', 'lgO2': the point on the maps,
+        'S_tot', 'N_tot': total sulphur and nitrogen in [mM],
+        'product_O', 'product_C', 'product_N', 'product_S': the corrosion product in each map ('' if none),
+        'margin_O', ...: the distance from the point to the nearest boundary with another product in (lgH2O, lgO2),
+        inf if there is none,
+        'status': 0 - ok, 1 - composition doubtful, 2 - oxygen too low, 3 - input outside of the domain of
+        eqstreamcomp, 4 - missing input, 5 - outside of the maps'''
+
+    from ccstoolkit.eqstreamcomp import composition as _composition
+
+    parsed = _composition._parse_columns(X)
+    if parsed == -1:
+        return -1
+    _, columns = parsed
+
+    c = _composition.get_compositions(columns, workers=workers, warm_start=warm_start)
+    c0, T, a_CO2 = _composition._parse_batch(columns)
+
+    output = np.zeros(len(c), dtype=_dtype)
+    output['status'] = c['status']
+    output['S_tot'], output['N_tot'] = c0['S'], c0['N']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        output['lgH2O'], output['lgO2'] = np.log10(c['H2O']), np.log10(c['O2'])
+    unsolved = np.isin(output['status'], [_status['outside domain'], _status['missing']])
+    output['lgH2O'][unsolved], output['lgO2'][unsolved] = np.nan, np.nan
+    for key in _map_keys:
+        output['margin_'+key] = np.nan
+
+    #---------------------------The streams on the maps---------------------------
+    P = {'S': c0['S'], 'N': c0['N'], 'CO2': a_CO2, 'T': T}
+    solved = np.isin(output['status'], [_status['ok'], _status['doubtful']])
+    with np.errstate(invalid='ignore'):
+        inside = np.all([(_domain[key]['min'] <= value) & (value <= _domain[key]['max']) for key, value in P.items()], axis=0)
+        inside &= (_bounds['x'][0] <= output['lgH2O']) & (output['lgH2O'] <= _bounds['x'][1]) & (_bounds['y'][0] <= output['lgO2']) & (output['lgO2'] <= _bounds['y'][1])
+    output['status'][solved & ~inside] = _status['outside maps']
+
+    rows = np.flatnonzero(solved & inside)
+    if len(rows):
+        P = {key: np.asarray(value, dtype=float)[rows] for key, value in P.items()}
+        for key in _map_keys:
+            names, margins = _get_classifier(key).classify(P, output['lgH2O'][rows], output['lgO2'][rows])
+            output['product_'+key][rows] = names
+            output['margin_'+key][rows] = margins
+
+    if with_compositions:
+        return output, c
+
+    return output
+
+#A function that classifies an unbounded stream of samples chunk by chunk
+def stream_corrosion_risk(samples, chunksize=1000, with_compositions=False):
+    '''samples = an iterable (e.g. a generator of readings) of dicts with the keys of get_corrosion_risk
+
+    chunksize = number of samples classified at once (default 1000)
+
+    with_compositions = the same as in get_corrosion_risk
+
+    Yields the output of get_corrosion_risk for each chunk, the samples in order. The samples are read lazily, the
+    solver is warm-started from the last solution of the previous chunk and the topology of the maps is kept.
+    Empty or non-numeric values are missing; missing CO2, tot and T get their defaults.'''
+
+    if not (isinstance(chunksize, int) and chunksize>0):
+        print('Wrong input! The chunk size must be a positive integer.')
+        return
+
+    samples = iter(samples)
+    warm = dict()
+    while True:
+        chunk = list(itertools.islice(samples, chunksize))
+        if not chunk:
+            return
+
+        yield get_corrosion_risk(_columns(chunk), warm_start=warm, with_compositions=with_compositions)
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import re
+import sys
+import numpy as np
+
+from . import _reactions
+from . import stability_maps as _stability_maps
+import ccstoolkit.common._parallel as _parallel
+
+#matplotlib is imported with the first plot, through its object-oriented interface only (no pyplot, no global figures)
+
+_bounds = _reactions.get_bounds()
+_map_keys = _stability_maps._map_keys
+
+_corr_products_colors = {
+    'Fe': 'tab:blue',
+    'FeCO3': 'tab:orange',
+    'Fe(OH)2': 'navy',
+    'FeS2': 'tab:green',
+    'FeS': 'tab:orange',
+    'FeSO4': 'tab:red',
+    'FeSO4.H2O': 'tab:purple',
+    'FeSO4.7H2O': 'tab:pink',
+    'Fe(NO3)2': 'tab:olive',
+    'Fe3O4': 'tab:green',
+    'Fe2O3': 'tab:red',
+    'FeO(OH)': 'tab:purple',
+    'Fe2(SO4)3': 'tab:olive'
+}
+
+_formats = ['png', 'svg']
+
+#Capacity of the packed maps of the plots; the compositions with more regions or points are calculated on their own
+_max_regions = 16
+_max_points = 32
+
+_templates = dict()                                            #Templates by dpi, kept between the calls
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Template
+#===================================================================================================================
+#The figure of the four maps (as cli._plot), created once with its axes, titles, labels and layout. Each map has a
+#pool of polygons; a plot only updates the vertices and the visibility of the polygons and the legend. The static part
+#of the figure (the text takes most of the drawing) is drawn once with the Agg canvas and kept as a background; a PNG
+#only draws the polygons, the frames of the axes and the legend on a copy of it. An SVG is drawn in full.
+class _Template:
+    def __init__(self, dpi: float):
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Polygon
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.Polygon = Polygon
+        self.dpi = dpi
+        self.figure = Figure(figsize=(9, 8), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+
+        self.axs = self.figure.subplot_mosaic([["O", "C"],["N", "S"],["legend", "legend"]], height_ratios=[1, 1, 0.3])
+        for key in _map_keys:
+            ax = self.axs[key]
+            ax.set_xlim(*_bounds['x'])
+            ax.set_ylim(*_bounds['y'])
+            ax.set_title(f"{key} map",fontsize=16)
+            ax.set_xlabel(r'$\lg\text{H}_2\text{O}$', fontsize=12)
+            ax.set_ylabel(r'$\lg\text{O}_2$', fontsize=12)
+        self.axs['legend'].axis("off")
+
+        #The layout doesn't depend on the regions, so it is found once
+        self.figure.tight_layout()
+
+        #The background: the figure without the polygons, the frames (drawn over the polygons) and the legend
+        self.spines = [spine for key in _map_keys for spine in self.axs[key].spines.values()]
+        for spine in self.spines:
+            spine.set_visible(False)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for spine in self.spines:
+            spine.set_visible(True)
+
+        self.polygons = {key: list() for key in _map_keys}
+        self.handles = {name: self._polygon(name) for name in _corr_products_colors}
+        self.legend = None
+
+    def _polygon(self, name: str):
+        return self.Polygon(np.zeros((1, 2)), closed=True, hatch='xxxx', facecolor='white', edgecolor=_corr_products_colors[name], label=re.sub(r'(?<!\.)\d', r'$_\g<0>$', name))
+
+    #Update the polygons and the legend to the regions of the maps
+    def update(self, maps: dict):
+        names = list()
+        for key in _map_keys:
+            polygons, regions = self.polygons[key], maps[key]
+            while len(polygons)<len(regions):
+                polygons.append(self.axs[key].add_patch(self._polygon('Fe')))
+
+            for polygon, region in zip(polygons, regions):
+                polygon.set_xy(region['points'])
+                polygon.set_edgecolor(_corr_products_colors[region['name']])
+                polygon.set_visible(True)
+                if region['name'] not in names:
+                    names.append(region['name'])
+            for polygon in polygons[len(regions):]:
+                polygon.set_visible(False)
+
+        if self.legend is not None:
+            self.legend.remove()
+        self.legend = self.axs['legend'].legend([self.handles[name] for name in names], [self.handles[name].get_label() for name in names], loc="center", ncol=5, frameon=False, fontsize=12)
+
+    def save(self, fname: str, file_format: str):
+        if file_format=='svg':
+            self.figure.savefig(fname, format='svg')
+            return
+
+        from matplotlib.image import imsave
+
+        #The same order as a full draw: polygons (zorder 1), frames (2.5), legend
+        self.canvas.restore_region(self.background)
+        for key in _map_keys:
+            for polygon in self.polygons[key]:
+                if polygon.get_visible():
+                    self.axs[key].draw_artist(polygon)
+        for spine in self.spines:
+            spine.axes.draw_artist(spine)
+        self.axs['legend'].draw_artist(self.legend)
+        imsave(fname, np.asarray(self.canvas.buffer_rgba()), format='png', dpi=self.dpi)
+
+#The template of the resolution, kept in this process
+def _get_template(dpi: float):
+    if dpi not in _templates:
+        _templates[dpi] = _Template(dpi)
+    return _templates[dpi]
+
+#The fonts of matplotlib can't be used across a fork (they share the font files with the parent). matplotlib drops its
+#own fonts in a forked worker, but not the fonts of its cached mathtext, nor the figure of the parent.
+def _after_fork():
+    _templates.clear()
+    mathtext = sys.modules.get('matplotlib.mathtext')
+    if mathtext is not None and hasattr(mathtext.MathTextParser, '_parse_cached'):
+        mathtext.MathTextParser._parse_cached.cache_clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Private methods
+#===================================================================================================================
+#The file name with the extension of the format
+def _file_name(fname: str, file_format: str):
+    return fname if fname.lower().endswith('.'+file_format) else fname+'.'+file_format
+
+#Save the plot of the maps (the output of get_stability_maps) to fname. Returns the file name.
+def _save(maps: dict, fname: str, file_format='png', dpi=100):
+    fname = _file_name(fname, file_format)
+    template = _get_template(dpi)
+    template.update(maps)
+    template.save(fname, file_format)
+    return fname
+
+#Calculate the maps of the rows in inputs = {'S', 'N', 'CO2', 'T', 'fname'} and save their plots; outputs['status']
+#gets the status of the maps (_stability_maps._status). All rows are calculated at once as in
+#_stability_maps._get_stability_maps_task; the truncated ones again on their own.
+def _save_plots_task(inputs: dict, outputs: dict, file_format='png', dpi=100, model: dict = None):
+    n = len(inputs['fname'])
+    packed = {key: np.zeros(shape, dtype=dtype) for key, (shape, dtype) in _stability_maps._packed_specs(n, _max_regions, _max_points).items()}
+    _stability_maps._get_stability_maps_task(inputs, packed, model=model)
+
+    for i in range(n):
+        status = packed['status'][i]
+        if status==_stability_maps._status['truncated']:
+            maps = _stability_maps._get_stability_maps({key: float(inputs[key][i]) for key in ['S','N','CO2','T']})
+        elif status==_stability_maps._status['ok']:
+            maps = _stability_maps._unpack(packed, i)
+        else:
+            outputs['status'][i] = status
+            continue
+
+        _save(maps, str(inputs['fname'][i]), file_format, dpi)
+        outputs['status'][i] = _stability_maps._status['ok']
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Public methods
+#===================================================================================================================
+#A function that saves the plots of the maps of many compositions
+def save_stability_maps_plots(Ps, fnames, file_format='png', dpi=100, workers=None):
+    '''Ps = the same as in get_stability_maps_many
+
+    fnames = [file name, ...] one per composition, or a prefix (the files are '<prefix>_<i>'); the extension of the
+    format is added if it is missing
+
+    file_format = 'png' (default) or 'svg'
+
+    dpi = resolution of the PNG files (default 100)
+
+    workers = number of worker processes (default None, i.e. plot in this process)
+
+    The plots are the same as the one of the cli (-sp). Each process draws one figure, created once and updated in
+    place for every composition, without pyplot.
+
+    Returns a list with the file name (or -1 if the composition is outside of the domain or missing) for each
+    composition.'''
+
+    if file_format not in _formats:
+        print(f'Wrong input! The format must be one of {_formats}.')
+        return -1
+
+    columns = _stability_maps._parse_Ps(Ps)
+    if isinstance(columns, int):
+        return -1
+    n = len(columns['S'])
+
+    if isinstance(fnames, str):
+        fnames = [f'{fnames}_{i}' for i in range(n)]
+    if len(fnames)!=n:
+        print('Wrong input! One file name per composition is needed.')
+        return -1
+    fnames = [_file_name(str(fname), file_format) for fname in fnames]
+
+    inputs = columns | {'fname': np.array(fnames)}
+    outputs = {'status': ((n,), np.int8)}
+    if workers is not None and workers>1 and n>1:
+        #The workers get the model of this process (with its TD data) and keep their own figure between the tasks
+        output = _parallel._map(__name__+'._save_plots_task', inputs, outputs, n, workers, (__name__, 'matplotlib.figure', 'matplotlib.backends.backend_agg'), kwargs={'file_format': file_format, 'dpi': dpi, 'model': _reactions.get_model()})
+    else:
+        output = {key: np.zeros(shape, dtype=dtype) for key, (shape, dtype) in outputs.items()}
+        _save_plots_task(inputs, output, file_format, dpi)
+
+    return [fname if status==_stability_maps._status['ok'] else -1 for fname, status in zip(fnames, output['status'])]
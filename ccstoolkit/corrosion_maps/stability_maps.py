@@ -3,12 +3,37 @@
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Import libraries
 #===================================================================================================================
+import hashlib
+import itertools
+import numpy as np
+
 from . import _reactions
 import ccstoolkit.common._line_logic as _line_logic
+import ccstoolkit.common._topology as _topology
+import ccstoolkit.common._point_location as _point_location
+import ccstoolkit.common._sweep as _sweep
+import ccstoolkit.common._parallel as _parallel
+import ccstoolkit.common._cache as _cache
+import ccstoolkit.common._uncertainty as _uncertainty
+import ccstoolkit.common._async as _async
+import ccstoolkit.common._atlas as _atlas
+import ccstoolkit.common._raster as _raster
+import ccstoolkit.common._math as _math
 
 _bounds = _reactions.get_bounds()
 _domain = _reactions.get_domain()
-_lines = _reactions.get_lines()
+
+#Tables used to pack the maps into arrays. The lines themselves are formed on the first call (_reactions.get_lines).
+_map_keys = list(_reactions.get_rules().keys())
+_names = sorted(set([s for rules in _reactions.get_rules().values() for key in rules for s in key.split('/')]))
+_names_of = dict()                                             #Names of the regions by their bounds ids
+_neighbours_of = dict()                                        #Neighbours of the regions by their bounds ids
+_status = {
+    'ok': 0,
+    'truncated': 1,                                            #More regions/points than the capacity of the arrays
+    'outside domain': 3,                                       #Input outside of _domain
+    'missing': 4                                               #NaN in the input
+}
 
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Private methods
@@ -51,39 +76,668 @@ def _parse_region_names(regions: dict):
 #Get regions with names
 def _get_regions_with_names(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
     return _parse_region_names(_line_logic._get_regions(lines, P, x_bounds, y_bounds))
+
+#The same as _get_regions_with_names, with the topology of the map kept from the previous call
+def _get_regions_incremental_with_names(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
+    regions = _topology._get_regions_incremental(lines, P, x_bounds, y_bounds)
+    return [regions[f] | {'name': name} for f, name in _get_names(tuple(tuple(region['bounds ids']) for region in regions))]
+    
+#The shapes and types of the packed maps of n parameter sets
+def _packed_specs(n: int, max_regions: int, max_points: int):
+    m = len(_map_keys)
+    return {
+        'status': ((n,), np.int8),
+        'n_regions': ((n, m), np.int16),
+        'name': ((n, m, max_regions), np.int16),                 #Index in _names
+        'area': ((n, m, max_regions), float),
+        'centroid': ((n, m, max_regions, 2), float),
+        'n_points': ((n, m, max_regions), np.int16),
+        'points': ((n, m, max_regions, max_points, 2), float)
+    }
+
+#The bounds ids of a region as int16 codes in the packed arrays (ids = the lines of the map, model[key]['ids']): the
+#index of a line, or -1-(side+4*k) for the side '<side><k>' of the box
+def _encode_ids(bounds_ids: list, ids: list):
+    return [ids.index(id_) if not id_.isdigit() else -1-(int(id_[0])+4*int(id_[1:])) for id_ in bounds_ids]
+
+def _decode_ids(codes, ids: list):
+    return [ids[code] if code>=0 else f'{(-1-code)%4}{(-1-code)//4}' for code in codes.tolist()]
+
+#Names of the faces with the given bounds ids (the regions of a map). Returns [(index of the face, name)].
+def _get_names(bounds_ids: tuple):
+    if bounds_ids not in _names_of:
+        regions = _parse_region_names([{'bounds ids': list(ids), 'face': f} for f, ids in enumerate(bounds_ids)])
+        _names_of[bounds_ids] = [(region['face'], region['name']) for region in regions]
+    return _names_of[bounds_ids]
+
+#Neighbours of the regions of a map with the given bounds ids (its faces): ((name, (names of the neighbours)), ...)
+#Two regions are neighbours if they are bounded by the same line.
+def _get_neighbours(bounds_ids: tuple):
+    if bounds_ids not in _neighbours_of:
+        names = _get_names(bounds_ids)
+        neighbours = {name: set() for _, name in names}
+        for (f, name), (g, other) in itertools.combinations(names, 2):
+            if name!=other and set(i for i in bounds_ids[f] if not i.isdigit()) & set(bounds_ids[g]):
+                neighbours[name].add(other)
+                neighbours[other].add(name)
+        _neighbours_of[bounds_ids] = tuple(sorted((name, tuple(sorted(others))) for name, others in neighbours.items()))
+    return _neighbours_of[bounds_ids]
+
+#The topologies of the maps (_get_neighbours of each map) of the rows of P = {key: array}, all rows at once
+def _get_topologies(P: dict):
+    topologies = [dict() for _ in range(len(P['T']))]
+    for key in _map_keys:
+        for group in _line_logic._get_regions_batch(_reactions.get_lines()[key], P, _bounds['x'], _bounds['y']):
+            for row, inner in zip(group['rows'], group['area']>0):
+                topologies[row][key] = _get_neighbours(tuple(tuple(group['faces'][f]['bounds ids']) for f in np.flatnonzero(inner)))
+    return [tuple(topology[key] for key in _map_keys) for topology in topologies]
+
+#Calculate the maps of the rows in inputs = {'S': array, 'N': array, 'CO2': array, 'T': array} and pack them in outputs.
+#Optional columns 'dlgK:<reaction>' are perturbations of lgK_p of the reactions.
+#All rows are calculated at once from the compiled model (_reactions.get_model, default: the one of this process);
+#the rows with the same topology are packed together. maps = the keys of the maps to calculate (default: all), so that
+#the maps of the same rows can be calculated by separate jobs. The outputs must be zeros (status ok) at the start; each
+#job writes only the other statuses, which are the same in all jobs, and the truncated maps.
+#An optional output 'topology' (n, maps) gets an id of the faces of each map (_topology_id) and an optional output
+#'bounds' (n, maps, max_regions, max_points) the bounds ids of the regions (_encode_ids), one per edge.
+def _get_stability_maps_task(inputs: dict, outputs: dict, model: dict = None, maps: list = None):
+    model = model or _reactions.get_model()
+    max_regions, max_points = outputs['points'].shape[2:4]
+    perturbed = [key for key in inputs if key.startswith('dlgK:')]
+    
+    columns = {key: np.asarray(inputs[key], dtype=float) for key in ['S','N','CO2','T']}
+    
+    status = np.full(len(columns['T']), _status['ok'], dtype=outputs['status'].dtype)
+    for key, value in columns.items():
+        with np.errstate(invalid='ignore'):
+            status[~((_domain[key]['min'] <= value) & (value <= _domain[key]['max']))] = _status['outside domain']
+    status[np.any([np.isnan(value) for value in columns.values()], axis=0)] = _status['missing']
+    outputs['status'][status!=_status['ok']] = status[status!=_status['ok']]
+    
+    rows = np.flatnonzero(status==_status['ok'])
+    if not len(rows):
+        return
     
+    P = {key: value[rows] for key, value in columns.items()}
+    if perturbed:
+        P['dlgK'] = {key[len('dlgK:'):]: np.asarray(inputs[key], dtype=float)[rows] for key in perturbed}
+    
+    for m, key in enumerate(_map_keys):
+        if maps is not None and key not in maps:
+            continue
+        
+        a = _reactions._intercepts(model[key], P)
+        for group in _line_logic._get_regions_arrays(model[key], a, _bounds['x'], _bounds['y']):
+            #The regions of a row are the faces with a positive area
+            inner = group['area']>0
+            patterns, inverse = np.unique(inner, axis=0, return_inverse=True)
+            for pattern, regions in zip(patterns, [np.flatnonzero(inverse.ravel()==k) for k in range(len(patterns))]):
+                i = rows[group['rows'][regions]]
+                faces = np.flatnonzero(pattern)
+                names = _get_names(tuple(tuple(group['faces'][f]['bounds ids']) for f in faces))
+                
+                if len(names)>max_regions or any(group['faces'][faces[f]]['points'].shape[1]>max_points for f, _ in names):
+                    outputs['status'][i] = _status['truncated']
+                
+                names = names[:max_regions]
+                outputs['n_regions'][i, m] = len(names)
+                if 'topology' in outputs:
+                    outputs['topology'][i, m] = _topology_id(group['signature'], pattern)
+                for r, (f, name) in enumerate(names):
+                    face = faces[f]
+                    points = group['faces'][face]['points'][regions, :max_points]
+                    outputs['name'][i, m, r] = _names.index(name)
+                    outputs['area'][i, m, r] = group['area'][regions, face]
+                    outputs['centroid'][i, m, r] = group['centroid'][regions, face]
+                    outputs['n_points'][i, m, r] = points.shape[1]
+                    outputs['points'][i, m, r, :points.shape[1]] = points
+                    if 'bounds' in outputs:
+                        outputs['bounds'][i, m, r, :points.shape[1]-1] = _encode_ids(group['faces'][face]['bounds ids'][:points.shape[1]-1], model[key]['ids'])
+
+#Id of the faces of a map, the same for the rows of all batches with the same graph of the active lines (signature,
+#_line_logic._graph_signatures) and the same regions. The vertices of the regions of such rows correspond one to one.
+def _topology_id(signature, pattern):
+    digest = hashlib.blake2b(np.ascontiguousarray(signature, dtype=np.int32).tobytes()+np.packbits(pattern).tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+#Calculate the packed maps (specs, _packed_specs) of the n rows of columns, in this process or split between workers
+def _calculate_packed(columns: dict, n: int, specs: dict, workers=None):
+    if workers is not None and workers>1 and n>1:
+        #The workers get the model of this process (with its TD data) and calculate the maps of the rows separately
+        return _parallel._map(__name__+'._get_stability_maps_task', columns, specs, n, workers, (__name__,), kwargs={'model': _reactions.get_model()}, jobs=[{'maps': [key]} for key in _map_keys])
+    
+    output = {key: np.zeros(shape, dtype=dtype) for key, (shape, dtype) in specs.items()}
+    _get_stability_maps_task(columns, output)
+    return output
+
+#The maps of row i of the packed arrays in the format of get_stability_maps (the bounds ids only with the optional
+#output 'bounds')
+def _unpack(packed: dict, i: int):
+    if packed['status'][i] not in [_status['ok'], _status['truncated']]:
+        return -1
+    
+    maps = dict()
+    for m, key in enumerate(_map_keys):
+        maps[key] = list()
+        for r in range(packed['n_regions'][i, m]):
+            n_points = packed['n_points'][i, m, r]
+            region = {'bounds ids': _decode_ids(packed['bounds'][i, m, r, :n_points-1], _reactions.get_model()[key]['ids'])} if 'bounds' in packed else dict()
+            maps[key].append(region | {
+                'area': float(packed['area'][i, m, r]),
+                'centroid': packed['centroid'][i, m, r].copy(),
+                'points': [tuple(map(float, p)) for p in packed['points'][i, m, r, :n_points]],
+                'name': _names[packed['name'][i, m, r]]
+            })
+    
+    return maps
+
+#Nodes of an atlas calculated at once (bounds the memory of the packed arrays)
+_atlas_block = 1024
+
+#The packed maps of a block of nodes as ragged arrays: the number of regions of each node and map, and the regions of
+#all nodes and maps in order with their number of points and their points
+def _ragged(packed: dict):
+    max_regions, max_points = packed['points'].shape[2:4]
+    regions = np.arange(max_regions) < packed['n_regions'][..., None]                              #(n, maps, regions)
+    points = regions[..., None] & (np.arange(max_points) < packed['n_points'][..., None])           #(n, maps, regions, points)
+    return {
+        'count': packed['n_regions'].ravel(),
+        'name': packed['name'][regions],
+        'area': packed['area'][regions],
+        'centroid': packed['centroid'][regions],
+        'n_points': packed['n_points'][regions],
+        'points': packed['points'][points]
+    }
+
+#Checked once when an atlas is opened: was it built with the reactions and TD data of this process
+def _prepare_atlas(atlas: dict):
+    atlas['stale'] = atlas['header'].get('td')!=_reactions._tables_hash()
+
+#The regions of map m of the nodes of an atlas: the points of the regions of map m of each node are stored one after the
+#other, so nodes with the same topology (the vertices correspond one to one) are interpolated at once with the weights.
+#The area and the centroid of interpolated points are calculated again. In the format of get_stability_maps.
+def _atlas_regions(atlas: dict, nodes: list, weights: list, m: int):
+    arrays, names = atlas['arrays'], atlas['header']['names']
+    regions, vertices = arrays['regions'], arrays['vertices']
+    ks = [i*len(atlas['header']['maps'])+m for i in nodes]
+    
+    points = sum(w*arrays['points'][vertices[regions[k]]:vertices[regions[k+1]]] for w, k in zip(weights, ks)).tolist()
+    offsets = (vertices[regions[ks[0]]:regions[ks[0]+1]+1]-vertices[regions[ks[0]]]).tolist()
+    
+    result = list()
+    for j, r in enumerate(range(regions[ks[0]], regions[ks[0]+1])):
+        region = [tuple(p) for p in points[offsets[j]:offsets[j+1]]]
+        result.append({
+            'area': float(arrays['area'][r]) if len(nodes)==1 else float(_math._polygon_area(region)),
+            'centroid': arrays['centroid'][r].copy() if len(nodes)==1 else _math._calculate_centroid(region),
+            'points': region,
+            'name': names[arrays['name'][r]]
+        })
+    
+    return result
+
+#P with the default values, -1 if it is not valid
+def _parse_P(P: dict):
+    
+    if not isinstance(P, dict):
+        print('Wrong input!')
+        return -1
+    
+    #Add default values, if not specified
+    for key, default in [('CO2', 2e3),('T', 298.15)]:
+        if key not in P:
+            P = P | {key: default}
+    
+    if {'S','N'} - set(P.keys()):
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+        
+    for key, p in P.items():
+        if not _domain[key]['min'] <= p <= _domain[key]['max']:
+            print(f'Wrong input! {key} outside of range.')
+            return -1
+    
+    return P
+
+#The columns of many compositions (Ps as in get_stability_maps_many) broadcast to the same length, with the default
+#values; -1 if they are not valid
+def _parse_Ps(Ps):
+    
+    if isinstance(Ps, (list, tuple)):
+        if not all(isinstance(P, dict) for P in Ps):
+            print('Wrong input!')
+            return -1
+        Ps = {key: [P.get(key, np.nan) for P in Ps] for key in set([key for P in Ps for key in P])}
+    
+    keys = set(Ps.dtype.names) if isinstance(Ps, np.ndarray) and Ps.dtype.names else set(Ps.keys()) if isinstance(Ps, dict) else None
+    if keys is None:
+        print('Wrong input!')
+        return -1
+    
+    if {'S','N'} - keys:
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+    
+    #Broadcast all columns to the same length. Add default values, if not specified
+    columns = {key: Ps[key] for key in ['S','N']}
+    for key, default in [('CO2', 2e3),('T', 298.15)]:
+        columns[key] = Ps[key] if key in keys else default
+    columns = dict(zip(columns.keys(), np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=float)) for value in columns.values()])))
+    
+    #Missing default values in a list of dicts
+    for key, default in [('CO2', 2e3),('T', 298.15)]:
+        columns[key] = np.where(np.isnan(columns[key]), default, columns[key])
+    
+    return columns
+
+#The body of get_stability_maps, called through the cache
+def _get_stability_maps(P: dict, incremental=False):
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
+    get_regions = _get_regions_incremental_with_names if incremental else _get_regions_with_names
+    regions = {key: get_regions(lines, P, _bounds['x'], _bounds['y']) for key, lines in _reactions.get_lines().items()}
+    
+    return regions
+
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Public methods
 #===================================================================================================================
 #A function that returns all graphs for a given composition
-def get_stability_maps(P: dict):
+def get_stability_maps(P: dict, cache=False, incremental=False):
     '''P = {
         'S': total sulphur concentration in [mM], 
         'N': total nitrogen concentration in [mM], 
         'CO2': activity of CO2 in [mM], 
         'T': temperature in [K]
-    }'''
+    }
+    
+    cache = False (default), True (in memory and on disk, in ~/.cache/ccstoolkit or $CCSTOOLKIT_CACHE_DIR) or
+    {'path': sqlite file, 'maxsize': results in memory, 'max_bytes': size on disk, 'digits': significant digits of the inputs}
+    
+    incremental = False (default) or True: keep the topology of the maps (the faces) from the previous call and only
+    update the coordinates, as long as the order of the vertices and the active lines don't change. The same result,
+    for interactive use and sweeps over P with small steps.'''
+    
+    return _cache._cached('corrosion_maps.get_stability_maps', lambda P: _get_stability_maps(P, incremental), P, cache)
+
+
+
+#An awaitable get_stability_maps for asyncio applications
+async def aget_stability_maps(P: dict, cache=False, timeout=None):
+    '''P = the same as in get_stability_maps
+    
+    cache = the same as in get_stability_maps
+    
+    timeout = None (default) or deadline in [s]; raises asyncio.TimeoutError
+    
+    The maps are calculated in a pool of worker processes ($CCSTOOLKIT_ASYNC_WORKERS, default the number of CPUs), so
+    the event loop is not blocked, and nothing is printed. Identical requests in flight are calculated once. At most
+    $CCSTOOLKIT_ASYNC_MAX_PENDING (default 64) distinct requests are submitted at once, the others wait for a free slot.
+    A cancelled request is dropped from the pool if no other request waits for it and it hasn't started yet.'''
+    
+    return await _async._submit(__name__+'.get_stability_maps', P, {'cache': cache}, timeout=timeout)
+
+#A function that returns the maps of many compositions
+def get_stability_maps_many(Ps, workers=None, packed=False, max_regions=12, max_points=16):
+    '''Ps = [P, P, ...] with P as in get_stability_maps
+    
+    Ps = {
+        'S': array of total sulphur concentrations in [mM], 
+        'N': array of total nitrogen concentrations in [mM], 
+        'CO2': array of activities of CO2 in [mM], 
+        'T': array of temperatures in [K]
+    }
+    
+    Ps can also be a structured array. 'CO2' and 'T' are optional and can be scalars.
+    
+    workers = number of worker processes (default None, i.e. calculate in this process). The compositions and the four
+    maps of each composition are split between the workers.
+    
+    Returns a list with the output of get_stability_maps (or -1) for each composition. The compositions with more than
+    max_regions regions or max_points points in a region are calculated again on their own.
+    With packed=True, returns the arrays of _packed_specs and 'bounds' instead (the truncated maps are not calculated
+    again), together with the tables 'maps', 'names' and 'ids' ({map: ids of its lines}; the bounds ids are the index
+    of a line, or -1-(side+4*k) for the side '<side><k>' of the box, one per edge of a region).
+    Each composition has a 'status': 0 - ok, 1 - more than max_regions/max_points, 3 - outside of domain, 4 - missing input.'''
+    
+    columns = _parse_Ps(Ps)
+    if isinstance(columns, int):
+        return -1
+    n = len(columns['S'])
+    
+    specs = _packed_specs(n, max_regions, max_points) | {'bounds': ((n, len(_map_keys), max_regions, max_points), np.int16)}
+    output = _calculate_packed(columns, n, specs, workers)
+    
+    if packed:
+        return output | {'maps': list(_map_keys), 'names': list(_names), 'ids': {key: list(_reactions.get_model()[key]['ids']) for key in _map_keys}}
+    
+    #The truncated maps again, each composition on its own
+    return [_unpack(output, i) if output['status'][i]!=_status['truncated'] else _get_stability_maps({key: float(value[i]) for key, value in columns.items()}) for i in range(n)]
+
+#A function that returns the uncertainty of the maps due to the uncertainty of the TD data
+def get_stability_maps_uncertainty(P: dict, n=200, ci=0.95, sigma=None, seed=None, workers=None, max_regions=12, max_points=16):
+    '''P = the same as in get_stability_maps
+    
+    n = number of Monte Carlo samples of the TD data (default 200)
+    
+    ci = probability of the confidence intervals (default 0.95)
+    
+    sigma = None (default) or {substance: {'dfg': [kJ/mol], 'dfh': [kJ/mol], 'cp': [J/mol/K]}}, standard uncertainties
+    that replace the defaults (1 kJ/mol for dfg and dfh, 5% of cp and 30 J/mol/K where cp is missing)
+    
+    seed = seed of the random numbers (default None)
+    
+    workers = number of worker processes (default None, i.e. calculate in this process)
+    
+    The samples of dfg, dfh and cp are propagated to lgK_p of the reactions, which shift the lines of the maps.
+    
+    Returns {
+        map: {
+            region name: {
+                'probability': fraction of the samples with the region, 
+                'area': {'mean': ..., 'std': ..., 'median': ..., 'low': ..., 'high': ...}, 
+                'centroid': {'x': {...}, 'y': {...}}
+            }
+        }, 
+        'samples': number of samples with maps
+    }
+    The area and the centroid are over the samples with the region. Disjoint regions with the same name are merged.'''
+    
+    if not (isinstance(n, int) and n>0 and 0<ci<1):
+        print('Wrong input! n must be a positive integer and 0 < ci < 1.')
+        return -1
     
     if not isinstance(P, dict):
         print('Wrong input!')
         return -1
     
     #Add default values, if not specified
-    for key, default in [('CO2', 2e3),('T', 298.15)]:
-        if key not in P:
-            P = P | {key: default}
+    P = {'CO2': 2e3, 'T': 298.15} | P
     
     if {'S','N'} - set(P.keys()):
         print('Wrong input! Insufficient number of concentrations provided.')
         return -1
+    
+    for key in ['S','N','CO2','T']:
+        if not _domain[key]['min'] <= P[key] <= _domain[key]['max']:
+            print(f'Wrong input! {key} outside of range.')
+            return -1
+    
+    #One row per sample, with the perturbations of lgK_p as extra columns
+    deltas = _uncertainty._sample(n, sigma=sigma, seed=seed)
+    dlgK = _uncertainty._dlgK(_reactions.get_reactions(), deltas, P['T'])
+    columns = {key: np.full(n, P[key], dtype=float) for key in ['S','N','CO2','T']} | {'dlgK:'+key: value for key, value in dlgK.items()}
+    
+    specs = _packed_specs(n, max_regions, max_points)
+    output = _calculate_packed(columns, n, specs, workers)
+    
+    samples = np.flatnonzero(np.isin(output['status'], [_status['ok'], _status['truncated']]))
+    
+    result = dict()
+    for m, key in enumerate(_map_keys):
+        #Area and area weighted centroid of each name in each sample
+        area = np.zeros((len(samples), len(_names)))
+        moment = np.zeros((len(samples), len(_names), 2))
+        for j, i in enumerate(samples):
+            for r in range(output['n_regions'][i, m]):
+                area[j, output['name'][i, m, r]] += output['area'][i, m, r]
+                moment[j, output['name'][i, m, r]] += output['area'][i, m, r]*output['centroid'][i, m, r]
         
-    for key, p in P.items():
+        result[key] = dict()
+        for k, name in enumerate(_names):
+            present = area[:, k]>0
+            if not np.any(present):
+                continue
+            
+            centroid = moment[present, k]/area[present, k][:, None]
+            result[key][name] = {
+                'probability': float(np.mean(present)),
+                'area': _uncertainty._interval(area[present, k], ci),
+                'centroid': {'x': _uncertainty._interval(centroid[:, 0], ci), 'y': _uncertainty._interval(centroid[:, 1], ci)}
+            }
+    
+    return result | {'samples': len(samples)}
+
+#A function that returns the regions of points of the maps for a given composition
+def classify_points(P: dict, xs, ys):
+    '''P = the same as in get_stability_maps
+    
+    xs = array of lg(a_H2O), ys = array of lg(a_O2) (the axes of the maps), broadcast against each other
+    
+    Returns {map: array of the names of the regions of the points}, '' outside of the maps or of the named regions.
+    The maps are indexed once per P (slab decomposition), the points are located by a binary search.'''
+    
+    index = _point_location._get_index(__name__, _get_stability_maps, P)
+    if isinstance(index, int):
+        return index
+    
+    return {key: _point_location._classify(index[key], xs, ys) for key in _map_keys}
+
+#A function that follows the topology of the maps along one parameter
+def get_stability_maps_sweep(P: dict, param: str, start, stop, n=64, tol=1e-9):
+    '''P = the same as in get_stability_maps (param is not needed)
+    
+    param = 'S', 'N', 'CO2' or 'T', the parameter that goes from start to stop (S, N and CO2 in log space)
+    
+    n = number of grid points on which the events are bracketed (default 64)
+    
+    tol = accuracy of the breakpoints, in lg of S, N, CO2 or in K (default 1e-9)
+    
+    The topology of a map changes where three lines go through one point (or a line through a vertex on the bounding
+    box) or a rule of a line changes its sign. These events are linear in the intercepts of the lines; they are
+    bracketed on the grid and found by bisection, so narrow windows between the grid points are not missed as long as
+    an event function doesn't change its sign twice between two grid points (it can't for S, N and CO2).
+    
+    Returns {
+        'breakpoints': [values of param where the topology of a map changes],
+        'topologies': [{map: {name: [names of the neighbouring regions]}} of each piece, one more than the breakpoints],
+        'events': [{'at': breakpoint, 'map': map, 'appears': [names], 'disappears': [names], 'neighbours': [names]}]
+    }
+    'neighbours' are the regions that are present before and after the breakpoint but have other neighbours.'''
+    
+    if not isinstance(P, dict) or param not in ['S','N','CO2','T']:
+        print('Wrong input! param must be S, N, CO2 or T.')
+        return -1
+    
+    if not (isinstance(n, int) and n>1 and start<stop):
+        print('Wrong input! n must be an integer larger than 1 and start < stop.')
+        return -1
+    
+    #Add default values, if not specified
+    P = {'CO2': 2e3, 'T': 298.15} | P | {param: start}
+    
+    if {'S','N'} - set(P.keys()):
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+    
+    for key, p in list(P.items())+[(param, stop)]:
         if not _domain[key]['min'] <= p <= _domain[key]['max']:
             print(f'Wrong input! {key} outside of range.')
             return -1
     
-    regions = {key: _get_regions_with_names(lines, P, _bounds['x'], _bounds['y']) for key, lines in _lines.items()}
+    #S, N and CO2 enter the intercepts through their logarithms
+    logarithmic = param!='T'
+    value = (lambda s: 10**s) if logarithmic else (lambda s: s)
+    grid = np.linspace(np.log10(start), np.log10(stop), n) if logarithmic else np.linspace(start, stop, n)
     
-    return regions
+    maps = [(_reactions.get_lines()[key], _bounds['x'], _bounds['y']) for key in _map_keys]
+    breakpoints, topologies = _sweep._sweep(maps, {key: P[key] for key in ['S','N','CO2','T']}, param, grid, value, _get_topologies, tol)
+    
+    #---------------------------Format---------------------------
+    breakpoints = [float(value(s)) for s in breakpoints]
+    topologies = [{key: dict(map_) for key, map_ in zip(_map_keys, topology)} for topology in topologies]
+    
+    events = list()
+    for at, before, after in zip(breakpoints, topologies[:-1], topologies[1:]):
+        for key in _map_keys:
+            if before[key]==after[key]:
+                continue
+            events.append({
+                'at': at,
+                'map': key,
+                'appears': sorted(set(after[key])-set(before[key])),
+                'disappears': sorted(set(before[key])-set(after[key])),
+                'neighbours': sorted(name for name in set(before[key]) & set(after[key]) if before[key][name]!=after[key][name])
+            })
+    
+    return {
+        'breakpoints': breakpoints,
+        'topologies': [{key: {name: list(others) for name, others in map_.items()} for key, map_ in topology.items()} for topology in topologies],
+        'events': events
+    }
+
+#A function that calculates the maps on a grid over the domain and writes them to an atlas file
+def build_stability_maps_atlas(path: str, n=8, domain=None, workers=None, max_regions=12, max_points=16):
+    '''path = file of the atlas
+    
+    n = number of nodes on each axis (default 8) or {'S': ..., 'N': ..., 'CO2': ..., 'T': ...}
+    
+    domain = None (default, the whole domain) or {key: {'min': ..., 'max': ...}}, a part of the domain
+    
+    workers, max_regions, max_points = the same as in get_stability_maps_many
+    
+    The grid is log-spaced in S, N and CO2 and evenly spaced in T. The vertices, names, areas and centroids of the
+    regions of all nodes are stored as ragged arrays in one file, read by get_stability_maps_atlas.
+    
+    Returns {'nodes': ..., 'regions': ..., 'points': ..., 'truncated': nodes with more than max_regions/max_points, 
+    'bytes': size of the file}'''
+    
+    keys = ['S','N','CO2','T']
+    if isinstance(n, int):
+        n = dict.fromkeys(keys, n)
+    
+    if not (isinstance(n, dict) and set(n.keys())==set(keys) and all(isinstance(value, int) and value>0 for value in n.values())):
+        print('Wrong input! n must be a positive integer or {key: positive integer} for S, N, CO2 and T.')
+        return -1
+    
+    if not (domain is None or isinstance(domain, dict) and set(domain.keys()) <= set(keys)):
+        print('Wrong input!')
+        return -1
+    
+    domain = {key: _domain[key] | (domain or dict()).get(key, dict()) for key in keys}
+    for key, item in domain.items():
+        if not _domain[key]['min'] <= item['min'] <= item['max'] <= _domain[key]['max']:
+            print(f'Wrong input! {key} outside of range.')
+            return -1
+    
+    axes = [{'key': key, 'min': float(domain[key]['min']), 'max': float(domain[key]['max']), 'n': n[key], 'scale': 'linear' if key=='T' else 'log'} for key in keys]
+    columns = _atlas._grid_values(axes)
+    nodes = len(columns['T'])
+    
+    #---------------------------The maps of the nodes, block by block---------------------------
+    status, topology, blocks = list(), list(), list()
+    for start in range(0, nodes, _atlas_block):
+        block = {key: value[start:start+_atlas_block] for key, value in columns.items()}
+        size = len(block['T'])
+        specs = _packed_specs(size, max_regions, max_points) | {'topology': ((size, len(_map_keys)), np.int64)}
+        packed = _calculate_packed(block, size, specs, workers)
+        
+        status.append(packed['status'])
+        topology.append(packed['topology'])
+        blocks.append(_ragged(packed))
+    
+    ragged = {key: np.concatenate([block[key] for block in blocks]) for key in blocks[0]}
+    arrays = {
+        'status': np.concatenate(status),
+        'topology': np.concatenate(topology),                                                   #(nodes, maps)
+        'regions': np.concatenate([[0], np.cumsum(ragged['count'], dtype=np.int64)]),           #(nodes*maps+1,)
+        'name': ragged['name'],                                                                 #Index in 'names'
+        'area': ragged['area'],
+        'centroid': ragged['centroid'],
+        'vertices': np.concatenate([[0], np.cumsum(ragged['n_points'], dtype=np.int64)]),       #(regions+1,)
+        'points': ragged['points']
+    }
+    header = {'format': 'corrosion_maps atlas', 'td': _reactions._tables_hash(), 'axes': axes, 'maps': list(_map_keys), 'names': list(_names)}
+    
+    return {
+        'nodes': nodes,
+        'regions': len(arrays['name']),
+        'points': len(arrays['points']),
+        'truncated': int(np.sum(arrays['status']==_status['truncated'])),
+        'bytes': _atlas._write(path, header, arrays)
+    }
 
+#A function that returns the maps of the nearest node of an atlas
+def get_stability_maps_atlas(P: dict, path: str, interpolate=False):
+    '''P = the same as in get_stability_maps, within the grid of the atlas
+    
+    path = file written by build_stability_maps_atlas
+    
+    interpolate = False (default): the maps of the nearest node of the grid; True: the vertices are interpolated
+    (multilinear, in lg S, lg N, lg CO2 and T) between the nodes around P, for each map that has the same topology in
+    all of them, the other maps are those of the nearest node
+    
+    The file is memory mapped once per process (the pages are shared between processes) and opened again when it
+    changes. The nearest node is found in O(1).
+    
+    Returns the maps in the format of get_stability_maps (without the bounds ids), or -1 if there is no atlas, it was
+    built with other TD data or P is outside of it.'''
+    
+    if not isinstance(P, dict):
+        print('Wrong input!')
+        return -1
+    
+    #Add default values, if not specified
+    P = {'CO2': 2e3, 'T': 298.15} | P
+    
+    if {'S','N'} - set(P.keys()):
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+    
+    atlas = _atlas._get_atlas(path, _prepare_atlas)
+    if atlas is None:
+        print(f'Wrong input! No atlas in {path}.')
+        return -1
+    
+    if atlas['stale']:
+        print('Wrong input! The atlas was built with other thermodynamic data.')
+        return -1
+    
+    axes = atlas['header']['axes']
+    for axis in axes:
+        if not axis['min'] <= P[axis['key']] <= axis['max']:
+            print(f"Wrong input! {axis['key']} outside of the atlas.")
+            return -1
+    
+    values = [P[axis['key']] for axis in axes]
+    status, topology = atlas['arrays']['status'], atlas['arrays']['topology']
+    
+    i = _atlas._nearest(axes, values)
+    if status[i] not in [_status['ok'], _status['truncated']]:
+        return -1
+    
+    nodes, weights = _atlas._cell(axes, values) if interpolate else ([i], [1.0])
+    
+    maps = dict()
+    for m, key in enumerate(atlas['header']['maps']):
+        if len(nodes)>1 and np.all(status[nodes]==_status['ok']) and np.all(topology[nodes, m]==topology[nodes[0], m]):
+            maps[key] = _atlas_regions(atlas, nodes, weights, m)
+        else:
+            maps[key] = _atlas_regions(atlas, [i], [1.0], m)
+    
+    return maps
 
+#A function that returns the maps as rasters of labels
+def get_stability_maps_raster(P: dict, width=512, height=512):
+    '''P = the same as in get_stability_maps
+    
+    width, height = number of pixels along lg(a_H2O) and lg(a_O2) (default 512 x 512)
+    
+    Returns {map: {'labels': uint8 array (height, width), 'names': [...], 'x': array (width,), 'y': array (height,)}}:
+    labels[i, j] is the index in names ('' first, outside of the regions) of the region at the centre of the pixel
+    (x[j], y[i]), the top row first. The labels are found from the lines and their rules for all pixels at once (the
+    sides of the lines, joined where the lines are not active), without the polygons of the regions. Regions smaller
+    than a pixel can be missed or left without a name on coarse grids.'''
+    
+    if not (isinstance(width, int) and isinstance(height, int) and width>0 and height>0):
+        print('Wrong input! The width and the height must be positive integers.')
+        return -1
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
+    return {key: _raster._rasterize(lines, P, _bounds['x'], _bounds['y'], _get_names, width, height) for key, lines in _reactions.get_lines().items()}
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 
-from .composition import get_composition
-from .stability_map import get_stability_map
-from .stoichiometry_map import get_stoichiometry_map
+from .composition import get_composition, get_compositions, get_composition_path, get_solver_counts, get_solver_stats, get_composition_uncertainty, aget_composition
+from .surrogate import build_surrogate, get_compositions_surrogate
+from .stability_map import get_stability_map, classify_stability_points, get_stability_map_raster
+from .stoichiometry_map import get_stoichiometry_map, classify_stoichiometry_points, get_stoichiometry_map_raster
 
-__all__ = ["get_stability_map","get_stoichiometry_map","get_composition"]
+__all__ = ["get_stability_map","get_stoichiometry_map","classify_stability_points","classify_stoichiometry_points","get_stability_map_raster","get_stoichiometry_map_raster","get_composition","get_compositions","get_composition_path","get_solver_counts","get_solver_stats","get_composition_uncertainty","aget_composition","build_surrogate","get_compositions_surrogate"]
@@ -0,0 +1,5 @@
+#!/usr/bin/python3
+
+from .cli import main
+
+main()
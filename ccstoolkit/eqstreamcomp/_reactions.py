@@ -162,6 +162,7 @@ for key, reaction in _reactions.items():
     
     reaction['line'] = {'equation': 'c[0](P)+c[1]*lgH2O+c[2]*lgO2=0 '}
     reaction['line']['coeffs'] = lambda P, c=(intercept,slope_x,slope_y): (c[0](P),c[1],c[2])
+    reaction['line']['slopes'] = (slope_x, slope_y)
     
     #---------------------------Equations in the form lgH2O=f(lgO2) and lgO2=f(lgH2O)---------------------------
     reaction['line']['x'] = lambda y, P, c=(intercept,slope_x,slope_y): -(c[0](P)+c[2]*y)/c[1]
@@ -95,6 +95,7 @@ for line, i in _unformatted_lines.items():
         #i['O @ coeff_matrix'] = vector
         i['equation'] = 'c[0](P)+c[1]*c_H+c[2]*c_O=0'
         i['coeffs'] = lambda P, c=(intercept,slope): (c[0](P),c[1],-1)
+        i['slopes'] = (slope, -1)
         
         #---------------------------Equations in the form c_O=f(c_H) and c_H=f(c_O)---------------------------
         i['x'] = lambda y, P, c=(intercept,slope): (y-c[0](P))/c[1]
@@ -113,6 +114,7 @@ for line, i in _unformatted_lines.items():
         
         i['equation'] = 'c[0](P)+c[1]*c_H+c[2]*c_O=0'
         i['coeffs'] = lambda P, c=(intercept,slope): (c[0](P),-1,c[1])
+        i['slopes'] = (-1, slope)
         
         #---------------------------Equations in the form c_O=f(c_H) and c_H=f(c_O)---------------------------
         i['x'] = lambda y, P, vector=vector: vector @ np.array([y,P['N'],P['S']])
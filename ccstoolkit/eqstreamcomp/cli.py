@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import
+#===================================================================================================================
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+
+from .composition import get_compositions
+from .composition import _elements, _impurities, _products
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Constants
+#===================================================================================================================
+_inputs = _elements+_impurities+['CO2','tot','T']
+_outputs = {prod: 'eq_'+prod for prod in _products} | {'status': 'status'}     #Prefixed, as S, H2O, ... are also inputs
+_risk_outputs = ['lgH2O','lgO2','S_tot','N_tot']+['product_'+key for key in 'OCNS']+['margin_'+key for key in 'OCNS']
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+def _format(fname, format_):
+	if format_:
+		return format_
+	if fname and os.path.splitext(fname)[1].lower() in ('.jsonl', '.ndjson', '.json'):
+		return 'jsonl'
+	return 'csv'
+
+#Rows of the input as dicts, read lazily
+def _read(f, format_):
+	if format_ == 'csv':
+		yield from csv.DictReader(f)
+	else:
+		for line in f:
+			if line.strip():
+				yield json.loads(line)
+
+def _to_float(value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return np.nan
+
+#Columns of a chunk for get_compositions. Empty or non-numeric values are NaN (status 4 - missing input).
+def _columns(rows):
+	keys = [key for key in _inputs if key in rows[0]]
+	return {key: np.array([_to_float(row.get(key)) for row in rows]) for key in keys}
+
+class _Writer:
+	def __init__(self, f, format_, risk=False):
+		self.f, self.format_, self.writer = f, format_, None
+		self.risk = risk
+
+	#The input columns are passed through, followed by the species, the corrosion risk (with -rk) and the status
+	def write(self, rows, c, risk=None):
+		outputs = list(_outputs.values())[:-1]+(_risk_outputs if self.risk else [])+['status']
+		if self.format_ == 'csv' and self.writer is None:
+			fieldnames = list(rows[0].keys())+[key for key in outputs if key not in rows[0]]
+			self.writer = csv.DictWriter(self.f, fieldnames=fieldnames, extrasaction='ignore')
+			self.writer.writeheader()
+
+		for k, (row, out) in enumerate(zip(rows, c)):
+			row = dict(row) | {_outputs[prod]: float(out[prod]) for prod in _products} | {'status': int(out['status'])}
+			if risk is not None:
+				row |= {key: risk[key][k].item() for key in _risk_outputs} | {'status': int(risk['status'][k])}
+			if self.format_ == 'csv':
+				self.writer.writerow(row)
+			else:
+				self.f.write(json.dumps(row) + '\n')
+
+		self.f.flush()
+
+def _progress(n, start):
+	elapsed = time.time()-start
+	sys.stderr.write(f"\r{n} streams, {elapsed:.1f} s, {n/max(elapsed, 1e-9):.0f} streams/s")
+	sys.stderr.flush()
+
+def _run(f_in, f_out, format_in, format_out, chunksize, workers, progress, risk=False):
+	rows = _read(f_in, format_in)
+	writer = _Writer(f_out, format_out, risk)
+	if risk:
+		from ccstoolkit.corrosion_maps.corrosion_risk import get_corrosion_risk
+		warm = dict()                                          #The last solution, the streams are a sequence
+
+	n, start = 0, time.time()
+	while True:
+		chunk = list(itertools.islice(rows, chunksize))
+		if not chunk:
+			break
+
+		columns = _columns(chunk)
+		if not (set(_elements) <= set(columns) or set(_impurities) <= set(columns)):
+			print(f"Wrong input! The columns must include {', '.join(_elements)} or {', '.join(_impurities)}.", file=sys.stderr)
+			sys.exit(1)
+
+		if risk:
+			output, c = get_corrosion_risk(columns, warm_start=warm, workers=workers, with_compositions=True)
+			writer.write(chunk, c, output)
+		else:
+			c = get_compositions(columns, workers=workers)
+			writer.write(chunk, c)
+
+		n += len(chunk)
+		if progress:
+			_progress(n, start)
+
+	if progress:
+		sys.stderr.write('\n')
+
+	return n
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Main
+#===================================================================================================================
+def main():
+	#---------------------------------------------------------------------------------------Parse the input
+	parser = argparse.ArgumentParser(description="Compute the equilibrium composition of CO2 streams.")
+
+	#Input
+	parser.add_argument("-i",action="store",type=str,metavar='file',help="Input file (CSV or JSONL) with columns H, N, O, S or H2O, H2S, NO2, O2, SO2 and optional CO2, tot, T. Default is stdin.")
+
+	#Output
+	parser.add_argument("-o",action="store",type=str,metavar='file',help="Output file name. Default is stdout.")
+
+	#Formats
+	parser.add_argument("-f","--format",action="store",choices=['csv','jsonl'],help="Input format. Default is from the file extension or csv.")
+	parser.add_argument("-of","--output-format",action="store",choices=['csv','jsonl'],help="Output format. Default is the input format.")
+
+	#Batch
+	parser.add_argument("-n","--chunksize",action="store",type=int,default=10000,help="Number of streams solved at once. Default is 10000.")
+	parser.add_argument("-w","--workers",action="store",type=int,default=None,help="Number of worker processes. Default is None (solve in this process).")
+
+	#Corrosion risk
+	parser.add_argument("-rk","--risk",action="store_true",help="Also classify the corrosion products of steel in the corrosion maps (lgH2O, lgO2, S_tot, N_tot, product_O/C/N/S, margin_O/C/N/S); status 5 is outside of the maps. The solver is warm-started from the previous stream.")
+
+	#Progress
+	parser.add_argument("-pg","--progress",action="store_true",help="Report the progress on stderr.")
+
+	args = parser.parse_args()
+
+	if args.chunksize < 1:
+		print("Wrong input! The chunk size must be positive.", file=sys.stderr)
+		sys.exit(1)
+
+	format_in = _format(args.i, args.format)
+	format_out = args.output_format or _format(args.o, None if args.o else format_in)
+
+	#---------------------------------------------------------------------------------------Calculate
+	f_in = open(args.i, newline='') if args.i else sys.stdin
+	f_out = open(args.o, "w", newline='') if args.o else sys.stdout
+	try:
+		n = _run(f_in, f_out, format_in, format_out, args.chunksize, args.workers, args.progress, args.risk)
+	except BrokenPipeError:
+		#The reader of stdout exited, e.g. | head
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
+	finally:
+		if args.i:
+			f_in.close()
+		if args.o:
+			f_out.close()
+
+	if args.o:
+		print(f"{n} streams written to {args.o}", file=sys.stderr)
+
+	return 0
+
+
+if __name__ == "__main__":
+	main()
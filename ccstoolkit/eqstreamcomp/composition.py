@@ -3,10 +3,16 @@
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Import libraries
 #===================================================================================================================
+import math
+import time
+import functools
 import numpy as np
-from scipy.optimize import minimize, differential_evolution
 
 from . import _reactions as _reactions_
+import ccstoolkit.common._parallel as _parallel
+import ccstoolkit.common._cache as _cache
+import ccstoolkit.common._uncertainty as _uncertainty
+import ccstoolkit.common._async as _async
 
 _domain = _reactions_.get_domain()
 _reactions = _reactions_.get_reactions()
@@ -16,91 +22,288 @@ _impurities = sorted(['H2O','H2S','O2','NO2','SO2'])
 _products = sorted(['O2','H2O','COS','NO','NO2','HNO2','HNO3', 'H2S','S','SO2','SO3','H2SO4'])
 _c_CO2 = 18.55e3
 _a_CO2 = 2e3
+_methods = ['nelder-mead','newton','log']
 
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Private methods
 #===================================================================================================================
 #-----------------------------------------------------------System of equations
-def _soe(p,c0,c,T,a_CO2):
-    x, y = p
+#Every concentration in the system of equations is built from the ratios of the substances in these reactions,
+#e.g. 'NO/NO2' -> NO2/NO = K_p*H2O^e_H2O*O2^e_O2*CO2^e_CO2
+_soe_ratios = ['NO/NO2','NO2/HNO2','HNO2/HNO3','SO2/SO3','SO3/H2SO4','S/SO2','H2S/S','H2S/COS']
+
+#The monomials of the system of equations as products of powers of the ratios
+_soe_monomials = {
+    'NO2/NO': {'NO/NO2': 1},
+    'HNO2/NO': {'NO/NO2': 1, 'NO2/HNO2': 1},
+    'HNO3/NO': {'NO/NO2': 1, 'NO2/HNO2': 1, 'HNO2/HNO3': 1},
+    'SO3/SO2': {'SO2/SO3': 1},                                                     #Oxidizing branch
+    'H2SO4/SO2': {'SO2/SO3': 1, 'SO3/H2SO4': 1},                                   #Oxidizing branch
+    'SO2': {'S/SO2': 1},                                                           #Reducing branch, S is solid
+    'H2S': {'H2S/S': -1},                                                          #Reducing branch
+    'COS': {'H2S/S': -1, 'H2S/COS': 1}                                             #Reducing branch
+}
+
+#The exponents of H2O, O2 and CO2 in the ratio of the second to the first substance of a reaction, e.g. NO2/NO for 'NO/NO2'
+def _ratio_exponents(key):
+    reaction = _reactions[key]['reaction']
+    return [-sum([c for s, c in zip(reaction['substances'], reaction['coeffs']) if s==i]) for i in ['H2O','O2','CO2']]
+
+#The monomials at a given T and a_CO2: ((ln(constant), exponent of H2O, exponent of O2), ...) in the order of _soe_monomials
+@functools.lru_cache(maxsize=4096)
+def _soe_constants(T, a_CO2):
+    ratios = dict()
+    for key in _soe_ratios:
+        e_H2O, e_O2, e_CO2 = _ratio_exponents(key)
+        ratios[key] = (math.log(_reactions[key]['K_p'](T))+e_CO2*math.log(a_CO2), e_H2O, e_O2)
+    
+    return tuple(tuple(sum([n*ratios[key][i] for key, n in monomial.items()]) for i in range(3)) for monomial in _soe_monomials.values())
+
+#Compile the system of equations of one stream. The constants are calculated once per (T, a_CO2) and the
+#concentrations are evaluated as flat monomials. Returns (residual(p), species(p), log_residual(p));
+#species returns the concentrations in the order of _products.
+def _compile_soe(c0, T, a_CO2):
+    (c1, w1, o1), (c2, w2, o2), (c3, w3, o3), (c4, w4, o4), (c5, w5, o5), (c6, w6, o6), (c7, w7, o7), (c8, w8, o8) = _soe_constants(float(T), float(a_CO2))
+    H0, N0, O0, S0 = float(c0['H']), float(c0['N']), float(c0['O']), float(c0['S'])
+    oxidizing = O0>=(2*S0+N0+H0/2)
+    exp = math.exp
+    L = math.log(10)
+    
+    def species(p):
+        x, y = p
+        u = L*(-40+42*x)                                   #ln(H2O)
+        v = L*(-120+122*y)                                 #ln(O2)
+        
+        d1 = exp(c1+w1*u+o1*v)
+        d2 = exp(c2+w2*u+o2*v)
+        d3 = exp(c3+w3*u+o3*v)
+        NO = N0/(1+d1+d2+d3)
+        
+        if oxidizing:
+            e1 = exp(c4+w4*u+o4*v)
+            e2 = exp(c5+w5*u+o5*v)
+            SO2 = S0/(1+e1+e2)
+            SO3, H2SO4 = SO2*e1, SO2*e2
+            S, COS, H2S = 0, 0, 0
+        else:
+            SO2 = exp(c6+w6*u+o6*v)                        #<------------ This equation does not hold if there is no S!
+            H2S = exp(c7+w7*u+o7*v)
+            COS = exp(c8+w8*u+o8*v)                        #<------------ This equation does not scale
+            S = S0-(COS+H2S+SO2)
+            SO3, H2SO4 = 0, 0
+        
+        #COS, H2O, H2S, H2SO4, HNO2, HNO3, NO, NO2, O2, S, SO2, SO3
+        return COS, exp(u), H2S, H2SO4, NO*d2, NO*d3, NO, NO*d1, exp(v), S, SO2, SO3
     
-    lgH2O = -40+42*x
-    lgO2 = -120+122*y
+    def residual(p):
+        try:
+            COS, H2O, H2S, H2SO4, HNO2, HNO3, NO, NO2, O2, S, SO2, SO3 = species(p)
+        except OverflowError:
+            return math.inf, math.inf
         
-    c['H2O'] = 10**lgH2O
-    c['O2'] = 10**lgO2
+        return (2*H2O + 2*H2S + HNO2 + HNO3 + 2*H2SO4 - H0,
+            2*O2 + H2O - COS + NO + 2*NO2 + 2*HNO2 + 3*HNO3 + 2*SO2 + 3*SO3 + 4*H2SO4 - O0)
     
-    c['NO'] = c0['N']/(1+_reactions['NO/NO2']['K_p'](T)*c['O2']**0.5+_reactions['NO2/HNO2']['K_p'](T)*_reactions['NO/NO2']['K_p'](T)*c['O2']**0.5*c['H2O']**0.5/c['O2']**0.25+_reactions['HNO2/HNO3']['K_p'](T)*_reactions['NO2/HNO2']['K_p'](T)*_reactions['NO/NO2']['K_p'](T)*c['O2']**0.5*c['H2O']**0.5/c['O2']**0.25*c['O2']**0.5)
-    c['NO2'] = _reactions['NO/NO2']['K_p'](T)*c['NO']*c['O2']**0.5
-    c['HNO2'] = _reactions['NO2/HNO2']['K_p'](T)*c['NO2']*c['H2O']**0.5/c['O2']**0.25
-    c['HNO3'] = _reactions['HNO2/HNO3']['K_p'](T)*c['HNO2']*c['O2']**0.5
+    #The same balances in log space: ln(sum of the terms) - ln(total). All terms are positive and are
+    #summed with log-sum-exp, so the residuals stay finite for any (x, y).
+    lnH0, lnN0, lnO0, lnS0 = math.log(H0), math.log(N0), math.log(O0), math.log(S0)
+    ln2, ln3, ln4 = math.log(2), math.log(3), math.log(4)
     
-    if c0['O']>=(2*c0['S']+c0['N']+c0['H']/2):
-        c['SO2'] = c0['S']/(1+_reactions['SO2/SO3']['K_p'](T)*c['O2']**0.5+_reactions['SO3/H2SO4']['K_p'](T)*_reactions['SO2/SO3']['K_p'](T)*c['O2']**0.5*c['H2O'])
-            
-        c['SO3'] = _reactions['SO2/SO3']['K_p'](T)*c['SO2']*c['O2']**0.5
-        c['H2SO4'] = _reactions['SO3/H2SO4']['K_p'](T)*c['SO3']*c['H2O']
-
-        c['S'] = 0
-        c['COS'] = 0
-        c['H2S'] = 0
-    else:
-        c['SO2'] = _reactions['S/SO2']['K_p'](T)*c['O2']                      #<------------ This equation does not hold if there is no S!
-        c['H2S'] = c['H2O']/c['O2']**0.5/_reactions['H2S/S']['K_p'](T)
-        c['COS'] = _reactions['H2S/COS']['K_p'](T)*a_CO2*c['H2S']/c['H2O']    #<------------ This equation does not scale
+    def lse(*terms):
+        m = max(terms)
+        return m+math.log(sum([exp(t-m) for t in terms]))
+    
+    def log_residual(p):
+        x, y = p
+        u = L*(-40+42*x)                                   #ln(H2O)
+        v = L*(-120+122*y)                                 #ln(O2)
         
-        c['S'] = c0['S'] - (c['COS'] + c['H2S'] + c['SO2'])
-        c['SO3'] = 0
-        c['H2SO4'] = 0
+        ld1 = c1+w1*u+o1*v
+        ld2 = c2+w2*u+o2*v
+        ld3 = c3+w3*u+o3*v
+        lNO = lnN0-lse(0, ld1, ld2, ld3)
+        lNO2, lHNO2, lHNO3 = lNO+ld1, lNO+ld2, lNO+ld3
         
-    q = [2*c['H2O'] + 2*c['H2S'] + c['HNO2'] + c['HNO3'] + 2*c['H2SO4'] - c0['H'],
-        2*c['O2'] + c['H2O'] - c['COS'] + c['NO'] + 2*c['NO2'] + 2*c['HNO2'] + 3*c['HNO3'] + 2*c['SO2'] + 3*c['SO3'] + 4*c['H2SO4'] - c0['O']]
+        if oxidizing:
+            le1 = c4+w4*u+o4*v
+            le2 = c5+w5*u+o5*v
+            lSO2 = lnS0-lse(0, le1, le2)
+            lSO3, lH2SO4 = lSO2+le1, lSO2+le2
+            
+            return (lse(ln2+u, lHNO2, lHNO3, ln2+lH2SO4) - lnH0,
+                lse(ln2+v, u, lNO, ln2+lNO2, ln2+lHNO2, ln3+lHNO3, ln2+lSO2, ln3+lSO3, ln4+lH2SO4) - lnO0)
+        else:
+            lSO2 = c6+w6*u+o6*v
+            lH2S = c7+w7*u+o7*v
+            lCOS = c8+w8*u+o8*v
+            
+            return (lse(ln2+u, ln2+lH2S, lHNO2, lHNO3) - lnH0,
+                lse(ln2+v, u, lNO, ln2+lNO2, ln2+lHNO2, ln3+lHNO3, ln2+lSO2) - lse(lnO0, lCOS))
+    
+    return residual, species, log_residual
+
+#System of equations. Fills c with the concentrations at p and returns the residuals of the H and O balances.
+def _soe(p,c0,c,T,a_CO2):
+    residual, species, _ = _compile_soe(c0, T, a_CO2)
+    c.update(zip(_products, species(p)))
+    return np.array(residual(p))
+    
+#How often each path of _solve is taken
+_counts = {key: 0 for key in ['oxygen too low','newton','nelder-mead','log','global','doubtful','failed']}
+
+#Totals over all single stream solves, see get_solver_stats
+_totals = {key: 0 for key in ['solves','time','seed time','global time','iterations','evaluations','oxidizing','reducing']}
+
+#Record of one solve, passed to the stats callback
+def _new_record():
+    return {
+        'path': None,                                          #One of the keys of _counts
+        'branch': None,                                        #'oxidizing', 'reducing' or None (oxygen too low)
+        'time': 0.0,                                           #[s]
+        'seed time': 0.0,                                      #[s]
+        'iterations': 0,                                       #Local solver iterations
+        'evaluations': 0,                                      #Residual evaluations (seed grid included)
+        'residual': None,                                      #Sum of squared residuals of the H and O balances
+        'global': False,                                       #True if differential evolution ran
+        'global time': 0.0                                     #[s]
+    }
 
-    return np.array(q)
+def _report(record, stats):
+    _counts[record['path']] += 1
+    
+    _totals['solves'] += 1
+    for key in ['time','seed time','global time','iterations','evaluations']:
+        _totals[key] += record[key]
+    if record['branch']:
+        _totals[record['branch']] += 1
     
-def _solve(c0,T=298.15,a_CO2=_a_CO2,verbose=True,local=True):
+    if stats is not None:
+        stats(record)
+
+def _solve(c0,T=298.15,a_CO2=_a_CO2,verbose=True,local=True,method='nelder-mead',stats=None,record=None):
     
     c = {prod: 0 for prod in _products}
     
+    #The top level call owns the record and reports it
+    top = record is None
+    if top:
+        record = _new_record()
+    start = time.perf_counter()
+    
     if c0['O']<c0['H']/2+c0['N']-c0['S']:                     #Outside of the studied range
+        record['path'] = 'oxygen too low'
+        _report(record, stats)
         if verbose:
             print('Oxygen too low. Outside of studied range.')
         return c
     
+    record['branch'] = 'oxidizing' if c0['O']>=(2*c0['S']+c0['N']+c0['H']/2) else 'reducing'
+    
+    if local and method=='newton':
+        #Newton with the analytic Jacobian. The Nelder-Mead path below is the fallback.
+        c0_ = {key: np.array([c0[key]], dtype=float) for key in _elements}
+        T_, a_CO2_ = np.array([T], dtype=float), np.array([a_CO2], dtype=float)
+        K, oxidizing = _K_p_batch(T_), np.array([record['branch']=='oxidizing'])
+        
+        x, y = _seed_batch(c0_, K, a_CO2_, oxidizing, counts=record)
+        record['seed time'] += time.perf_counter()-start
+        
+        x, y, fun, it = _newton_batch(x, y, c0_, K, a_CO2_, oxidizing, counts=record)
+        record['iterations'] += int(it)
+        record['residual'] = float(fun[0])
+        
+        if fun[0]<=1e-4:
+            record['path'] = 'newton'
+            record['time'] = time.perf_counter()-start
+            _report(record, stats)
+            return _composition(x[0], y[0], c0, T, a_CO2)
+        
+        if verbose:
+            print('Convergence doubtful. Defaulting to Nelder-Mead.')
+        method = 'nelder-mead'
+
+    #scipy is imported only when the Newton solver isn't enough (the import takes longer than most solves)
+    from scipy.optimize import minimize, differential_evolution
+
+    residual, species, log_residual = _compile_soe(c0, T, a_CO2)
+    
+    #The log residuals stay finite, so they can be minimized with tight tolerances
+    squares = lambda f: (lambda p: sum([i**2 for i in f(p)]))
+    log_options = {'xatol': 1e-10, 'fatol': 1e-14, 'maxfev': 2000}
+    converged = lambda sol: sol.success and sum([i**2 for i in residual(sol.x)])<=1e-4
+    
+    def count(sol):
+        record['iterations'] += int(sol.get('nit', 0))
+        record['evaluations'] += int(sol.nfev)
+    
     if local:
+        seed_start = time.perf_counter()
+        
         x0 = np.linspace(0,1,10) 
         y0 = np.linspace(0,1,10)  
 
         points = [[x,y] for x in x0 for y in y0]               #1000 points or less do not increase the calculation time significantly
-        energies = [np.sum(np.abs(_soe(p,c0,c,T,a_CO2))) for p in points]
+        energies = [sum([abs(i) for i in residual(p)]) for p in points]
         indx = np.argmin(energies)
         x0, y0 = points[indx]
+        
+        record['seed time'] += time.perf_counter()-seed_start
+        record['evaluations'] += len(points)
 
-        sol = minimize(lambda p: np.sum([i**2 for i in _soe(p,c0,c,T,a_CO2)]), [x0,y0], method='Nelder-Mead', tol=1e-6)
-        #Reducing the tolerance will quickly lead to overflow errors
+        if method=='log':
+            sol = minimize(squares(log_residual), [x0,y0], method='Nelder-Mead', options=log_options)
+            count(sol)
+        else:
+            sol = minimize(squares(residual), [x0,y0], method='Nelder-Mead', tol=1e-6)
+            #Reducing the tolerance will quickly lead to overflow errors
+            count(sol)
+            
+            if not converged(sol):
+                #Retry on the log residuals before defaulting to the global solve
+                method = 'log'
+                sol = minimize(squares(log_residual), [x0,y0], method='Nelder-Mead', options=log_options)
+                count(sol)
     else:
-        sol = differential_evolution(lambda p: np.sum([i**2 for i in _soe(p,c0,c,T,a_CO2)]), [(0,1),(0,1)], tol=1e-12)
+        record['global'] = True
+        sol = differential_evolution(squares(log_residual if method=='log' else residual), [(0,1),(0,1)], tol=1e-12)
         #Increasing the tolerance will quickly lead to local solutions
+        count(sol)
+        record['global time'] = time.perf_counter()-start
 
     #Check if it solved
     if not sol.success:
+        record['path'] = 'failed'
+        if top:
+            record['time'] = time.perf_counter()-start
+            _report(record, stats)
         print(sol.message)
         return {prod: 0 for prod in _products}
+    
+    c = dict(zip(_products, species(sol.x)))
+    record['residual'] = float(sum([i**2 for i in residual(sol.x)]))
         
     #Check if local minimum
-    if np.all(np.abs(sol.fun)>1e-4):
+    if not converged(sol):
         if local:
+            record['path'] = 'global'
             if verbose:
                 print('Convergence doubtful. Defaulting to global solve.')
-            c = _solve(c0,T=T,a_CO2=a_CO2,verbose=verbose,local=False)
+            c = _solve(c0,T=T,a_CO2=a_CO2,verbose=verbose,local=False,method=method,stats=stats,record=record)
         else:
+            record['path'] = 'doubtful'
             if verbose:
                 print('Convergence doubtful.')
+    else:
+        record['path'] = method if local else 'global'
     
     #-----------------------------------------------------------Output
+    if top:
+        record['time'] = time.perf_counter()-start
+        _report(record, stats)
+    
     return c
 
-def _solve_ppmx(p0,T=298.15,a_CO2=_a_CO2,c_tot=_c_CO2,**kwargs):
+def _ppmx_to_c0(p0,c_tot=_c_CO2):
     '''p0 = {'H2O': 10, 'H2S': 3, 'O2': 2, 'NO2': 2.5, 'SO2': 1} in ppmx'''
     
     c0 = {key: value*c_tot*1e-6 for key,value in p0.items()}                                #[mol/m^3]
@@ -110,14 +313,432 @@ def _solve_ppmx(p0,T=298.15,a_CO2=_a_CO2,c_tot=_c_CO2,**kwargs):
     c0['O'] = c0['H2O']+2*c0['SO2']+2*c0['NO2']+2*c0['O2']                                  #[mol/m^3]
     c0['S'] = c0['SO2']+c0['H2S']                                                           #[mol/m^3]
     
-    c0 = {key: c0[key] for key in _elements}
+    return {key: c0[key] for key in _elements}
+
+def _solve_ppmx(p0,T=298.15,a_CO2=_a_CO2,c_tot=_c_CO2,**kwargs):
+    '''p0 = {'H2O': 10, 'H2S': 3, 'O2': 2, 'NO2': 2.5, 'SO2': 1} in ppmx'''
+    
+    return _solve(_ppmx_to_c0(p0,c_tot=c_tot),T=T,a_CO2=a_CO2,**kwargs)
+
+#Keys of the inputs of the concentrations (_elements or _impurities): the ones checked against _domain and the species
+#are differentiated with respect to ('tot' is used only with ppmx)
+def _input_keys(concentrations):
+    return list(concentrations)+(['tot'] if concentrations is _impurities else [])+['CO2','T']
+
+#Validate the input of get_composition and convert it into total concentrations. Returns (c0, T, a_CO2) or -1.
+def _parse_input(x0):
+    if not isinstance(x0, dict):
+        print('Wrong input!')
+        return -1
+        
+    #Add default values, if not specified
+    for key, default in [('CO2', 2e3),('tot', 18.55e3),('T', 298.15)]:
+        if key not in x0:
+            x0 = x0 | {key: default}
+        
+    if not set(_elements) - set(x0.keys()):               #True if x has {'H','N','O','S'} keys
+        concentrations = _elements
+    elif not set(_impurities) - set(x0.keys()):           #True if x has {'H2O','H2S', 'O2','NO2','SO2'} keys
+        concentrations = _impurities
+    else:
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+    
+    for key in _input_keys(concentrations):
+        if not _domain[key]['min'] <= x0[key] <= _domain[key]['max']:
+            print(f'Wrong input! {key} outside of range.')
+            return -1
+    
+    if concentrations is _elements:
+        c0 = {key: x0[key] for key in _elements}
+    else:
+        c0 = _ppmx_to_c0({key: x0[key] for key in _impurities},c_tot=x0['tot'])
+        
+    return c0, x0['T'], x0['CO2']
+
+#-----------------------------------------------------------Batch solve
+#Status codes of the batch solver
+_status = {
+    'converged': 0,
+    'doubtful': 1,                                             #Residual above the tolerance even after the global solve
+    'oxygen too low': 2,                                       #Outside of the studied range
+    'outside domain': 3,                                       #Input outside of _domain
+    'missing': 4                                               #NaN in the input
+}
+
+#The output of get_compositions
+_dtype = np.dtype([(prod, float) for prod in _products]+[('status', np.int8)])
+
+#Equilibrium constants for an array of temperatures
+def _K_p_batch(T, dtype=float):
+    return {key: np.asarray(reaction['K_p'](T), dtype=dtype) for key, reaction in _reactions.items()}
+
+#The species concentrations for arrays of (x, y). All arguments are broadcast against each other.
+def _species_batch(x, y, c0, K, a_CO2, oxidizing):
+    c = dict()
+
+    c['H2O'] = 10**(-40+42*x)
+    c['O2'] = 10**(-120+122*y)
+
+    sqrt_O2 = c['O2']**0.5
+    sqrt_H2O = c['H2O']**0.5
+
+    #Nitrogen
+    d1 = K['NO/NO2']*sqrt_O2                                   #NO2/NO
+    d2 = K['NO2/HNO2']*d1*sqrt_H2O/c['O2']**0.25               #HNO2/NO
+    d3 = K['HNO2/HNO3']*d2*sqrt_O2                             #HNO3/NO
+
+    c['NO'] = c0['N']/(1+d1+d2+d3)
+    c['NO2'] = c['NO']*d1
+    c['HNO2'] = c['NO']*d2
+    c['HNO3'] = c['NO']*d3
+
+    #Sulphur: both branches are calculated and the right one is selected for each stream
+    e1 = K['SO2/SO3']*sqrt_O2                                  #SO3/SO2
+    e2 = K['SO3/H2SO4']*e1*c['H2O']                            #H2SO4/SO2
+
+    SO2_ox = c0['S']/(1+e1+e2)
+    SO2_red = K['S/SO2']*c['O2']
+    H2S_red = c['H2O']/sqrt_O2/K['H2S/S']
+    COS_red = K['H2S/COS']*a_CO2*H2S_red/c['H2O']
+
+    zero = np.zeros(np.broadcast(x, y, oxidizing).shape)
+    c['SO2'] = np.where(oxidizing, SO2_ox, SO2_red)
+    c['SO3'] = np.where(oxidizing, SO2_ox*e1, zero)
+    c['H2SO4'] = np.where(oxidizing, SO2_ox*e2, zero)
+    c['H2S'] = np.where(oxidizing, zero, H2S_red)
+    c['COS'] = np.where(oxidizing, zero, COS_red)
+    c['S'] = np.where(oxidizing, zero, c0['S']-(COS_red+H2S_red+SO2_red))
+
+    return c
+
+#The H and O balances (the same as in _soe) for a given composition
+def _balance(c, c0):
+    return np.array([2*c['H2O'] + 2*c['H2S'] + c['HNO2'] + c['HNO3'] + 2*c['H2SO4'] - c0['H'],
+        2*c['O2'] + c['H2O'] - c['COS'] + c['NO'] + 2*c['NO2'] + 2*c['HNO2'] + 3*c['HNO3'] + 2*c['SO2'] + 3*c['SO3'] + 4*c['H2SO4'] - c0['O']])
+
+#Vectorized version of _soe
+def _soe_batch(x, y, c0, K, a_CO2, oxidizing):
+    return _balance(_species_batch(x, y, c0, K, a_CO2, oxidizing), c0)
+
+#Analytic Jacobian of the H and O balances with respect to (x, y) for a given composition.
+#Each species is a product of powers of H2O and O2, so it is enough to know d(ln c)/d(lgH2O) and d(ln c)/d(lgO2).
+def _jac_batch(c, oxidizing):
+    L = np.log(10)
+
+    #Nitrogen: NO = N/D, D = 1 + NO2/NO + HNO2/NO + HNO3/NO
+    D = c['NO']+c['NO2']+c['HNO2']+c['HNO3']
+    g_u = -L*(0.5*c['HNO2']+0.5*c['HNO3'])/D
+    g_v = -L*(0.5*c['NO2']+0.25*c['HNO2']+0.75*c['HNO3'])/D
+
+    #Sulphur (oxidizing branch): SO2 = S/E, E = 1 + SO3/SO2 + H2SO4/SO2
+    E = c['SO2']+c['SO3']+c['H2SO4']
+    h_u = np.where(oxidizing, -L*c['H2SO4']/E, 0)
+    h_v = np.where(oxidizing, -L*(0.5*c['SO3']+0.5*c['H2SO4'])/E, L)          #In the reducing branch SO2 = K*O2
+
+    #d(ln c)/d(lgH2O) and d(ln c)/d(lgO2) of each species in the balances
+    dl = {
+        'H2O': (L, 0),
+        'O2': (0, L),
+        'NO': (g_u, g_v),
+        'NO2': (g_u, g_v+0.5*L),
+        'HNO2': (g_u+0.5*L, g_v+0.25*L),
+        'HNO3': (g_u+0.5*L, g_v+0.75*L),
+        'SO2': (h_u, h_v),
+        'SO3': (h_u, h_v+0.5*L),
+        'H2SO4': (h_u+L, h_v+0.5*L),
+        'H2S': (L, -0.5*L),
+        'COS': (0, -0.5*L)
+    }
+
+    d = lambda s, i: c[s]*dl[s][i]
+    J = np.array([[2*d('H2O',i) + 2*d('H2S',i) + d('HNO2',i) + d('HNO3',i) + 2*d('H2SO4',i),
+        2*d('O2',i) + d('H2O',i) - d('COS',i) + d('NO',i) + 2*d('NO2',i) + 2*d('HNO2',i) + 3*d('HNO3',i) + 2*d('SO2',i) + 3*d('SO3',i) + 4*d('H2SO4',i)] for i in range(2)])
+
+    #[variable, equation, ...] -> [equation, variable, ...]; d(lgH2O)/dx = 42, d(lgO2)/dy = 122
+    J = np.swapaxes(J, 0, 1)
+    J[:, 0] *= 42
+    J[:, 1] *= 122
+    
+    return J
+
+#The composition of a single stream at (x, y)
+def _composition(x, y, c0, T, a_CO2):
+    c0_ = {key: np.array([c0[key]], dtype=float) for key in _elements}
     
-    return _solve(c0,T=T,a_CO2=a_CO2,**kwargs)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        c = _species_batch(np.array([x]), np.array([y]), c0_, _K_p_batch(np.array([T], dtype=float)), a_CO2, c0_['O']>=(2*c0_['S']+c0_['N']+c0_['H']/2))
     
+    return {prod: float(c[prod][0]) for prod in _products}
+
+#Evaluate the seed grid (the same one as in _solve) for many streams at once. Returns the best (x, y) of each stream.
+#counts = None or a dict, its 'evaluations' get the residual evaluations (over all streams).
+def _seed_batch(c0, K, a_CO2, oxidizing, counts=None):
+    col = lambda d: {key: value[:, None] for key, value in d.items()}
+
+    grid = np.linspace(0,1,10)
+    x0 = np.repeat(grid, len(grid))[None, :]
+    y0 = np.tile(grid, len(grid))[None, :]
+
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        q = _soe_batch(x0, y0, col(c0), col(K), a_CO2[:, None], oxidizing[:, None])
+        energies = np.nan_to_num(np.sum(np.abs(q), axis=0), nan=np.inf)
+    indx = np.argmin(energies, axis=1)
+    if counts is not None:
+        counts['evaluations'] += energies.size
+
+    return x0[0, indx], y0[0, indx]
+
+#Damped Newton with the analytic Jacobian for many streams at once, starting from (x, y).
+#Returns (x, y, sum of squared residuals, number of iterations). counts as in _seed_batch.
+def _newton_batch(x, y, c0, K, a_CO2, oxidizing, max_iter=100, max_step=0.25, rtol=1e-10, counts=None):
+    x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+
+    select = lambda rows: ({key: value[rows] for key, value in c0.items()}, {key: value[rows] for key, value in K.items()}, a_CO2[rows], oxidizing[rows])
+    def f(x, y, rows):
+        if counts is not None:
+            counts['evaluations'] += len(rows)
+        return _soe_batch(x, y, *select(rows))
+
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        rows = np.arange(len(x))
+        q = f(x, y, rows)
+        fun = np.sum(q**2, axis=0)
+        done = ~np.isfinite(fun)
+        fun_tol = (rtol*(c0['H']+c0['O']))**2                                                  #Converged relative to the total H and O
+
+        for it in range(max_iter):
+            active = rows[~done & (fun>fun_tol)]
+            if not len(active):
+                break
+
+            xa, ya, qa = x[active], y[active], q[:, active]
+            J = _jac_batch(_species_batch(xa, ya, *select(active)), oxidizing[active])          #[equation, variable, stream]
+
+            #Solve J*dp = -q for each stream (2x2 system, Cramer's rule)
+            det = J[0, 0]*J[1, 1]-J[0, 1]*J[1, 0]
+            dx = -(J[1, 1]*qa[0]-J[0, 1]*qa[1])/det
+            dy = -(J[0, 0]*qa[1]-J[1, 0]*qa[0])/det
+
+            ok = np.isfinite(dx) & np.isfinite(dy)
+            dx, dy = np.where(ok, dx, 0), np.where(ok, dy, 0)
+
+            #Limit the step length (in units of the seed grid), otherwise the powers of 10 overflow
+            scale = np.minimum(1, max_step/np.maximum(np.abs(dx), np.abs(dy)).clip(1e-300))
+            dx, dy = dx*scale, dy*scale
+
+            #Backtracking line search on the sum of squared residuals
+            step = np.ones(len(active))
+            improved = np.zeros(len(active), dtype=bool)
+            for _ in range(20):
+                xt = xa+step*dx
+                yt = ya+step*dy
+                qt = f(xt, yt, active)
+                funt = np.sum(qt**2, axis=0)
+
+                better = ~improved & (funt<fun[active])
+                x[active[better]], y[active[better]] = xt[better], yt[better]
+                q[:, active[better]] = qt[:, better]
+                fun[active[better]] = funt[better]
+                improved |= better
+
+                if np.all(improved):
+                    break
+                step = np.where(improved, step, step/2)
+
+            #Streams that can't be improved any further are done
+            done[active[~improved]] = True
+        else:
+            it = max_iter
+
+    return x, y, fun, it
+
+#Solve the system of equations for many streams at once: seed grid + damped Newton with the analytic Jacobian.
+#c0, T and a_CO2 are 1d arrays of the same length. Returns (x, y, sum of squared residuals).
+#warm = None or a dict, for streams in a sequence (a time series): every stride-th stream is seeded and the others
+#start Newton from the solution of the seeded stream before them; the first stream starts from the last solution of
+#the previous call (warm['x'], warm['y']), which is updated. The streams that don't converge are seeded.
+def _solve_batch(c0, T, a_CO2, warm=None, stride=32, **kwargs):
+    K = _K_p_batch(T)
+    oxidizing = c0['O']>=(2*c0['S']+c0['N']+c0['H']/2)
+    
+    if warm is None:
+        x, y = _seed_batch(c0, K, a_CO2, oxidizing)
+        x, y, fun, _ = _newton_batch(x, y, c0, K, a_CO2, oxidizing, **kwargs)
+        return x, y, fun
+    
+    n = len(T)
+    select = lambda rows: ({key: value[rows] for key, value in c0.items()}, {key: value[rows] for key, value in K.items()}, a_CO2[rows], oxidizing[rows])
+    x, y, fun = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.inf)
+    
+    #---------------------------The seeded streams, then the others from them---------------------------
+    anchors = np.arange(0, n, stride)
+    x[anchors], y[anchors] = _seed_batch(*select(anchors))
+    if 'x' in warm and n:
+        x[0], y[0] = warm['x'], warm['y']
+    x[anchors], y[anchors], fun[anchors], _ = _newton_batch(x[anchors], y[anchors], *select(anchors), **kwargs)
+    
+    rows = np.setdiff1d(np.arange(n), anchors)
+    x[rows], y[rows] = x[rows-rows%stride], y[rows-rows%stride]
+    x[rows], y[rows], fun[rows], _ = _newton_batch(x[rows], y[rows], *select(rows), **kwargs)
+    
+    #---------------------------Seed the streams that didn't converge---------------------------
+    rows = np.flatnonzero(~(fun<=(kwargs.get('rtol', 1e-10)*(c0['H']+c0['O']))**2))
+    if len(rows):
+        x[rows], y[rows] = _seed_batch(*select(rows))
+        x[rows], y[rows], fun[rows], _ = _newton_batch(x[rows], y[rows], *select(rows), **kwargs)
+    
+    finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(finite):
+        warm['x'], warm['y'] = float(x[finite[-1]]), float(y[finite[-1]])
+    
+    return x, y, fun
+
+#Columns of a dict of arrays or a structured array, broadcast to the same length, with default values.
+#Returns (concentration keys, columns) or -1.
+def _parse_columns(X):
+    keys = set(X.dtype.names) if isinstance(X, np.ndarray) and X.dtype.names else set(X.keys()) if isinstance(X, dict) else None
+    if keys is None:
+        print('Wrong input!')
+        return -1
+    
+    if not set(_elements) - keys:                          #True if X has {'H','N','O','S'} keys
+        concentrations = _elements
+    elif not set(_impurities) - keys:                      #True if X has {'H2O','H2S', 'O2','NO2','SO2'} keys
+        concentrations = _impurities
+    else:
+        print('Wrong input! Insufficient number of concentrations provided.')
+        return -1
+    
+    #Broadcast all columns to the same length. Add default values, if not specified
+    columns = {key: X[key] for key in concentrations}
+    for key, default in [('CO2', _a_CO2),('tot', _c_CO2),('T', 298.15)]:
+        columns[key] = X[key] if key in keys else default
+    columns = dict(zip(columns.keys(), np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=float)) for value in columns.values()])))
+    
+    return concentrations, columns
+
+#-----------------------------------------------------------Sensitivities
+#Total concentrations, temperature and activity of CO2 from columns of inputs (elements or ppmx)
+def _parse_batch(inputs):
+    if set(_elements) <= set(inputs):
+        c0 = {key: inputs[key] for key in _elements}
+    else:
+        c0 = _ppmx_to_c0({key: inputs[key] for key in _impurities}, c_tot=inputs['tot'])
+    
+    return c0, inputs['T'], inputs['CO2']
+
+#d(species)/d(inputs) at the solutions c (structured array of get_compositions) by implicit differentiation.
+#With F(x, y, inputs) = 0 the H and O balances: d(x, y)/d(inputs) = -J^-1 dF/d(inputs), J = dF/d(x, y).
+#All partial derivatives are taken by complex step (exact to round-off). Returns {species: array (n, inputs)}.
+def _sensitivities_batch(c, inputs, keys):
+    n = len(c)
+    dc = np.full((len(_products), n, len(keys)), np.nan)
+    
+    rows = np.flatnonzero(np.isin(c['status'], [_status['converged'], _status['doubtful']]) & (c['H2O']>0) & (c['O2']>0))
+    if len(rows):
+        inputs = {key: np.asarray(inputs[key], dtype=float)[rows] for key in keys}
+        x = (np.log10(c['H2O'][rows])+40)/42
+        y = (np.log10(c['O2'][rows])+120)/122
+        
+        c0, T, a_CO2 = _parse_batch(inputs)
+        oxidizing = c0['O']>=(2*c0['S']+c0['N']+c0['H']/2)
+        
+        h = 1e-30
+        def partial(dx=0, dy=0, key=None):
+            inputs_ = inputs | ({key: inputs[key]+1j*h} if key else dict())
+            c0, T, a_CO2 = _parse_batch(inputs_)
+            c_ = _species_batch(x+1j*h*dx, y+1j*h*dy, c0, _K_p_batch(T, dtype=complex), a_CO2, oxidizing)
+            return np.array([c_[prod] for prod in _products]).imag/h, _balance(c_, c0).imag/h
+        
+        with np.errstate(over='ignore', invalid='ignore'):
+            C_x, F_x = partial(dx=1)
+            C_y, F_y = partial(dy=1)
+            J = np.moveaxis(np.array([[F_x[0], F_y[0]], [F_x[1], F_y[1]]]), -1, 0)                #(n, 2, 2)
+            
+            for j, key in enumerate(keys):
+                C_k, F_k = partial(key=key)
+                dxy = -np.linalg.solve(J, F_k.T[:, :, None])[:, :, 0]                       #(n, 2)
+                dc[:, rows, j] = C_k+C_x*dxy[:, 0]+C_y*dxy[:, 1]
+    
+    return dict(zip(_products, dc))
+
+#Worker task of get_compositions(..., workers=N)
+def _get_compositions_task(inputs, outputs, **kwargs):
+    outputs['output'][:] = get_compositions(inputs, **kwargs)
+
+#-----------------------------------------------------------Continuation
+#Newton corrector for a single stream starting from (x, y). Returns (x, y, converged).
+def _correct(x, y, c0, T, a_CO2, max_iter=10, rtol=1e-8):
+    c0_ = {key: np.array([c0[key]], dtype=float) for key in _elements}
+    oxidizing = c0_['O']>=(2*c0_['S']+c0_['N']+c0_['H']/2)
+    
+    x, y, fun, it = _newton_batch([x], [y], c0_, _K_p_batch(np.array([T], dtype=float)), np.array([a_CO2], dtype=float), oxidizing, max_iter=max_iter)
+    
+    return x[0], y[0], bool(fun[0]<=(rtol*(c0['H']+c0['O']))**2 and it<max_iter)
+
+#Solve at value v1 of the parameter, starting from the converged points in history [(v, x, y), ...].
+#The predictor is a secant through the last two points. When the corrector fails, the step is halved.
+def _continue(parse, history, v1, depth=0, max_depth=6):
+    v0, x0, y0 = history[-1]
+    c0, T, a_CO2 = parse(v1)
+    
+    #Predictor
+    x, y = x0, y0
+    if len(history)>1 and history[-2][0]!=v0:
+        v_, x_, y_ = history[-2]
+        x = x0+(x0-x_)*(v1-v0)/(v0-v_)
+        y = y0+(y0-y_)*(v1-v0)/(v0-v_)
+    
+    #Corrector
+    x, y, converged = _correct(x, y, c0, T, a_CO2)
+    if converged:
+        history.append((v1, x, y))
+        return True
+    
+    #Step control
+    if depth<max_depth:
+        vm = (v0+v1)/2
+        if _continue(parse, history, vm, depth=depth+1, max_depth=max_depth):
+            return _continue(parse, history, v1, depth=depth+1, max_depth=max_depth)
+    
+    return False
+
+#The body of get_composition, called through the cache
+def _get_composition(x0,with_sensitivities=False,**kwargs):
+    
+    if kwargs.get('method', 'nelder-mead') not in _methods:
+        print('Wrong input! Unknown method.')
+        return -1
+    
+    parsed = _parse_input(x0)
+    if parsed == -1:
+        return -1
+    c0, T, a_CO2 = parsed
+        
+    sol = _solve(c0,T=T,a_CO2=a_CO2,**kwargs)
+    c = {key: float(c) for key,c in sol.items()}
+    
+    if not with_sensitivities:
+        return c
+    
+    #The same inputs as in _parse_input, with the default values
+    keys = _input_keys(_elements if not set(_elements) - set(x0.keys()) else _impurities)
+    inputs = {key: [float(({'CO2': _a_CO2, 'tot': _c_CO2, 'T': 298.15} | x0)[key])] for key in keys}
+    
+    output = np.zeros(1, dtype=_dtype)
+    for prod in _products:
+        output[prod] = c[prod]
+    output['status'] = _status['converged'] if sum(c.values()) else _status['oxygen too low']
+    
+    dc = _sensitivities_batch(output, inputs, keys)
+    
+    return c, {prod: {key: float(dc[prod][0, j]) for j, key in enumerate(keys)} for prod in _products}
+
 #===================================================================================================================
 #---------------------------------------------------------------------------------------Public methods
 #===================================================================================================================
-def get_composition(x0,**kwargs):
+def get_composition(x0,cache=False,stats=None,**kwargs):
     '''x0 = {
         'H': total hydrogen concentration in [mM], 
         'N': total nitrogen concentration in [mM], 
@@ -136,36 +757,309 @@ def get_composition(x0,**kwargs):
         'CO2': activity of CO2 in [mM],
         'tot': total concentration of all species [mM],
         'T': temperature in [K]
-    }'''
+    }
+    
+    method = 'nelder-mead' (default), 'newton' (Newton with the analytic Jacobian, falls back to 'nelder-mead') or
+    'log' (Nelder-Mead on the log residuals with a tight tolerance)
+    
+    cache = False (default), True (in memory and on disk, in ~/.cache/ccstoolkit or $CCSTOOLKIT_CACHE_DIR) or
+    {'path': sqlite file, 'maxsize': results in memory, 'max_bytes': size on disk, 'digits': significant digits of the inputs}
+    
+    with_sensitivities = False (default) or True: returns (composition, sensitivities) with
+    sensitivities = {species: {input: d(species)/d(input)}} for the inputs of x0 (and 'CO2', 'tot', 'T'),
+    by implicit differentiation of the balances at the solution
+    
+    stats = None (default) or a function called after the solve with a dict {
+        'path': 'newton', 'nelder-mead', 'log', 'global', 'doubtful', 'failed' or 'oxygen too low', 
+        'branch': 'oxidizing', 'reducing' or None, 
+        'time': total time in [s], 
+        'seed time': time of the seed grid in [s], 
+        'iterations': local solver iterations, 
+        'evaluations': residual evaluations (the Newton solve and its fallback), 
+        'residual': final sum of squared residuals of the H and O balances, 
+        'global': True if differential evolution ran, 
+        'global time': time of differential evolution in [s]
+    }
+    Cache hits are not solved and not reported.'''
+    
+    #The callback is not part of the cache key
+    return _cache._cached('eqstreamcomp.get_composition', functools.partial(_get_composition, stats=stats), x0, cache, **kwargs)
+
+#An awaitable get_composition for asyncio applications
+async def aget_composition(x0,timeout=None,**kwargs):
+    '''x0 = the same as in get_composition
+    
+    timeout = None (default) or deadline in [s]; raises asyncio.TimeoutError
+    
+    kwargs = the same as in get_composition, except stats
+    
+    The solve runs in a pool of worker processes ($CCSTOOLKIT_ASYNC_WORKERS, default the number of CPUs), so the event
+    loop is not blocked, and nothing is printed. Identical requests in flight are solved once. At most
+    $CCSTOOLKIT_ASYNC_MAX_PENDING (default 64) distinct requests are submitted at once, the others wait for a free slot.
+    A cancelled request is dropped from the pool if no other request waits for it and it hasn't started yet.'''
+    
+    if kwargs.get('stats') is not None:
+        print('Wrong input! stats is not supported by aget_composition.')
+        return -1
+    
+    return await _async._submit(__name__+'.get_composition', x0, kwargs, timeout=timeout)
+
+#A function that returns the equilibrium compositions along a path in one of the inputs
+def get_composition_path(x0,param='T',values=(),**kwargs):
+    '''x0 = the same as in get_composition
+    
+    param = the key of x0 that changes along the path, e.g. 'T', 'CO2', 'tot', 'H' or 'SO2'
+    
+    values = the values of x0[param] along the path
+    
+    Each point is warm-started from the previous ones. When the oxygen excess flips the sulphur speciation
+    between the oxidizing and the reducing branch, the solver is re-seeded. Returns a list of compositions
+    (-1 for wrong input) in the order of values.'''
     
     if not isinstance(x0, dict):
         print('Wrong input!')
         return -1
+    
+    parse = lambda v: _parse_input(x0 | {param: float(v)})
+    
+    compositions = list()
+    history = list()                                       #Converged points [(value, x, y), ...] on the current branch
+    branch = None
+    for v in values:
+        parsed = parse(v)
+        if parsed == -1:
+            compositions.append(-1)
+            history = list()
+            continue
+        c0, T, a_CO2 = parsed
         
-    #Add default values, if not specified
-    for key, default in [('CO2', 2e3),('tot', 18.55e3),('T', 298.15)]:
-        if key not in x0:
-            x0 = x0 | {key: default}
+        #Outside of the studied range
+        if c0['O']<c0['H']/2+c0['N']-c0['S']:
+            compositions.append({key: float(c) for key,c in _solve(c0,T=T,a_CO2=a_CO2,**kwargs).items()})
+            history = list()
+            continue
         
-    if not set(_elements) - set(x0.keys()):               #True if x has {'H','N','O','S'} keys
-        for key in _elements:
-            if not _domain[key]['min'] <= x0[key] <= _domain[key]['max']:
-                print(f'Wrong input! {key} outside of range.')
-                return -1
-                
-        sol = _solve(x0,T=x0['T'],a_CO2=x0['CO2'],**kwargs)
+        #Re-seed when the branch flips
+        oxidizing = c0['O']>=(2*c0['S']+c0['N']+c0['H']/2)
+        if oxidizing!=branch:
+            history = list()
+            branch = oxidizing
         
-    elif not set(_impurities) - set(x0.keys()):           #True if x has {'H2O','H2S', 'O2','NO2','SO2'} keys
+        if not (history and _continue(parse, history, float(v))):
+            #No previous point or the continuation failed: full solve
+            sol = _solve(c0,T=T,a_CO2=a_CO2,**({'method': 'newton'} | kwargs))
+            compositions.append({key: float(c) for key,c in sol.items()})
+            
+            history = [(float(v), (np.log10(sol['H2O'])+40)/42, (np.log10(sol['O2'])+120)/122)] if sol['H2O']>0 and sol['O2']>0 else list()
+            continue
+        
+        _, x, y = history[-1]
+        compositions.append(_composition(x, y, c0, T, a_CO2))
+        history = history[-2:]
     
-        for key in _impurities:
-            if not _domain[key]['min'] <= x0[key] <= _domain[key]['max']:
-                print(f'Wrong input! {key} outside of range.')
-                return -1
-                
-        sol = _solve_ppmx(x0,T=x0['T'],a_CO2=x0['CO2'],**kwargs)
-    else:
-        print('Wrong input! Insufficient number of concentrations provided.')
+    return compositions
+    
+
+#A function that returns the equilibrium composition of many streams at once
+def get_compositions(X,workers=None,with_sensitivities=False,warm_start=False,**kwargs):
+    '''X = {
+        'H': array of total hydrogen concentrations in [mM], 
+        'N': array of total nitrogen concentrations in [mM], 
+        'O': array of total oxygen concentrations in [mM], 
+        'S': array of total sulphur concentrations in [mM],
+        'CO2': array of activities of CO2 in [mM],
+        'T': array of temperatures in [K]
+    }
+    
+    X = {
+        'H2O': array of concentrations in [ppmx], 
+        'H2S': array of concentrations in [ppmx], 
+        'O2': array of concentrations in [ppmx], 
+        'NO2': array of concentrations in [ppmx], 
+        'SO2': array of concentrations in [ppmx],
+        'CO2': array of activities of CO2 in [mM],
+        'tot': array of total concentrations of all species [mM],
+        'T': array of temperatures in [K]
+    }
+    
+    X can be a dict of arrays or a structured array. 'CO2', 'tot' and 'T' are optional and can be scalars.
+    
+    workers = number of worker processes (default None, i.e. solve in this process)
+    
+    with_sensitivities = False (default) or True: returns (compositions, sensitivities) with
+    sensitivities = {species: structured array with one field per input, d(species)/d(input)}, NaN where not solved
+    
+    warm_start = False (default), True or a dict: the streams are a sequence (e.g. a time series) and Newton starts
+    from the solution of an earlier stream instead of the seed grid, which is used only every 32 streams and where
+    Newton fails. A dict keeps the last solution between calls (e.g. chunks of a stream; not with workers).
+    
+    Returns a structured array with one field per species in [mM] and a 'status' field:
+        0 - converged
+        1 - convergence doubtful
+        2 - oxygen too low, outside of the studied range
+        3 - input outside of the domain
+        4 - missing input (NaN)'''
+    
+    parsed = _parse_columns(X)
+    if parsed == -1:
         return -1
+    concentrations, columns = parsed
+    n = len(columns['T'])
+    
+    if with_sensitivities:
+        output = get_compositions(columns, workers=workers, warm_start=warm_start, **kwargs)
+        keys = _input_keys(concentrations)
+        dc = _sensitivities_batch(output, columns, keys)
+        
+        dtype = np.dtype([(key, float) for key in keys])
+        return output, {prod: np.ascontiguousarray(value).view(dtype)[:, 0] for prod, value in dc.items()}
+    
+    #The streams are split between the workers through shared memory
+    if workers is not None and workers>1 and n>1:
+        return _parallel._map(__name__+'._get_compositions_task', columns, {'output': ((n,), _dtype)}, n, workers, (__name__,), kwargs=kwargs|{'warm_start': bool(warm_start)})['output']
+    
+    #---------------------------Validate with masks---------------------------
+    status = np.full(n, _status['converged'], dtype=np.int8)
+    
+    for key in _input_keys(concentrations):
+        status[~((_domain[key]['min'] <= columns[key]) & (columns[key] <= _domain[key]['max']))] = _status['outside domain']
+    
+    status[np.any([np.isnan(value) for value in columns.values()], axis=0)] = _status['missing']
+    
+    #---------------------------Total concentrations---------------------------
+    if concentrations is _impurities:
+        c0 = _ppmx_to_c0({key: columns[key] for key in _impurities},c_tot=columns['tot'])
+    else:
+        c0 = {key: columns[key] for key in _elements}
+    
+    with np.errstate(invalid='ignore'):
+        status[(status==_status['converged']) & (c0['O']<c0['H']/2+c0['N']-c0['S'])] = _status['oxygen too low']
+    
+    #---------------------------Solve---------------------------
+    output = np.zeros(n, dtype=_dtype)
+    output['status'] = status
+    
+    rows = np.flatnonzero(status==_status['converged'])
+    if not len(rows):
+        return output
+    
+    c0 = {key: value[rows] for key, value in c0.items()}
+    T = columns['T'][rows]
+    a_CO2 = columns['CO2'][rows]
+    
+    x, y, fun = _solve_batch(c0, T, a_CO2, warm=warm_start if isinstance(warm_start, dict) else dict() if warm_start else None)
+    
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        c = _species_batch(x, y, c0, _K_p_batch(T), a_CO2, c0['O']>=(2*c0['S']+c0['N']+c0['H']/2))
+    for prod in _products:
+        output[prod][rows] = c[prod]
+    
+    #Streams that did not converge are passed to the Nelder-Mead single stream solver
+    for i in np.flatnonzero(~(fun<=1e-4)):
+        c0_i = {key: float(value[i]) for key, value in c0.items()}
+        c_i = _solve(c0_i, T=float(T[i]), a_CO2=float(a_CO2[i]), **({'verbose': False} | kwargs | {'method': 'nelder-mead'}))
+        
+        for prod in _products:
+            output[prod][rows[i]] = c_i[prod]
         
-    return {key: float(c) for key,c in sol.items()}
+        if not np.sum(_balance(c_i, c0_i)**2)<=1e-4:
+            output['status'][rows[i]] = _status['doubtful']
+    
+    return output
+
+#A function that returns the uncertainty of the equilibrium composition due to the uncertainty of the TD data
+def get_composition_uncertainty(x0,n=1000,ci=0.95,sigma=None,seed=None):
+    '''x0 = the same as in get_composition
+    
+    n = number of Monte Carlo samples of the TD data (default 1000)
+    
+    ci = probability of the confidence intervals (default 0.95)
+    
+    sigma = None (default) or {substance: {'dfg': [kJ/mol], 'dfh': [kJ/mol], 'cp': [J/mol/K]}}, standard uncertainties
+    that replace the defaults (1 kJ/mol for dfg and dfh, 5% of cp and 30 J/mol/K where cp is missing)
+    
+    seed = seed of the random numbers (default None)
+    
+    The samples of dfg, dfh and cp are propagated to lgK_p of the reactions and all samples are solved at once.
+    
+    Returns {
+        species: {'mean': ..., 'std': ..., 'median': ..., 'low': ..., 'high': ...} in [mM], 
+        'samples': number of samples that converged
+    }'''
+    
+    if not (isinstance(n, int) and n>0 and 0<ci<1):
+        print('Wrong input! n must be a positive integer and 0 < ci < 1.')
+        return -1
+    
+    parsed = _parse_input(x0)
+    if parsed == -1:
+        return -1
+    c0, T, a_CO2 = parsed
+    
+    if c0['O']<c0['H']/2+c0['N']-c0['S']:
+        print('Oxygen too low, outside of the studied range.')
+        return -1
+    
+    #Perturbed equilibrium constants, one row per sample
+    deltas = _uncertainty._sample(n, sigma=sigma, seed=seed)
+    dlgK = _uncertainty._dlgK(_reactions, deltas, T)
+    K = {key: value*10**dlgK[key] for key, value in _K_p_batch(np.full(n, T, dtype=float)).items()}
+    
+    c0 = {key: np.full(n, value, dtype=float) for key, value in c0.items()}
+    a_CO2 = np.full(n, a_CO2, dtype=float)
+    oxidizing = c0['O']>=(2*c0['S']+c0['N']+c0['H']/2)
+    
+    x, y = _seed_batch(c0, K, a_CO2, oxidizing)
+    x, y, fun, _ = _newton_batch(x, y, c0, K, a_CO2, oxidizing)
+    
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        c = _species_batch(x, y, c0, K, a_CO2, oxidizing)
+    converged = fun<=1e-4
+    
+    return {prod: _uncertainty._interval(c[prod][converged], ci) for prod in _products} | {'samples': int(np.sum(converged))}
+
+#A function that returns how often each path of the solver has been taken
+def get_solver_counts(reset=False):
+    '''Returns {
+        'oxygen too low': outside of the studied range, 
+        'newton': solved by Newton, 
+        'nelder-mead': solved by Nelder-Mead, 
+        'log': solved by Nelder-Mead on the log residuals, 
+        'global': local solve failed, solved by differential evolution, 
+        'doubtful': differential evolution did not converge either, 
+        'failed': the solver did not finish
+    }
+    
+    Counts every call of the single stream solver since the import (or the last reset=True).'''
+    
+    counts = dict(_counts)
+    
+    if reset:
+        for key in _counts:
+            _counts[key] = 0
+    
+    return counts
+
+#A function that returns the totals over all single stream solves
+def get_solver_stats(reset=False):
+    '''Returns {
+        'solves': number of solves, 
+        'time': total time in [s], 
+        'seed time': total time of the seed grids in [s], 
+        'global time': total time of differential evolution in [s], 
+        'iterations': total local solver iterations, 
+        'evaluations': total residual evaluations, 
+        'oxidizing': solves on the oxidizing branch, 
+        'reducing': solves on the reducing branch, 
+        'paths': the same as get_solver_counts()
+    }
+    
+    Totals since the import (or the last reset=True). Use get_composition(..., stats=f) for each solve.'''
+    
+    stats = dict(_totals) | {'paths': get_solver_counts(reset=reset)}
+    
+    if reset:
+        for key in _totals:
+            _totals[key] = 0
     
+    return stats
@@ -5,6 +5,9 @@
 #===================================================================================================================
 from . import _reactions
 import ccstoolkit.common._line_logic as _line_logic
+import ccstoolkit.common._topology as _topology
+import ccstoolkit.common._point_location as _point_location
+import ccstoolkit.common._raster as _raster
 
 _bounds = _reactions.get_bounds()
 _domain = _reactions.get_domain()
@@ -32,21 +35,16 @@ def _parse_region_names(regions: dict):
     return regions
 
 #Get regions with names
-def _get_regions_with_names(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
-    return _parse_region_names(_line_logic._get_regions(lines, P, x_bounds, y_bounds))
-    
-#===================================================================================================================
-#---------------------------------------------------------------------------------------Public methods
-#===================================================================================================================
-#A function that returns the stability map for a given composition
-def get_stability_map(P: dict):
-    '''P = {
-        'S': total sulphur concentration in [mM], 
-        'N': total nitrogen concentration in [mM], 
-        'CO2': activity of CO2 in [mM], 
-        'T': temperature in [K]
-    }'''
-    
+def _get_regions_with_names(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple, incremental=False):
+    get_regions = _topology._get_regions_incremental if incremental else _line_logic._get_regions
+    return _parse_region_names(get_regions(lines, P, x_bounds, y_bounds))
+
+#Names of the regions with the given bounds ids. Returns [(index of the region, name)].
+def _get_names(bounds_ids: tuple):
+    return [(f, region['name']) for f, region in enumerate(_parse_region_names([{'bounds ids': list(ids)} for ids in bounds_ids]))]
+
+#P with the default values, -1 if it is not valid
+def _parse_P(P: dict):
     if not isinstance(P, dict):
         print('Wrong input!')
         return -1
@@ -65,5 +63,60 @@ def get_stability_map(P: dict):
             print(f'Wrong input! {key} outside of range.')
             return -1
     
-    return _get_regions_with_names(_lines, P, _bounds['x'], _bounds['y'])
+    return P
+    
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Public methods
+#===================================================================================================================
+#A function that returns the stability map for a given composition
+def get_stability_map(P: dict, incremental=False):
+    '''P = {
+        'S': total sulphur concentration in [mM], 
+        'N': total nitrogen concentration in [mM], 
+        'CO2': activity of CO2 in [mM], 
+        'T': temperature in [K]
+    }
+    
+    incremental = False (default) or True: keep the topology of the map from the previous call and only update the
+    coordinates, while the active lines and the order of the vertices don't change. The same result.'''
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
+    return _get_regions_with_names(_lines, P, _bounds['x'], _bounds['y'], incremental)
 
+#A function that returns the regions of points of the stability map for a given composition
+def classify_stability_points(P: dict, xs, ys):
+    '''P = the same as in get_stability_map
+    
+    xs = array of lg(a_H2O), ys = array of lg(a_O2) (the axes of the map), broadcast against each other
+    
+    Returns an array of the names of the regions of the points, '' outside of the map. The map is indexed once
+    per P (slab decomposition), the points are located by a binary search.'''
+    
+    index = _point_location._get_index(__name__, get_stability_map, P)
+    if isinstance(index, int):
+        return index
+    
+    return _point_location._classify(index, xs, ys)
+
+#A function that returns the stability map as a raster of labels
+def get_stability_map_raster(P: dict, width=512, height=512):
+    '''P = the same as in get_stability_map
+    
+    width, height = number of pixels along lg(a_H2O) and lg(a_O2) (default 512 x 512)
+    
+    Returns {'labels': uint8 array (height, width), 'names': [...], 'x': array (width,), 'y': array (height,)}:
+    labels[i, j] is the index in names ('' first) of the region at the centre of the pixel (x[j], y[i]), the top row
+    first. The labels are found from the lines and their rules, without the polygons of the regions.'''
+    
+    if not (isinstance(width, int) and isinstance(height, int) and width>0 and height>0):
+        print('Wrong input! The width and the height must be positive integers.')
+        return -1
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
+    return _raster._rasterize(_lines, P, _bounds['x'], _bounds['y'], _get_names, width, height)
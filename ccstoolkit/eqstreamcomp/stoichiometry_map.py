@@ -5,6 +5,8 @@
 #===================================================================================================================
 from . import _stoichiometry
 import ccstoolkit.common._line_logic as _line_logic
+import ccstoolkit.common._point_location as _point_location
+import ccstoolkit.common._raster as _raster
 
 _bounds = _stoichiometry.get_bounds()
 _domain = _stoichiometry.get_domain()
@@ -38,16 +40,14 @@ def _parse_region_names(regions: dict):
 #Get regions with names
 def _get_regions_with_names(lines: dict, P: dict, x_bounds: tuple, y_bounds: tuple):
     return _parse_region_names(_line_logic._get_regions(lines, P, x_bounds, y_bounds))
-    
-#===================================================================================================================
-#---------------------------------------------------------------------------------------Public methods
-#===================================================================================================================
-#A function that returns stoichiometric map for a given composition
-def get_stoichiometry_map(P: dict):
-    '''P = {
-        'N/S': ratio of the nitrogen and sulphur concentrations
-    }'''
-    
+
+#Names of the explored regions with the given bounds ids. Returns [(index of the region, name)].
+def _get_names(bounds_ids: tuple):
+    regions = _parse_region_names([{'bounds ids': list(ids)} for ids in bounds_ids])
+    return [(f, region['name']) for f, region in enumerate(regions) if region['name']!='COS+H2O+H2S+NO']
+
+#P with the default values, -1 if it is not valid
+def _parse_P(P: dict):
     if not isinstance(P, dict):
         print('Wrong input!')
         return -1
@@ -62,8 +62,58 @@ def get_stoichiometry_map(P: dict):
             print(f'Wrong input! {key} outside of range.')
             return -1
     
+    return P
+    
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Public methods
+#===================================================================================================================
+#A function that returns stoichiometric map for a given composition
+def get_stoichiometry_map(P: dict):
+    '''P = {
+        'N/S': ratio of the nitrogen and sulphur concentrations
+    }'''
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
     regions = _get_regions_with_names(_lines, {'N': P['N/S'], 'S': 1}, _bounds['x'], _bounds['y'])
     
     #The region designated as 'COS+H2O+H2S+NO' is unexplored!
     return [region for region in regions if region['name']!='COS+H2O+H2S+NO']
 
+#A function that returns the regions of points of the stoichiometric map for a given composition
+def classify_stoichiometry_points(P: dict, xs, ys):
+    '''P = the same as in get_stoichiometry_map
+    
+    xs, ys = arrays of the coordinates of the points (the axes of the map), broadcast against each other
+    
+    Returns an array of the names of the regions of the points, '' outside of the map or of the explored regions.
+    The map is indexed once per P (slab decomposition), the points are located by a binary search.'''
+    
+    index = _point_location._get_index(__name__, get_stoichiometry_map, P)
+    if isinstance(index, int):
+        return index
+    
+    return _point_location._classify(index, xs, ys)
+
+#A function that returns the stoichiometric map as a raster of labels
+def get_stoichiometry_map_raster(P: dict, width=512, height=512):
+    '''P = the same as in get_stoichiometry_map
+    
+    width, height = number of pixels along the axes of the map (default 512 x 512)
+    
+    Returns {'labels': uint8 array (height, width), 'names': [...], 'x': array (width,), 'y': array (height,)}:
+    labels[i, j] is the index in names ('' first, outside of the explored regions) of the region at the centre of the
+    pixel (x[j], y[i]), the top row first. The labels are found from the lines and their rules, without the polygons of
+    the regions.'''
+    
+    if not (isinstance(width, int) and isinstance(height, int) and width>0 and height>0):
+        print('Wrong input! The width and the height must be positive integers.')
+        return -1
+    
+    P = _parse_P(P)
+    if isinstance(P, int):
+        return -1
+    
+    return _raster._rasterize(_lines, {'N': P['N/S'], 'S': 1}, _bounds['x'], _bounds['y'], _get_names, width, height)
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import itertools
+import numpy as np
+
+from . import composition as _composition
+
+_domain = _composition._domain
+_products = _composition._products
+_elements = _composition._elements
+
+#The grid covers the elements and the temperature, all with log spacing. The activity of CO2 is fixed.
+#The table holds the solution (x, y) = (lgH2O, lgO2) scaled as in the solver; all species follow from it exactly.
+_axes = ['H','N','O','S','T']
+_channels = ['x','y']
+
+_dtype = np.dtype(_composition._dtype.descr+[('error', float)])
+
+_tables = dict()
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Private methods
+#===================================================================================================================
+def _grid(shape: tuple):
+    return [np.logspace(np.log10(_domain[key]['min']), np.log10(_domain[key]['max']), n) for key, n in zip(_axes, shape)]
+
+#The table is memory-mapped and kept open between calls, together with its grid
+def _load(path: str):
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _tables:
+        table = np.load(path, mmap_mode='r')
+        _tables[key] = (table, _grid(table.shape[:len(_axes)]))
+    return _tables[key]
+
+#Multilinear interpolation in log space of the nodes around each stream. u are the fractional grid indices.
+#Nodes without a solution (oxygen too low, not converged) are NaN and are left out; the weights of the others are
+#renormalized. Streams without any solved node around them get NaN.
+def _interpolate(table: np.ndarray, u: np.ndarray):
+    shape = np.array(table.shape[:len(_axes)])
+
+    i = np.clip(np.floor(u).astype(int), 0, shape-2)
+    t = u-i
+
+    #All 2^5 corners of the cells at once
+    corners = np.array(list(itertools.product([0,1], repeat=len(_axes))))
+    nodes = table.reshape(-1, len(_channels))[np.ravel_multi_index(tuple(np.moveaxis(i[:, None, :]+corners, -1, 0)), shape)]
+    weights = np.prod(np.where(corners, t[:, None, :], 1-t[:, None, :]), axis=2)*np.all(np.isfinite(nodes), axis=2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xy = np.einsum('ij,ijk->ik', weights, np.nan_to_num(nodes))/np.sum(weights, axis=1)[:, None]
+
+    return xy[:, 0], xy[:, 1]
+
+#One Newton correction of the solutions (x, y): the corrected solutions, the species at them and the largest relative
+#change of a species. The step is not damped, so a solution far from the root gets a large change (inf if the
+#Jacobian is singular or the species overflow); a small residual alone doesn't bound the error of the species.
+def _correct(x, y, c0, K, a_CO2, oxidizing):
+    c = _composition._species_batch(x, y, c0, K, a_CO2, oxidizing)
+    q = _composition._balance(c, c0)
+    J = _composition._jac_batch(c, oxidizing)
+
+    det = J[0, 0]*J[1, 1]-J[0, 1]*J[1, 0]
+    x1 = x-(J[1, 1]*q[0]-J[0, 1]*q[1])/det
+    y1 = y-(J[0, 0]*q[1]-J[1, 0]*q[0])/det
+    c1 = _composition._species_batch(x1, y1, c0, K, a_CO2, oxidizing)
+
+    change = np.array([np.where(c1[prod]==c[prod], 0, np.abs(c1[prod]-c[prod])/np.maximum(np.abs(c[prod]), np.abs(c1[prod]))) for prod in _products])
+    return x1, y1, c1, np.max(np.nan_to_num(change, nan=np.inf), axis=0)
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Public methods
+#===================================================================================================================
+#A function that precomputes the compositions on a grid over the domain and saves them as an array file
+def build_surrogate(path, n=15, workers=None):
+    '''path = file to save the table in (.npy)
+
+    n = number of grid points along each of 'H', 'N', 'O', 'S' and 'T' (log spacing), e.g. 15 or {'H': 20, 'T': 5, ...}
+
+    workers = number of worker processes (default None)
+
+    The activity of CO2 is fixed to the default value. Returns the path.'''
+
+    shape = tuple(n.get(key, 15) if isinstance(n, dict) else n for key in _axes)
+    if min(shape) < 2:
+        print('Wrong input! At least 2 grid points are needed along each axis.')
+        return -1
+
+    nodes = np.meshgrid(*_grid(shape), indexing='ij')
+    X = {key: value.ravel() for key, value in zip(_axes, nodes)}
+
+    c = _composition.get_compositions(X, workers=workers, verbose=False)
+
+    table = np.full((len(c), len(_channels)), np.nan, dtype=np.float32)
+    rows = c['status']==_composition._status['converged']
+    table[rows, 0] = (np.log10(c['H2O'][rows])+40)/42
+    table[rows, 1] = (np.log10(c['O2'][rows])+120)/122
+
+    np.save(path, table.reshape(shape+(len(_channels),)))
+
+    return path
+
+#A function that returns the compositions interpolated from a table of build_surrogate
+def get_compositions_surrogate(X, path, tol=1e-2, polish=2, workers=None, **kwargs):
+    '''X = the same as in get_compositions
+
+    path = file saved by build_surrogate
+
+    tol = largest accepted relative change of a species in one Newton correction of the interpolated composition
+    (default 1e-2)
+
+    polish = number of Newton steps for the streams above tol before they are passed to the exact solver (default 2)
+
+    workers = number of worker processes for the exact solver (default None)
+
+    The composition interpolated from the nodes around a stream is corrected by one Newton step and accepted if no
+    species changes by more than tol. Nodes without a solution are left out of the interpolation (the weights of the
+    others are renormalised). Streams with a non-default activity of CO2, outside of the domain, without any solved
+    node around them or not accepted are solved exactly (get_compositions).
+
+    Returns a structured array as get_compositions with an additional 'error' field: the largest relative change of
+    a species in the last Newton correction (0 for the streams solved exactly)'''
+
+    parsed = _composition._parse_columns(X)
+    if parsed == -1:
+        return -1
+    concentrations, columns = parsed
+    n = len(columns['T'])
+
+    table, grids = _load(path)
+
+    #---------------------------Total concentrations---------------------------
+    if concentrations is _composition._impurities:
+        c0 = _composition._ppmx_to_c0({key: columns[key] for key in concentrations}, c_tot=columns['tot'])
+    else:
+        c0 = {key: columns[key] for key in concentrations}
+
+    values = c0 | {'T': columns['T']}
+
+    #---------------------------Streams covered by the table---------------------------
+    inside = np.isclose(columns['CO2'], _composition._a_CO2) & (columns['tot']>=_domain['tot']['min'])
+    for key in concentrations:
+        inside &= (_domain[key]['min'] <= columns[key]) & (columns[key] <= _domain[key]['max'])
+    for key, grid in zip(_axes, grids):
+        inside &= (grid[0] <= values[key]) & (values[key] <= grid[-1])
+    with np.errstate(invalid='ignore'):
+        inside &= c0['O']>=c0['H']/2+c0['N']-c0['S']
+
+    output = np.zeros(n, dtype=_dtype)
+
+    #---------------------------Interpolate---------------------------
+    rows = np.flatnonzero(inside)
+    if len(rows):
+        u = np.stack([(np.log10(values[key][rows])-np.log10(grid[0]))/(np.log10(grid[-1])-np.log10(grid[0]))*(len(grid)-1) for key, grid in zip(_axes, grids)], axis=1)
+        x, y = _interpolate(table, u)
+
+        c0_ = {key: c0[key][rows] for key in _elements}
+        K = _composition._K_p_batch(values['T'][rows])
+        a_CO2 = columns['CO2'][rows]
+        oxidizing = c0_['O']>=(2*c0_['S']+c0_['N']+c0_['H']/2)
+
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            _, _, c, error = _correct(x, y, c0_, K, a_CO2, oxidizing)
+
+            #A few Newton steps from the interpolated solution for the streams above the tolerance
+            redo = np.flatnonzero(np.isfinite(x) & np.isfinite(y) & (error>tol))
+            if polish and len(redo):
+                select = lambda d: {key: value[redo] for key, value in d.items()}
+                x[redo], y[redo], _, _ = _composition._newton_batch(x[redo], y[redo], select(c0_), select(K), a_CO2[redo], oxidizing[redo], max_iter=polish)
+
+                _, _, c_, error[redo] = _correct(x[redo], y[redo], select(c0_), select(K), a_CO2[redo], oxidizing[redo])
+                for prod in _products:
+                    c[prod][redo] = c_[prod]
+
+        accepted = error<=tol
+        for prod in _products:
+            output[prod][rows[accepted]] = c[prod][accepted]
+        output['error'][rows[accepted]] = error[accepted]
+
+        inside[rows[~accepted]] = False
+
+    #---------------------------Exact solver for the rest---------------------------
+    rows = np.flatnonzero(~inside)
+    if len(rows):
+        exact = _composition.get_compositions({key: value[rows] for key, value in columns.items()}, workers=workers, **kwargs)
+        for key in _composition._dtype.names:
+            output[key][rows] = exact[key]
+
+    return output
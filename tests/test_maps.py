@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Import libraries
+#===================================================================================================================
+import os
+import sys
+import json
+import pytest
+import numpy as np
+
+from ccstoolkit.corrosion_maps.stability_maps import _get_stability_maps, _domain
+from ccstoolkit.eqstreamcomp import get_stability_map, get_stoichiometry_map
+
+#Regression of the regions built by _line_logic (_clip_lines, _get_faces): names, areas and bounds ids of the maps
+#compared with the stored ones. Run this file (python tests/test_maps.py) to write the fixture again.
+_fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'maps.json')
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Methods
+#===================================================================================================================
+#The compositions of the fixture: random corrosion map inputs over the domain and a sweep of the stoichiometry map
+def _compositions():
+    rng = np.random.default_rng(18)
+    n = 30
+    lg = lambda key: 10**rng.uniform(np.log10(_domain[key]['min']), np.log10(_domain[key]['max']), n)
+    Ps = {'S': lg('S'), 'N': lg('N'), 'CO2': lg('CO2'), 'T': rng.uniform(_domain['T']['min'], _domain['T']['max'], n)}
+
+    corrosion = [{key: round(float(value[i]), 6) for key, value in Ps.items()} for i in range(n)]
+    stability = [{'S': P['S'], 'N': P['N'], 'T': min(P['T'], 370.0)} for P in corrosion[:10]]
+    stoichiometry = [{'N/S': round(float(x), 6)} for x in np.linspace(0.05, 4, 10)]
+
+    return {'corrosion': corrosion, 'stability': stability, 'stoichiometry': stoichiometry}
+
+#[name, area, bounds ids] of the regions of each map of P
+def _regions(kind: str, P: dict):
+    regions = lambda rs: [[r['name'], r['area'], list(r['bounds ids'])] for r in rs]
+    if kind=='corrosion':
+        maps = _get_stability_maps(P)
+        return {key: regions(maps[key]) for key in maps}
+    if kind=='stability':
+        return {'map': regions(get_stability_map(P))}
+    return {'map': regions(get_stoichiometry_map(P))}
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Tests
+#===================================================================================================================
+#The cases are read from the fixture when the tests are collected
+def pytest_generate_tests(metafunc):
+    if metafunc.function is test_regions:
+        with open(_fixture) as f:
+            fixture = json.load(f)
+        cases = [(kind, case['P'], case['maps']) for kind in fixture for case in fixture[kind]]
+        metafunc.parametrize('kind, P, expected', cases, ids=[f'{kind}-{i}' for i, (kind, _, _) in enumerate(cases)])
+
+def test_regions(kind, P, expected):
+    maps = _regions(kind, P)
+    assert sorted(maps)==sorted(expected)
+
+    for key in expected:
+        assert [r[0] for r in maps[key]]==[r[0] for r in expected[key]], key
+        assert [r[2] for r in maps[key]]==[r[2] for r in expected[key]], key
+        assert [r[1] for r in maps[key]]==pytest.approx([r[1] for r in expected[key]], rel=1e-9, abs=1e-9), key
+
+#===================================================================================================================
+#---------------------------------------------------------------------------------------Fixture
+#===================================================================================================================
+if __name__=='__main__':
+    fixture = {kind: [{'P': P, 'maps': _regions(kind, P)} for P in Ps] for kind, Ps in _compositions().items()}
+    os.makedirs(os.path.dirname(_fixture), exist_ok=True)
+    with open(_fixture, 'w') as f:
+        json.dump(fixture, f, indent=1)
+    print(f'Written {_fixture}', file=sys.stderr)